@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
+
+from security_log_analyzer import _utc
+from span_store import MISSING, SpanStore
+
+logger = logging.getLogger(__name__)
+
+# 보안 로그 중 알림으로 전달할 심각도
+LOG_ALERT_SEVERITIES = {"high", "critical"}
+
+
+def span_alert(store: SpanStore, row: int) -> Dict:
+    """새 span 행을 /api/trace/security-alerts와 같은 형식의 알림으로 변환합니다."""
+    return {
+        "source": "trace",
+        "id": store.span_id[row],
+        "operationName": store.operation.value(row),
+        "alert": store.alert.value(row),
+        "image": store.image.value(row),
+        "commandLine": store.command_line[row],
+        "pid": store.pid.value(row),
+        "eventId": store.event_id.value(row),
+        "startTime": int(store.start_time[row]),
+        "duration": int(store.duration[row]),
+        "status": "ERROR" if store.error[row] else "OK"
+    }
+
+
+class AlertBroadcaster:
+    """trace와 security-logs 인덱스를 하나의 폴링 루프로 따라가며 새 알림을 구독자에게 전달합니다.
+
+    trace는 trace 캐시의 리스너로 등록해 새 snapshot의 컬럼에서 trace별 최고 수위(startTime) 이후 span만
+    골라내므로 문서를 따로 내려받지 않습니다. 폴링 주기마다 캐시의 버전만 확인하고, 로그는 timestamp
+    최고 수위 이후만 조회하므로 클라이언트 수와 관계없이 쿼리는 인덱스당 한 번입니다.
+    구독자가 없으면 폴링을 멈춥니다.
+    """
+
+    def __init__(self, trace_cache, log_analyzer, trace_index: str = "trace",
+                 log_index: str = "security-logs", poll_interval: float = None,
+                 queue_size: int = None):
+        self.trace_cache = trace_cache
+        self.log_analyzer = log_analyzer
+        self.trace_index = trace_index
+        self.log_index = log_index
+        self.poll_interval = poll_interval or float(os.getenv('STREAM_POLL_INTERVAL', '2'))
+        self.queue_size = queue_size or int(os.getenv('STREAM_QUEUE_SIZE', '256'))
+
+        # 시작 시점 이후의 데이터만 전달합니다 (span startTime은 마이크로초).
+        # trace 문서는 호스트별로 따로 색인되므로 수위는 traceID별로 둡니다. 처음 읽은 snapshot의 trace는
+        # 시작 시점 이후만, 그 뒤에 새로 색인된 trace는 span 시각과 관계없이 모두 전달합니다.
+        self.trace_watermarks: Dict[str, int] = {}
+        self._trace_floor = int(time.time() * 1_000_000)
+        self.trace_watermark = self._trace_floor
+        self.log_watermark = _utc(datetime.now(timezone.utc)).isoformat()
+        # 같은 timestamp의 로그를 중복 전달하지 않도록 최고 수위 시점에 본 문서 ID를 보관합니다.
+        self._log_ids_at_watermark: Set[str] = set()
+        # 리스너(스레드 풀)가 만든 trace 알림과 변화량. 다음 폴링에서 이벤트 루프가 전달합니다.
+        self._trace_pending: List[Tuple[List[Dict], Dict]] = []
+        self._trace_lock = threading.Lock()
+
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.polls = 0
+        self.dropped = 0
+
+    def subscribe(self) -> asyncio.Queue:
+        """새 구독자 큐를 등록하고, 필요하면 폴링 루프를 시작합니다."""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> Dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "polls": self.polls,
+            "dropped": self.dropped,
+            "traceWatermark": self.trace_watermark,
+            "logWatermark": self.log_watermark
+        }
+
+    def publish(self, event: str, data: Dict):
+        """모든 구독자에게 이벤트를 보냅니다. 큐가 가득 찬 느린 구독자는 오래된 이벤트를 버립니다."""
+        message = {"event": event, "data": data}
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(message)
+
+    async def _run(self):
+        while self._subscribers:
+            try:
+                await self.poll()
+            except Exception:
+                logger.exception("스트림 폴링 오류")
+            await asyncio.sleep(self.poll_interval)
+
+    async def poll(self):
+        """trace 캐시를 갱신하고 security-logs를 한 번 조회해 알림과 메트릭 변화량을 보냅니다."""
+        self.polls += 1
+        # 인덱스가 바뀌었으면 캐시가 새 snapshot을 읽으며 on_snapshot을 호출합니다.
+        await self.trace_cache.get(self.trace_index)
+        trace_alerts, trace_delta = self._take_trace()
+        log_alerts, log_delta = await self._poll_logs()
+
+        for alert in trace_alerts + log_alerts:
+            self.publish("alert", alert)
+        if trace_delta["spans"] or log_delta["logs"]:
+            self.publish("metrics", {**trace_delta, **log_delta,
+                                     "traceWatermark": self.trace_watermark,
+                                     "logWatermark": self.log_watermark})
+
+    def on_snapshot(self, snapshot):
+        """trace 캐시 리스너입니다. 최고 수위 이후 span의 알림과 변화량을 모아 둡니다."""
+        if snapshot.index_name != self.trace_index or len(snapshot) == 0:
+            return
+        store = snapshot.store
+        with self._trace_lock:
+            rows = np.flatnonzero(store.after_watermarks(self.trace_watermarks, self._trace_floor))
+            # 처음 본 snapshot의 trace를 모두 기록했으므로 이후에 나타나는 trace는 처음부터 읽습니다.
+            for trace_id in store.trace.categories:
+                self.trace_watermarks.setdefault(trace_id, self._trace_floor)
+            self._trace_floor = -1
+            if len(rows) == 0:
+                return
+            store.advance_watermarks(rows, self.trace_watermarks)
+            self.trace_watermark = max(self.trace_watermark, int(store.start_time[rows].max()))
+            if not self._subscribers:
+                return
+            has_alert = store.alert.codes[rows] != MISSING
+            alert_rows = rows[has_alert]
+            alert_rows = alert_rows[np.argsort(store.start_time[alert_rows], kind="stable")]
+            delta = {
+                "spans": len(rows),
+                "alerts": len(alert_rows),
+                "processEvents": int(store.event_id.equals('1')[rows].sum()),
+                "fileEvents": int(store.event_id.equals('11')[rows].sum())
+            }
+            self._trace_pending.append(([span_alert(store, row) for row in alert_rows.tolist()], delta))
+
+    def _take_trace(self):
+        with self._trace_lock:
+            pending, self._trace_pending = self._trace_pending, []
+        alerts: List[Dict] = []
+        delta = {"spans": 0, "alerts": 0, "processEvents": 0, "fileEvents": 0}
+        for batch_alerts, batch_delta in pending:
+            alerts.extend(batch_alerts)
+            for key, value in batch_delta.items():
+                delta[key] += value
+        return alerts, delta
+
+    async def _poll_logs(self):
+        hits = await self.log_analyzer.logs_since(self.log_index, self.log_watermark)
+        logs = [hit for hit in hits if hit.get('_id') not in self._log_ids_at_watermark]
+        alerts: List[Dict] = []
+        severities: Dict[str, int] = {}
+        for hit in logs:
+            log = hit['_source']
+            severity = log.get('severity', '')
+            severities[severity] = severities.get(severity, 0) + 1
+            if str(severity).lower() in LOG_ALERT_SEVERITIES:
+                alerts.append({"source": "security-logs", "id": hit.get('_id'), **log})
+        if logs:
+            newest = logs[-1]['_source'].get('timestamp', self.log_watermark)
+            if newest != self.log_watermark:
+                self.log_watermark = newest
+                self._log_ids_at_watermark = set()
+            self._log_ids_at_watermark.update(
+                hit.get('_id') for hit in logs if hit['_source'].get('timestamp') == newest)
+        return alerts, {"logs": len(logs), "logsBySeverity": severities}
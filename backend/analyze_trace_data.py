@@ -8,17 +8,28 @@ import json
 import pandas as pd
 from datetime import datetime
 import os
+import sys
 from dotenv import load_dotenv
 
 load_dotenv()
 
 def main():
     # Elasticsearch 연결 (환경변수에서 설정 가져오기)
-    analyzer = TraceAnalyzer()
+    # TRACE_BACKEND=local이면 local_trace_store.py로 변환한 로컬 파일을 사용합니다.
+    if os.getenv('TRACE_BACKEND', 'elasticsearch') == 'local':
+        from local_trace_store import LocalTraceAnalyzer
+        analyzer = LocalTraceAnalyzer()
+    else:
+        analyzer = TraceAnalyzer()
     
     # 인덱스 이름 (실제 사용한 인덱스 이름으로 변경하세요)
     index_name = "trace"  # 실제 발견된 인덱스 이름
     
+    # --setup-span-fields: span 태그를 펼치는 ingest pipeline/매핑을 설정하고 기존 문서를 다시 처리
+    if '--setup-span-fields' in sys.argv:
+        print(f"span 필드 설정: {analyzer.setup_span_fields(index_name)}")
+        return
+    
     print("=== Trace 데이터 분석 시작 ===")
     
     # 1. 인덱스 상태 확인
@@ -114,8 +125,16 @@ def main():
                 for value in values[:3]:  # 처음 3개만 표시
                     print(f"     * {value}")
     
-    # 5-6번은 잠시 주석 처리
-    print("\n5-6. 고급 분석 기능은 데이터 구조 파악 후 구현 예정")
+    # 5. 클러스터 집계로 보안 패턴 분석 (nested spans 집계)
+    print("\n5. 보안 패턴 분석:")
+    patterns = analyzer.analyze_security_patterns(index_name)
+    if patterns:
+        for bucket in patterns["alert_types"]:
+            print(f"   - 알림 {bucket['key']}: {bucket['doc_count']}개")
+        for bucket in patterns["process_images"][:5]:
+            print(f"   - 프로세스 {bucket['key']}: {bucket['doc_count']}개")
+    else:
+        print("   ✗ 보안 패턴을 집계할 수 없습니다.")
     
     print("\n=== 분석 완료 ===")
     print("\n다음 단계 제안:")
@@ -0,0 +1,204 @@
+import asyncio
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from ingest_spool import _lock
+from security_log_analyzer import query_now
+
+logger = logging.getLogger(__name__)
+
+FEATURES = ['bytes', 'port']
+
+# 작업 프로세스마다 마지막으로 불러온 모델 하나만 (경로, 모델)로 보관합니다.
+_loaded_model: Tuple[Optional[str], object] = (None, None)
+
+
+def _feature_matrix(records: List[Dict]):
+    import numpy as np
+    return np.array([[record.get(name) or 0 for name in FEATURES] for record in records], dtype=float)
+
+
+def train_model(records: List[Dict], model_path: str, contamination: float = 0.1) -> Dict:
+    """IsolationForest를 학습해 model_path에 저장합니다. 작업 프로세스에서 실행됩니다."""
+    import joblib
+    from sklearn.ensemble import IsolationForest
+
+    model = IsolationForest(contamination=contamination, random_state=42)
+    model.fit(_feature_matrix(records))
+
+    temp_path = f"{model_path}.tmp"
+    joblib.dump(model, temp_path)
+    os.replace(temp_path, model_path)
+    return {"samples": len(records)}
+
+
+def score_records(model_path: str, records: List[Dict]) -> List[int]:
+    """저장된 모델로 records를 평가합니다(-1이면 이상). 작업 프로세스에서 실행됩니다."""
+    global _loaded_model
+    path, model = _loaded_model
+    if path != model_path:
+        # 재학습으로 경로가 바뀌면 이전 모델을 버리고 새 모델로 교체합니다.
+        import joblib
+        model = joblib.load(model_path)
+        _loaded_model = (model_path, model)
+    return model.predict(_feature_matrix(records)).tolist()
+
+
+class AnomalyModelManager:
+    """이상 탐지 모델을 주기적으로 학습하고, 요청은 저장된 모델로 평가만 합니다.
+
+    학습은 `train_window_hours` 동안의 로그 중 최대 `sample_size`개를 무작위로 뽑아
+    수행하며, 학습과 평가는 모두 프로세스 풀에서 실행됩니다. 여러 워커가 같은 model_dir을 쓰면
+    `train.lock` 파일 잠금을 잡은 워커 하나만 학습하고 오래된 모델을 지우며, 나머지는 latest.json을 다시 읽습니다.
+    """
+
+    def __init__(self, analyzer, index_name: str, model_dir: str = None,
+                 train_interval: float = None, train_window_hours: float = None,
+                 sample_size: int = None, workers: int = None):
+        self.analyzer = analyzer
+        self.index_name = index_name
+        self.model_dir = model_dir or os.getenv('ANOMALY_MODEL_DIR', 'models')
+        self.train_interval = train_interval or float(os.getenv('ANOMALY_TRAIN_INTERVAL', '900'))
+        self.train_window_hours = train_window_hours or float(os.getenv('ANOMALY_TRAIN_WINDOW_HOURS', '24'))
+        self.sample_size = sample_size or int(os.getenv('ANOMALY_SAMPLE_SIZE', '10000'))
+        self.workers = workers or int(os.getenv('ANOMALY_WORKERS', '2'))
+
+        self.model: Optional[Dict] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._task: Optional[asyncio.Task] = None
+        self._training: Optional[asyncio.Task] = None
+
+    def start(self):
+        """저장된 모델을 불러오고 주기적 학습 작업을 시작합니다."""
+        os.makedirs(self.model_dir, exist_ok=True)
+        # 이벤트 루프와 bulk writer 스레드가 있는 프로세스를 fork하지 않도록 spawn을 사용합니다.
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        self.model = self._load_latest()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    async def train(self) -> Optional[Dict]:
+        """학습을 한 번 수행합니다. 이미 학습 중이면 그 결과를 기다립니다."""
+        if self._training is None or self._training.done():
+            self._training = asyncio.get_running_loop().create_task(self._train())
+        return await asyncio.shield(self._training)
+
+    async def detect(self, records: List[Dict]) -> Dict:
+        """records를 현재 모델로 평가해 이상 로그와 모델 정보를 반환합니다."""
+        model = self.model or await self.train()
+        if model is None or not records:
+            return {"anomalies": [], "model": self.model_info()}
+
+        loop = asyncio.get_running_loop()
+        try:
+            predictions = await loop.run_in_executor(self._pool, score_records, model["path"], records)
+        except FileNotFoundError:
+            # 학습을 맡은 워커가 이전 모델을 지웠으면 최신 모델을 다시 읽어 평가합니다.
+            model = self.model = self._load_latest()
+            if model is None:
+                return {"anomalies": [], "model": self.model_info()}
+            predictions = await loop.run_in_executor(self._pool, score_records, model["path"], records)
+        anomalies = [record for record, prediction in zip(records, predictions) if prediction == -1]
+        return {"anomalies": anomalies, "model": self.model_info()}
+
+    def model_info(self) -> Dict:
+        """응답에 포함할 모델 버전과 최신성 정보를 반환합니다."""
+        if self.model is None:
+            return {"version": None, "stale": True}
+        age = time.time() - self.model["trained_at"]
+        return {
+            "version": self.model["version"],
+            "trainedAt": datetime.fromtimestamp(self.model["trained_at"]).isoformat(),
+            "samples": self.model["samples"],
+            "ageSeconds": round(age),
+            "stale": age > self.train_interval * 2
+        }
+
+    async def _run(self):
+        while True:
+            latest = self._load_latest()
+            if latest is not None and (self.model is None or latest["version"] > self.model["version"]):
+                self.model = latest
+            if self.model is None or time.time() - self.model["trained_at"] >= self.train_interval:
+                try:
+                    await self.train()
+                except Exception:
+                    logger.exception("이상 탐지 모델 학습 오류")
+            await asyncio.sleep(self.train_interval / 10)
+
+    async def _train(self) -> Optional[Dict]:
+        lock = self._try_lock()
+        if lock is None:
+            # 다른 워커가 학습 중이면 그 워커가 저장한 최신 모델을 따릅니다.
+            self.model = self._load_latest() or self.model
+            return self.model
+        try:
+            latest = self._load_latest()
+            if latest is not None and time.time() - latest["trained_at"] < self.train_interval:
+                # 잠금을 기다리는 동안 다른 워커가 이미 학습했습니다.
+                self.model = latest
+                return latest
+
+            end_time = query_now()
+            start_time = end_time - timedelta(hours=self.train_window_hours)
+            records = await self.analyzer.sample_logs(self.index_name, start_time, end_time, self.sample_size)
+            if not records:
+                return self.model
+
+            version = int(time.time() * 1000)
+            path = os.path.join(self.model_dir, f"anomaly-{version}.joblib")
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._pool, train_model, records, path)
+
+            model = {"version": version, "path": path, "trained_at": time.time(), "samples": result["samples"]}
+            latest_path = os.path.join(self.model_dir, "latest.json")
+            with open(f"{latest_path}.tmp", "w") as f:
+                json.dump(model, f)
+            os.replace(f"{latest_path}.tmp", latest_path)
+            self.model = model
+            self._remove_old_models(keep=2)
+            return model
+        finally:
+            # 파일을 닫으면 잠금도 풀립니다.
+            lock.close()
+
+    def _try_lock(self):
+        """학습 잠금을 기다리지 않고 잡아 파일 객체를 반환합니다. 다른 워커가 잡고 있으면 None입니다."""
+        handle = open(os.path.join(self.model_dir, "train.lock"), "a+b")
+        if not _lock(handle):
+            handle.close()
+            return None
+        return handle
+
+    def _remove_old_models(self, keep: int):
+        # 평가 중인 요청이 이전 모델을 참조할 수 있으므로 최근 모델 몇 개는 남겨 둡니다.
+        paths = sorted(glob.glob(os.path.join(self.model_dir, "anomaly-*.joblib")))
+        for path in paths[:-keep]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _load_latest(self) -> Optional[Dict]:
+        try:
+            with open(os.path.join(self.model_dir, "latest.json")) as f:
+                model = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return model if os.path.exists(model["path"]) else None
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+trace 파싱과 /api/trace/* 핸들러 벤치마크
+
+합성 Sysmon/Sigma trace를 메모리 안의 가짜 검색 클라이언트에 넣고, 각 핸들러와
+clean_cmd, 타임라인 중복 제거 로직의 지연 시간 분위수와 최대 메모리를 측정합니다.
+
+    python benchmark_trace.py --spans 50000 --output bench.json
+    python benchmark_trace.py --baseline bench.json   # p95가 기준보다 느려지면 종료 코드 1
+"""
+
+from contextlib import redirect_stdout
+from typing import Callable, Dict, List, Optional
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import numpy as np
+import orjson
+
+SIGMA_RULES = [
+    "Suspicious LNK Command-Line Padding",
+    "Non Interactive PowerShell Process Spawned",
+    "PSScriptPolicyTest Creation By Uncommon Process",
+    "Potential CommandLine Path Traversal",
+    "Suspicious Encoded PowerShell Command Line",
+    "Whoami Utility Execution"
+]
+
+IMAGES = [
+    "C:\\Windows\\explorer.exe",
+    "C:\\Windows\\System32\\cmd.exe",
+    "C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe",
+    "C:\\Windows\\System32\\svchost.exe",
+    "C:\\Windows\\System32\\rundll32.exe",
+    "C:\\Program Files\\Google\\Chrome\\Application\\chrome.exe",
+    "C:\\Users\\analyst\\AppData\\Local\\Temp\\setup.exe"
+]
+
+EVENT_NAMES = {"1": "ProcessCreate", "3": "NetworkConnect", "5": "ProcessTerminate",
+               "11": "FileCreate", "13": "RegistryEvent"}
+
+
+def generate_trace(spans: int = 10000, tags: int = 8, alert_ratio: float = 0.05, depth: int = 6,
+                   seed: int = 42, trace_id: str = "bench-trace", host: str = "DESKTOP-BENCH",
+                   base_time: int = 1_700_000_000_000_000) -> Dict:
+    """합성 Sysmon trace 문서를 만듭니다.
+
+    프로세스는 depth 단계를 넘지 않는 트리로 생성되고 가끔 종료된 PID를 재사용합니다.
+    span마다 최소 태그(이벤트 ID, PID, Image 등)에 더해 tags개가 될 때까지 추가 태그를 붙이며,
+    alert_ratio 비율의 span에 sigma.alert를 붙입니다.
+    """
+    rnd = random.Random(seed)
+    running: List[Dict] = []
+    exited: List[str] = []
+    next_pid = 1000
+    start_time = base_time
+    result = []
+
+    for index in range(spans):
+        start_time += rnd.randint(100, 5000)
+        roll = rnd.random()
+        if not running or roll < 0.2:
+            parents = [process for process in running if process["depth"] < depth - 1]
+            parent = rnd.choice(parents) if parents and rnd.random() < 0.9 else None
+            if exited and rnd.random() < 0.05:
+                pid = exited.pop(rnd.randrange(len(exited)))
+            else:
+                pid = str(next_pid)
+                next_pid += 4
+            process = {
+                "pid": pid,
+                "ppid": parent["pid"] if parent else "4",
+                "depth": parent["depth"] + 1 if parent else 0,
+                "image": rnd.choice(IMAGES)
+            }
+            running.append(process)
+            event_id = "1"
+        elif roll < 0.3:
+            process = running.pop(rnd.randrange(len(running)))
+            exited.append(process["pid"])
+            event_id = "5"
+        else:
+            process = rnd.choice(running)
+            event_id = rnd.choice(["3", "11", "11", "13"])
+
+        image = process["image"]
+        span_tags = [
+            {"key": "sysmon.event_id", "value": event_id},
+            {"key": "sysmon.pid", "value": process["pid"]},
+            {"key": "sysmon.ppid", "value": process["ppid"]},
+            {"key": "Image", "value": image},
+            {"key": "CommandLine", "value": f"\"{image}\" /c task-{rnd.randint(0, 500)} --flag {index % 7}"},
+            {"key": "User", "value": rnd.choice(["DESKTOP\\analyst", "NT AUTHORITY\\SYSTEM"])},
+            {"key": "EventName", "value": EVENT_NAMES[event_id]}
+        ]
+        for extra in range(len(span_tags), tags):
+            span_tags.append({"key": f"sysmon.field{extra}", "value": f"value-{rnd.randint(0, 1000)}"})
+        if rnd.random() < alert_ratio:
+            span_tags.append({"key": "sigma.alert", "value": rnd.choice(SIGMA_RULES)})
+            if rnd.random() < 0.2:
+                span_tags.append({"key": "error", "value": True})
+
+        result.append({
+            "traceID": trace_id,
+            "spanID": f"{seed:x}{index:08x}",
+            "operationName": f"evt:{event_id}",
+            "startTime": start_time,
+            "duration": rnd.randint(1, 2000),
+            "processID": "p1",
+            "tags": span_tags
+        })
+    # Jaeger 내보내기처럼 호스트 이름은 process 태그에 둡니다.
+    processes = {"p1": {"serviceName": "sysmon", "tags": [{"key": "hostname", "value": host}]}}
+    return {"traceID": trace_id, "spans": result, "processes": processes}
+
+
+class _FakeIndices:
+    def __init__(self, client):
+        self.client = client
+
+    async def exists(self, index):
+        return True
+
+    async def get(self, index):
+        return {index: {"mappings": {}, "settings": {}}}
+
+    async def get_mapping(self, index):
+        # 펼친 span 필드가 없는 인덱스로 응답해 /api/trace/metrics가 trace 캐시 경로를 측정하게 합니다.
+        return {index: {"mappings": {}}}
+
+
+class FakeTraceSearchClient:
+    """AsyncTraceAnalyzer가 사용하는 AsyncElasticsearch 메서드를 메모리에서 흉내 냅니다.
+
+    문서는 직렬화해서 보관하고 검색마다 다시 디코딩하므로, 네트워크를 제외한
+    응답 디코딩 비용은 측정에 포함됩니다.
+    """
+
+    def __init__(self, docs: List[Dict]):
+        self._docs = [orjson.dumps(doc) for doc in docs]
+        self.indices = _FakeIndices(self)
+        self.searches = 0
+
+    async def count(self, index):
+        return {"count": len(self._docs)}
+
+    async def open_point_in_time(self, index, keep_alive):
+        return {"id": "benchmark-pit"}
+
+    async def close_point_in_time(self, id):
+        return {}
+
+    async def search(self, index=None, body=None, **kwargs):
+        self.searches += 1
+        body = body or kwargs
+        total = {"value": len(self._docs)}
+        if "pit" in body:
+            start = body["search_after"][0] + 1 if body.get("search_after") else 0
+            page = self._docs[start:start + body["size"]]
+            hits = [{"_source": orjson.loads(doc), "sort": [start + i]} for i, doc in enumerate(page)]
+            return {"pit_id": body["pit"]["id"], "hits": {"total": total, "hits": hits}}
+        if "_seq_no" in str(body.get("sort", "")):
+            return {"hits": {"total": total, "hits": [{"_seq_no": len(self._docs) - 1}]}}
+        size = body.get("size", 10)
+        hits = [{"_source": orjson.loads(doc)} for doc in self._docs[:size]]
+        return {"hits": {"total": total, "hits": hits}}
+
+    async def close(self):
+        pass
+
+
+def summarize(samples: List[float], peak_memory: int) -> Dict:
+    values = np.array(samples) * 1000
+    return {
+        "iterations": len(samples),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3),
+        "peak_memory_bytes": peak_memory
+    }
+
+
+async def measure(run: Callable, iterations: int, warmup: int, setup: Optional[Callable] = None) -> Dict:
+    """run을 반복 실행해 지연 시간을 재고, tracemalloc을 켠 별도 실행으로 최대 메모리를 잽니다."""
+    async def once():
+        if setup is not None:
+            setup()
+        result = run()
+        if asyncio.iscoroutine(result):
+            await result
+
+    # 핸들러의 진단 출력이 측정에 섞이지 않도록 버립니다.
+    with redirect_stdout(io.StringIO()):
+        for _ in range(warmup):
+            await once()
+        samples = []
+        for _ in range(iterations):
+            if setup is not None:
+                setup()
+            started = time.perf_counter()
+            result = run()
+            if asyncio.iscoroutine(result):
+                await result
+            samples.append(time.perf_counter() - started)
+
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        await once()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return summarize(samples, peak)
+
+
+async def run_benchmarks(args) -> Dict:
+    import security_api as api
+    from elasticsearch_analyzer import AsyncTraceAnalyzer
+    from metrics_aggregator import SpanMetricsRecorder
+    from timeline import TimelineEngine
+    from trace_cache import TraceCache
+
+    docs = [generate_trace(args.spans // args.traces, args.tags, args.alert_ratio, args.depth,
+                           seed=args.seed + number, trace_id=f"bench-trace-{number}",
+                           host=f"DESKTOP-{number:04d}")
+            for number in range(args.traces)]
+
+    analyzer = AsyncTraceAnalyzer()
+    await analyzer.client.close()
+    analyzer.client = FakeTraceSearchClient(docs)
+    api.trace_analyzer = analyzer
+    api.trace_cache = TraceCache(analyzer, ttl=3600, check_interval=3600)
+    api.trace_cache.add_listener(SpanMetricsRecorder(api.trace_metrics))
+    api.trace_cache.add_listener(api.timeline)
+
+    snapshot = await api.trace_cache.get("trace")
+    store = snapshot.store
+    tree = (await api.load_process_trees())[0]
+    deepest = int(np.argmax(tree.depth))
+    deepest_pid = tree.node_info(deepest)["pid"]
+    root_pid = tree.node_info(tree.roots[0])["pid"]
+    command_lines = store.command_line.tolist()
+
+    everything = api.TraceScope()
+
+    def cold():
+        api.trace_cache.invalidate("trace")
+
+    cases = {
+        "trace.status": (lambda: api.get_trace_status(), None),
+        "trace.security_alerts.cold": (lambda: api.get_security_alerts(None, None, None, everything), cold),
+        "trace.security_alerts.warm": (lambda: api.get_security_alerts(None, None, None, everything), None),
+        "trace.security_alerts.page": (lambda: api.get_security_alerts(None, 100, "id,alert,startTime", everything), None),
+        "trace.metrics.cold": (lambda: api.get_trace_metrics(everything), cold),
+        "trace.metrics.warm": (lambda: api.get_trace_metrics(everything), None),
+        "trace.timeline.cold": (lambda: api.get_trace_timeline(None, None, None, everything), cold),
+        "trace.timeline.warm": (lambda: api.get_trace_timeline(None, None, None, everything), None),
+        "trace.process_tree.cold": (lambda: api.get_process_tree(None, everything), cold),
+        "trace.process_tree.warm": (lambda: api.get_process_tree(None, everything), None),
+        "trace.process_subtree": (lambda: api.get_process_subtree(root_pid, None, 2, everything), None),
+        "trace.process_ancestors": (lambda: api.get_process_ancestors(deepest_pid, None, everything), None),
+        "clean_cmd": (lambda: [api.clean_cmd(cmd) for cmd in command_lines], None),
+        # 타임라인 엔진이 전체 이력을 처음부터 처리하는 비용 (이후 snapshot은 새 이벤트만 처리)
+        "timeline_dedup": (lambda: TimelineEngine().update(store), None)
+    }
+    selected = [name.strip() for name in args.only.split(',')] if args.only else list(cases)
+    unknown = [name for name in selected if name not in cases]
+    if unknown:
+        raise SystemExit(f"알 수 없는 벤치마크: {', '.join(unknown)}")
+
+    results = {}
+    for name in selected:
+        run, setup = cases[name]
+        results[name] = await measure(run, args.iterations, args.warmup, setup)
+        print(f"{name:32s} p50={results[name]['p50_ms']:9.3f}ms p95={results[name]['p95_ms']:9.3f}ms "
+              f"p99={results[name]['p99_ms']:9.3f}ms peak={results[name]['peak_memory_bytes'] / 1e6:8.2f}MB",
+              file=sys.stderr)
+
+    await api.analyzer.close()
+    return {
+        "config": {
+            "spans": len(store), "traces": args.traces, "tags": args.tags, "alert_ratio": args.alert_ratio,
+            "depth": args.depth, "seed": args.seed, "iterations": args.iterations, "warmup": args.warmup,
+            "processes": len(tree), "max_depth": int(tree.depth.max()) if len(tree) else 0
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count()
+        },
+        "results": results
+    }
+
+
+def compare(report: Dict, baseline: Dict, max_regression: float) -> List[str]:
+    """기준 결과보다 p95가 max_regression배 넘게 느려진 항목을 반환합니다."""
+    regressions = []
+    for name, result in report["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if previous and previous["p95_ms"] > 0 and result["p95_ms"] > previous["p95_ms"] * max_regression:
+            regressions.append(f"{name}: p95 {previous['p95_ms']}ms -> {result['p95_ms']}ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="trace 파싱과 /api/trace/* 핸들러 벤치마크")
+    parser.add_argument("--spans", type=int, default=20000, help="전체 span 수")
+    parser.add_argument("--traces", type=int, default=1, help="trace 문서 수")
+    parser.add_argument("--tags", type=int, default=10, help="span당 태그 수")
+    parser.add_argument("--alert-ratio", type=float, default=0.05, help="sigma.alert가 붙는 span 비율")
+    parser.add_argument("--depth", type=int, default=6, help="프로세스 트리 최대 깊이")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--only", default=None, help="실행할 벤치마크 이름 (쉼표 구분)")
+    parser.add_argument("--output", default="benchmark_results.json", help="결과 JSON 파일")
+    parser.add_argument("--baseline", default=None, help="비교할 이전 결과 JSON 파일")
+    parser.add_argument("--max-regression", type=float, default=1.25,
+                        help="허용하는 p95 증가 배율 (기본값: 1.25)")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_benchmarks(args))
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"결과 저장: {args.output}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        if regressions:
+            print("성능 저하:", *regressions, sep="\n  ", file=sys.stderr)
+            sys.exit(1)
+        print("기준 대비 성능 저하 없음", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
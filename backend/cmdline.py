@@ -0,0 +1,137 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, NamedTuple, Optional
+
+# clean_cmd가 찾는 주 실행 파일 이름
+MAIN_EXECUTABLE = re.compile(r'([a-zA-Z0-9_-]+\.exe)')
+# 따옴표로 감싼 경로 또는 첫 공백 전까지를 실행 파일로, 나머지를 인자로 나눕니다.
+EXECUTABLE_AND_ARGUMENTS = re.compile(r'\s*(?:"([^"]*)"?|(\S*))\s*(.*)', re.DOTALL)
+# PowerShell -e/-enc/-EncodedCommand 뒤의 base64 또는 FromBase64String 호출
+ENCODED_PAYLOAD = re.compile(r'(?:^|\s)[-/]e[a-z]*\s+["\']?[A-Za-z0-9+/]{20,}={0,2}|frombase64string', re.IGNORECASE)
+
+# 실행 파일 이름(소문자) -> 스크립트 호스트
+SCRIPT_HOSTS = {
+    "powershell.exe": "powershell",
+    "pwsh.exe": "powershell",
+    "powershell_ise.exe": "powershell",
+    "cmd.exe": "cmd",
+    "wscript.exe": "wscript",
+    "cscript.exe": "cscript",
+    "mshta.exe": "mshta",
+    "python.exe": "python",
+    "pythonw.exe": "python",
+    "bash.exe": "bash",
+    "wsl.exe": "bash"
+}
+
+
+class CommandLine(NamedTuple):
+    """CommandLine을 나눈 결과입니다. main은 clean_cmd와 같은 값입니다."""
+    executable: str
+    path: str
+    arguments: str
+    script_host: Optional[str]
+    encoded: bool
+    main: str
+
+
+class InternTable:
+    """문자열마다 객체 하나와 파싱 결과를 보관하는 크기 제한 LRU 표입니다.
+
+    같은 문자열은 같은 객체를 돌려주므로 메모리에 한 번만 남고, 해시도 한 번만 계산됩니다.
+    파싱은 결과가 처음 필요할 때 한 번만 합니다.
+    """
+
+    def __init__(self, parse: Callable, capacity: int):
+        self.parse = parse
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def intern(self, text: str) -> str:
+        return self._entry(text)[0]
+
+    def parsed(self, text: str):
+        entry = self._entry(text)
+        if entry[1] is None:
+            entry[1] = self.parse(entry[0])
+        return entry[1]
+
+    def stats(self) -> Dict:
+        return {"size": len(self._entries), "capacity": self.capacity, "hits": self.hits, "misses": self.misses}
+
+    def _entry(self, text: str) -> list:
+        entry = self._entries.get(text)
+        if entry is not None:
+            # 조회 경로는 잠그지 않습니다 (OrderedDict 연산 하나하나는 GIL 아래에서 원자적입니다).
+            try:
+                self._entries.move_to_end(text)
+            except KeyError:  # 다른 스레드가 방금 제거한 경우
+                pass
+            self.hits += 1
+            return entry
+        with self._lock:
+            entry = self._entries.get(text)
+            if entry is not None:
+                return entry
+            self.misses += 1
+            entry = self._entries[text] = [text, None]
+            if len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+            return entry
+
+
+def _basename(path: str) -> str:
+    return path.replace('/', '\\').rsplit('\\', 1)[-1]
+
+
+def _parse(text: str) -> CommandLine:
+    match = EXECUTABLE_AND_ARGUMENTS.match(text)
+    path = match.group(1) if match.group(1) is not None else (match.group(2) or '')
+    arguments = match.group(3)
+    executable = _basename(path)
+    host_key = executable.lower()
+    if not host_key.endswith('.exe'):
+        host_key += '.exe'
+    main = MAIN_EXECUTABLE.search(text)
+    return CommandLine(
+        executable=executable,
+        path=path,
+        arguments=arguments,
+        script_host=SCRIPT_HOSTS.get(host_key),
+        encoded=ENCODED_PAYLOAD.search(text) is not None,
+        main=main.group(1) if main else text
+    )
+
+
+_commands = InternTable(_parse, int(os.getenv('CMDLINE_CACHE_SIZE', '65536')))
+_images = InternTable(_basename, int(os.getenv('IMAGE_CACHE_SIZE', '16384')))
+
+
+def intern_command(text: str) -> str:
+    """같은 CommandLine 문자열을 객체 하나로 보관합니다."""
+    return _commands.intern(text) if text else text
+
+
+def parse_command_line(text: str) -> CommandLine:
+    return _commands.parsed(text)
+
+
+def clean_cmd(cmd: str) -> str:
+    """CommandLine에서 주요 실행 파일만 추출"""
+    if isinstance(cmd, str):
+        return _commands.parsed(cmd).main
+    return cmd
+
+
+def image_name(image: str) -> str:
+    """Image 경로에서 실행 파일 이름만 반환합니다."""
+    return _images.parsed(image) if image else image
+
+
+def cache_stats() -> Dict:
+    return {"commandLines": _commands.stats(), "images": _images.stats()}
@@ -1,61 +1,105 @@
-from elasticsearch import Elasticsearch
 import json
-import pandas as pd
+import logging
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
 import os
+import time
 from dotenv import load_dotenv
 
+from lazy_client import LazyClient
+from span_store import HOST_TAGS
+
 load_dotenv()
 
-class TraceAnalyzer:
-    def __init__(self, hosts=None, username=None, password=None):
-        """Elasticsearch 클라이언트를 초기화합니다."""
-        # 환경변수에서 설정 가져오기
-        if not hosts:
-            hosts = [os.getenv('ELASTICSEARCH_HOST', 'https://localhost:9200')]
-        if not username:
-            username = os.getenv('ELASTICSEARCH_USERNAME')
-        if not password:
-            password = os.getenv('ELASTICSEARCH_PASSWORD')
-        
-        if username and password:
-            self.client = Elasticsearch(
-                hosts=hosts,
-                basic_auth=(username, password),
-                verify_certs=False,
-                ssl_show_warn=False
-            )
-        else:
-            self.client = Elasticsearch(
-                hosts=hosts,
-                verify_certs=False,
-                ssl_show_warn=False
-            )
-        
-    def check_index_status(self, index_name: str) -> Dict:
-        """인덱스 상태를 확인합니다."""
-        try:
-            # 인덱스 존재 여부 확인
-            if not self.client.indices.exists(index=index_name):
-                return {"status": "error", "message": f"인덱스 '{index_name}'이 존재하지 않습니다."}
-            
-            # 인덱스 정보 가져오기
-            index_info = self.client.indices.get(index=index_name)
-            doc_count = self.client.count(index=index_name)
-            
-            return {
-                "status": "success",
-                "index_name": index_name,
-                "document_count": doc_count['count'],
-                "index_info": index_info
-            }
-        except Exception as e:
-            return {"status": "error", "message": str(e)}
-    
-    def search_security_alerts(self, index_name: str, limit: int = 100) -> List[Dict]:
-        """보안 알림이 포함된 이벤트를 검색합니다."""
-        query = {
+logger = logging.getLogger(__name__)
+
+# ingest pipeline이 span 태그를 span 필드로 펼칠 때의 이름 (태그 키 -> 필드)
+SPAN_TAG_FIELDS = {
+    "sysmon.event_id": "event_id",
+    "Image": "image",
+    "sigma.alert": "sigma_alert",
+    "sysmon.pid": "pid",
+    "sysmon.ppid": "ppid",
+    "CommandLine": "command_line",
+    "User": "user"
+}
+SPAN_FIELDS_PIPELINE = os.getenv('TRACE_SPAN_PIPELINE', 'trace-span-fields')
+# 펼친 필드가 없는 인덱스를 다시 확인하기까지의 시간(초)
+SPAN_FIELDS_RECHECK = float(os.getenv('TRACE_SPAN_FIELDS_RECHECK', '60'))
+
+# spans[].tags를 span 필드로 펼치고, Jaeger processes의 호스트 태그를 span.host로 복사합니다.
+SPAN_FIELDS_SCRIPT = """
+if (ctx.spans == null) { return; }
+Map hosts = new HashMap();
+if (ctx.processes != null) {
+  for (def entry : ctx.processes.entrySet()) {
+    def process = entry.getValue();
+    if (process == null || process.tags == null) { continue; }
+    for (def tag : process.tags) {
+      if (params.host_tags.contains(tag.key)) { hosts.put(entry.getKey(), tag.value); }
+    }
+  }
+}
+for (def span : ctx.spans) {
+  if (span.processID != null && hosts.containsKey(span.processID)) { span.host = hosts.get(span.processID); }
+  if (span.tags == null) { continue; }
+  for (def tag : span.tags) {
+    if (tag.value == null) { continue; }
+    def field = params.fields.get(tag.key);
+    if (field != null) { span[field] = tag.value.toString(); }
+    else if (params.host_tags.contains(tag.key)) { span.host = tag.value.toString(); }
+  }
+}
+"""
+
+def build_client_options(hosts=None, username=None, password=None, pool_size=None,
+                         request_timeout=None, max_retries=None) -> Dict:
+    """동기/비동기 Elasticsearch 클라이언트가 공유하는 연결 설정을 만듭니다."""
+    # 환경변수에서 설정 가져오기
+    if not hosts:
+        hosts = [os.getenv('ELASTICSEARCH_HOST', 'https://localhost:9200')]
+    if not username:
+        username = os.getenv('ELASTICSEARCH_USERNAME')
+    if not password:
+        password = os.getenv('ELASTICSEARCH_PASSWORD')
+
+    options = {
+        "hosts": hosts,
+        "verify_certs": False,
+        "ssl_show_warn": False,
+        # 노드당 커넥션 풀 크기와 요청 타임아웃
+        "connections_per_node": pool_size or int(os.getenv('ELASTICSEARCH_POOL_SIZE', '10')),
+        "request_timeout": request_timeout or float(os.getenv('ELASTICSEARCH_TIMEOUT', '30')),
+        "max_retries": max_retries if max_retries is not None else int(os.getenv('ELASTICSEARCH_MAX_RETRIES', '3')),
+        "retry_on_timeout": True
+    }
+    if username and password:
+        options["basic_auth"] = (username, password)
+    return options
+
+def create_client(asynchronous: bool = False, hosts=None, username=None, password=None, **options):
+    """Elasticsearch 클라이언트를 만듭니다. elasticsearch는 불러오는 데 시간이 걸려 처음 만들 때 불러옵니다."""
+    from elasticsearch import AsyncElasticsearch, Elasticsearch
+    return (AsyncElasticsearch if asynchronous else Elasticsearch)(
+        **build_client_options(hosts, username, password, **options))
+
+class TraceQueries:
+    """TraceAnalyzer와 AsyncTraceAnalyzer가 공유하는 쿼리 본문입니다."""
+
+    @staticmethod
+    def index_version_query() -> Dict:
+        return {
+            "query": {"match_all": {}},
+            "sort": [{"_seq_no": {"order": "desc"}}],
+            "size": 1,
+            "_source": False,
+            "track_total_hits": True,
+            "seq_no_primary_term": True
+        }
+
+    @staticmethod
+    def security_alerts_query(limit: int) -> Dict:
+        return {
             "query": {
                 "nested": {
                     "path": "spans",
@@ -80,46 +124,17 @@ class TraceAnalyzer:
             },
             "size": limit
         }
-        
-        try:
-            response = self.client.search(index=index_name, body=query)
-            return response['hits']['hits']
-        except Exception as e:
-            print(f"검색 오류: {e}")
-            return []
-    
-    def get_all_data(self, index_name: str, limit: int = 10) -> List[Dict]:
-        """모든 데이터를 가져와서 구조를 확인합니다."""
-        query = {
-            "query": {"match_all": {}},
-            "size": limit
-        }
-        
-        try:
-            response = self.client.search(index=index_name, body=query)
-            return response['hits']['hits']
-        except Exception as e:
-            print(f"검색 오류: {e}")
-            return []
-    
-    def get_process_events(self, index_name: str, limit: int = 100) -> List[Dict]:
-        """프로세스 생성 이벤트를 검색합니다."""
-        # 우선 간단한 쿼리로 테스트
-        query = {
+
+    @staticmethod
+    def match_all_query(limit: int) -> Dict:
+        return {
             "query": {"match_all": {}},
             "size": limit
         }
-        
-        try:
-            response = self.client.search(index=index_name, body=query)
-            return response['hits']['hits']
-        except Exception as e:
-            print(f"검색 오류: {e}")
-            return []
-    
-    def get_file_events(self, index_name: str, limit: int = 100) -> List[Dict]:
-        """파일 생성 이벤트를 검색합니다."""
-        query = {
+
+    @staticmethod
+    def file_events_query(limit: int) -> Dict:
+        return {
             "query": {
                 "bool": {
                     "must": [
@@ -133,48 +148,257 @@ class TraceAnalyzer:
             ],
             "size": limit
         }
-        
-        try:
-            response = self.client.search(index=index_name, body=query)
-            return response['hits']['hits']
-        except Exception as e:
-            print(f"검색 오류: {e}")
-            return []
-    
-    def analyze_security_patterns(self, index_name: str) -> Dict:
-        """보안 패턴을 분석합니다."""
-        # 보안 알림 유형별 집계
-        alert_agg_query = {
-            "aggs": {
-                "alert_types": {
-                    "terms": {
-                        "field": "tags.sigma.alert.keyword",
-                        "size": 10
+
+    @staticmethod
+    def span_fields_mapping() -> Dict:
+        """trace 인덱스 매핑입니다. span 태그는 nested key/value와 펼친 keyword 필드로 모두 저장합니다."""
+        keyword = {"type": "keyword"}
+        span_fields = {field: keyword for field in SPAN_TAG_FIELDS.values()}
+        span_fields["command_line"] = {"type": "keyword", "ignore_above": 8191}
+        span_fields["host"] = keyword
+        return {
+            "properties": {
+                "traceID": keyword,
+                "spans": {
+                    "type": "nested",
+                    "properties": {
+                        "traceID": keyword,
+                        "spanID": keyword,
+                        "operationName": keyword,
+                        "processID": keyword,
+                        "startTime": {"type": "long"},
+                        "duration": {"type": "long"},
+                        "tags": {"type": "nested", "properties": {"key": keyword, "value": keyword}},
+                        **span_fields
                     }
                 },
-                "process_images": {
-                    "terms": {
-                        "field": "tags.Image.keyword",
-                        "size": 10
-                    }
+                # processID별 키가 문서마다 달라 매핑하지 않습니다 (호스트는 pipeline이 span.host로 복사).
+                "processes": {"type": "object", "enabled": False}
+            }
+        }
+
+    @staticmethod
+    def span_fields_pipeline() -> Dict:
+        return {
+            "description": "span 태그를 span 필드로 펼칩니다 (AI-Detector)",
+            "processors": [{
+                "script": {
+                    "lang": "painless",
+                    "source": SPAN_FIELDS_SCRIPT,
+                    "params": {"fields": SPAN_TAG_FIELDS, "host_tags": list(HOST_TAGS)}
                 }
-            },
-            "size": 0
+            }]
         }
-        
-        try:
-            response = self.client.search(index=index_name, body=alert_agg_query)
+
+    @classmethod
+    def trace_index_body(cls) -> Dict:
+        return {
+            "settings": {"index": {"default_pipeline": SPAN_FIELDS_PIPELINE}},
+            "mappings": cls.span_fields_mapping()
+        }
+
+    @staticmethod
+    def mapping_has_span_fields(response: Dict) -> bool:
+        """get_mapping 결과에 펼친 span 필드(spans.event_id)가 있는지 반환합니다."""
+        for mapping in response.values():
+            spans = mapping.get('mappings', {}).get('properties', {}).get('spans', {})
+            if spans.get('type') == 'nested' and 'event_id' in spans.get('properties', {}):
+                return True
+        return False
+
+    @staticmethod
+    def security_patterns_query(flattened: bool = True) -> Dict:
+        """보안 알림 유형과 프로세스 이미지별 수를 집계합니다.
+
+        flattened이면 펼친 span 필드를 nested 집계합니다. 아니면 동적 매핑으로 만들어진 인덱스라
+        spans가 nested가 아니므로, spans.tags의 .keyword 하위 필드에 nested 없이 filter/terms 집계를
+        합니다. 이때 key와 value의 짝은 문서 단위로만 맞춰지므로 수는 해당 태그가 있는 trace 문서 수입니다.
+        """
+        if flattened:
+            aggs = {
+                "alert_types": {"terms": {"field": "spans.sigma_alert", "size": 10}},
+                "process_images": {"terms": {"field": "spans.image", "size": 10}}
+            }
+            return {"aggs": {"spans": {"nested": {"path": "spans"}, "aggs": aggs}}, "size": 0}
+
+        def tag_terms(key: str) -> Dict:
             return {
-                "alert_types": response['aggregations']['alert_types']['buckets'],
-                "process_images": response['aggregations']['process_images']['buckets']
+                "filter": {"term": {"spans.tags.key.keyword": key}},
+                "aggs": {"values": {"terms": {"field": "spans.tags.value.keyword", "size": 10}}}
             }
-        except Exception as e:
-            print(f"분석 오류: {e}")
-            return {}
-    
-    def search_by_process_id(self, index_name: str, process_id: int) -> List[Dict]:
-        """특정 프로세스 ID의 모든 이벤트를 검색합니다."""
-        query = {
+        return {"aggs": {"alert_types": tag_terms("sigma.alert"), "process_images": tag_terms("Image")}, "size": 0}
+
+    @staticmethod
+    def parse_security_patterns(response: Dict, flattened: bool = True) -> Dict:
+        aggregations = response['aggregations']
+        if flattened:
+            return {
+                "alert_types": aggregations['spans']['alert_types']['buckets'],
+                "process_images": aggregations['spans']['process_images']['buckets']
+            }
+        return {
+            "alert_types": aggregations['alert_types']['values']['buckets'],
+            "process_images": aggregations['process_images']['values']['buckets']
+        }
+
+    @staticmethod
+    def span_filters(start: Optional[int] = None, end: Optional[int] = None,
+                     trace_ids: Optional[List[str]] = None, hosts: Optional[List[str]] = None) -> Tuple[Dict, List]:
+        """trace 문서를 고르는 쿼리와 nested span 집계에 쓸 span 필터 목록을 반환합니다."""
+        span_filter = []
+        if start is not None or end is not None:
+            bounds = {}
+            if start is not None:
+                bounds["gte"] = start
+            if end is not None:
+                bounds["lte"] = end
+            span_filter.append({"range": {"spans.startTime": bounds}})
+        if hosts:
+            span_filter.append({"terms": {"spans.host": hosts}})
+
+        doc_filter = []
+        if trace_ids:
+            doc_filter.append({"terms": {"traceID": trace_ids}})
+        if span_filter:
+            doc_filter.append({"nested": {"path": "spans", "query": {"bool": {"filter": span_filter}}}})
+        return ({"bool": {"filter": doc_filter}} if doc_filter else {"match_all": {}}), span_filter
+
+    @staticmethod
+    def span_metrics_query(start: Optional[int] = None, end: Optional[int] = None,
+                           trace_ids: Optional[List[str]] = None, hosts: Optional[List[str]] = None,
+                           top_size: int = 100) -> Dict:
+        """/api/trace/metrics를 클러스터에서 계산하는 집계입니다. 응답은 집계 버킷과 첫 traceID뿐입니다.
+
+        start/end는 span startTime(마이크로초) 범위입니다.
+        """
+        query, span_filter = TraceQueries.span_filters(start, end, trace_ids, hosts)
+        return {
+            "query": query,
+            "size": 1,
+            "_source": ["traceID"],
+            "track_total_hits": False,
+            "aggs": {
+                "spans": {
+                    "nested": {"path": "spans"},
+                    "aggs": {
+                        "scoped": {
+                            "filter": {"bool": {"filter": span_filter}} if span_filter else {"match_all": {}},
+                            "aggs": {
+                                "alerts": {"filter": {"exists": {"field": "spans.sigma_alert"}}},
+                                "process_events": {"filter": {"term": {"spans.event_id": "1"}}},
+                                "file_events": {"filter": {"term": {"spans.event_id": "11"}}},
+                                "alert_types": {"terms": {"field": "spans.sigma_alert", "size": top_size}},
+                                "alert_type_count": {"cardinality": {"field": "spans.sigma_alert"}},
+                                "images": {"terms": {"field": "spans.image", "size": 10}},
+                                "hosts": {"cardinality": {"field": "spans.host"}},
+                                "traces": {
+                                    "reverse_nested": {},
+                                    "aggs": {"count": {"cardinality": {"field": "traceID"}}}
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+
+    @staticmethod
+    def parse_span_metrics(response: Dict) -> Dict:
+        scoped = response['aggregations']['spans']['scoped']
+        hits = response['hits']['hits']
+        return {
+            "traceID": hits[0]['_source'].get('traceID', '') if hits else '',
+            "totalSpans": scoped['doc_count'],
+            "securityAlerts": scoped['alerts']['doc_count'],
+            "processEvents": scoped['process_events']['doc_count'],
+            "fileEvents": scoped['file_events']['doc_count'],
+            "alertTypes": scoped['alert_type_count']['value'],
+            "alertTypesList": [bucket['key'] for bucket in scoped['alert_types']['buckets']],
+            "traceCount": scoped['traces']['count']['value'],
+            "hostCount": scoped['hosts']['value'],
+            "topImages": [{"image": bucket['key'], "count": bucket['doc_count']}
+                          for bucket in scoped['images']['buckets']]
+        }
+
+    @staticmethod
+    def span_bounds_query(trace_ids: Optional[List[str]] = None, hosts: Optional[List[str]] = None) -> Dict:
+        """범위를 지정하지 않은 히스토그램이 쓸 span startTime 최솟값/최댓값 집계입니다."""
+        query, span_filter = TraceQueries.span_filters(trace_ids=trace_ids, hosts=hosts)
+        return {
+            "query": query,
+            "size": 0,
+            "aggs": {
+                "spans": {
+                    "nested": {"path": "spans"},
+                    "aggs": {
+                        "scoped": {
+                            "filter": {"bool": {"filter": span_filter}} if span_filter else {"match_all": {}},
+                            "aggs": {
+                                "first": {"min": {"field": "spans.startTime"}},
+                                "last": {"max": {"field": "spans.startTime"}}
+                            }
+                        }
+                    }
+                }
+            }
+        }
+
+    @staticmethod
+    def parse_span_bounds(response: Dict) -> Optional[Tuple[int, int]]:
+        scoped = response['aggregations']['spans']['scoped']
+        if not scoped['doc_count'] or scoped['first']['value'] is None:
+            return None
+        return int(scoped['first']['value']), int(scoped['last']['value'])
+
+    @staticmethod
+    def span_histogram_query(start: int, end: int, interval: int, trace_ids: Optional[List[str]] = None,
+                             hosts: Optional[List[str]] = None) -> Dict:
+        """span startTime을 interval(마이크로초) 간격으로 나눈 이벤트 수, 알림 수, Event ID별 수입니다.
+
+        startTime은 long 필드이므로 date_histogram 대신 histogram을 쓰며, 버킷 key는 interval의 배수입니다.
+        """
+        query, span_filter = TraceQueries.span_filters(start, end, trace_ids, hosts)
+        return {
+            "query": query,
+            "size": 0,
+            "aggs": {
+                "spans": {
+                    "nested": {"path": "spans"},
+                    "aggs": {
+                        "scoped": {
+                            "filter": {"bool": {"filter": span_filter}},
+                            "aggs": {
+                                "over_time": {
+                                    "histogram": {"field": "spans.startTime", "interval": interval,
+                                                  "min_doc_count": 1},
+                                    "aggs": {
+                                        "alerts": {"filter": {"exists": {"field": "spans.sigma_alert"}}},
+                                        "event_types": {"terms": {"field": "spans.event_id", "size": 30}}
+                                    }
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+
+    @staticmethod
+    def parse_span_histogram(response: Dict) -> Dict[int, Dict]:
+        buckets = {}
+        for bucket in response['aggregations']['spans']['scoped']['over_time']['buckets']:
+            key = int(bucket['key'])
+            buckets[key] = {
+                "key": key,
+                "count": bucket['doc_count'],
+                "alerts": bucket['alerts']['doc_count'],
+                "eventTypes": {item['key']: item['doc_count'] for item in bucket['event_types']['buckets']}
+            }
+        return buckets
+
+    @staticmethod
+    def process_id_query(process_id: int) -> Dict:
+        return {
             "query": {
                 "term": {"tags.sysmon.pid": process_id}
             },
@@ -182,22 +406,16 @@ class TraceAnalyzer:
                 {"startTime": {"order": "asc"}}
             ]
         }
-        
-        try:
-            response = self.client.search(index=index_name, body=query)
-            return response['hits']['hits']
-        except Exception as e:
-            print(f"검색 오류: {e}")
-            return []
-            
-    def get_timeline_analysis(self, index_name: str) -> Dict:
-        """시간대별 이벤트 분석을 수행합니다."""
-        query = {
+
+    @staticmethod
+    def timeline_query(interval: str = '1m') -> Dict:
+        # 1초 고정 간격은 하루 범위만 되어도 search.max_buckets를 넘으므로 간격을 받습니다.
+        return {
             "aggs": {
                 "events_over_time": {
                     "date_histogram": {
                         "field": "startTime",
-                        "calendar_interval": "1s",
+                        "fixed_interval": interval,
                         "format": "yyyy-MM-dd HH:mm:ss"
                     },
                     "aggs": {
@@ -211,10 +429,424 @@ class TraceAnalyzer:
             },
             "size": 0
         }
-        
+
+    @staticmethod
+    def pit_page_query(pit_id: str, keep_alive: str, batch_size: int, query: Optional[Dict] = None,
+                       source=None, sort: Optional[List] = None, search_after=None) -> Dict:
+        """point-in-time + search_after 페이지 요청 본문을 만듭니다."""
+        body = {
+            "query": query or {"match_all": {}},
+            "pit": {"id": pit_id, "keep_alive": keep_alive},
+            # _shard_doc을 마지막 정렬 키로 두어 동점 없이 페이지를 이어갑니다.
+            "sort": list(sort or []) + [{"_shard_doc": "asc"}],
+            "size": batch_size,
+            "track_total_hits": False
+        }
+        if source is not None:
+            body["_source"] = source
+        if search_after is not None:
+            body["search_after"] = search_after
+        return body
+
+    @staticmethod
+    def parse_index_version(response: Dict) -> tuple:
+        hits = response['hits']['hits']
+        max_seq_no = hits[0].get('_seq_no', -1) if hits else -1
+        return (response['hits']['total']['value'], max_seq_no)
+
+class TraceAnalyzer(TraceQueries):
+    def __init__(self, hosts=None, username=None, password=None, **options):
+        """Elasticsearch 클라이언트를 초기화합니다."""
+        self.client = LazyClient(lambda: create_client(False, hosts, username, password, **options))
+        self._span_fields: Dict[str, tuple] = {}
+
+    def setup_span_fields(self, index_name: str, backfill: bool = True) -> Dict:
+        """span 필드 ingest pipeline을 등록하고 인덱스가 이를 기본 pipeline으로 쓰게 합니다.
+
+        인덱스가 없으면 매핑과 함께 만들고, 있으면 펼친 필드 매핑을 추가한 뒤 backfill이면
+        기존 문서를 update_by_query로 다시 처리합니다 (백그라운드 작업 ID 반환).
+        """
+        self._span_fields.pop(index_name, None)
         try:
-            response = self.client.search(index=index_name, body=query)
+            self.client.ingest.put_pipeline(id=SPAN_FIELDS_PIPELINE, body=self.span_fields_pipeline())
+            if not self.client.indices.exists(index=index_name):
+                self.client.indices.create(index=index_name, body=self.trace_index_body())
+                return {"status": "success", "index_name": index_name, "created": True}
+
+            spans = self.span_fields_mapping()["properties"]["spans"]
+            fields = {name: spec for name, spec in spans["properties"].items()
+                      if name in SPAN_TAG_FIELDS.values() or name == "host"}
+            self.client.indices.put_mapping(index=index_name, body={
+                "properties": {"spans": {"type": "nested", "properties": fields}}})
+            self.client.indices.put_settings(index=index_name, body={
+                "index": {"default_pipeline": SPAN_FIELDS_PIPELINE}})
+            result = {"status": "success", "index_name": index_name, "created": False}
+            if backfill:
+                task = self.client.update_by_query(index=index_name, pipeline=SPAN_FIELDS_PIPELINE,
+                                                   conflicts="proceed", wait_for_completion=False)
+                result["task"] = task.get('task')
+            return result
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    def has_span_fields(self, index_name: str) -> bool:
+        """인덱스에 펼친 span 필드가 매핑되어 있는지 반환합니다. 없으면 일정 시간 뒤 다시 확인합니다."""
+        cached = self._span_fields.get(index_name)
+        if cached is not None and (cached[0] or time.monotonic() - cached[1] < SPAN_FIELDS_RECHECK):
+            return cached[0]
+        try:
+            ready = self.mapping_has_span_fields(dict(self.client.indices.get_mapping(index=index_name)))
+        except Exception:
+            logger.exception("매핑 확인 오류")
+            ready = False
+        self._span_fields[index_name] = (ready, time.monotonic())
+        return ready
+
+    def get_span_metrics(self, index_name: str, start: Optional[int] = None, end: Optional[int] = None,
+                         trace_ids: Optional[List[str]] = None, hosts: Optional[List[str]] = None,
+                         top_size: int = 100) -> Optional[Dict]:
+        """span 메트릭을 클러스터에서 집계합니다. 실패하면 None입니다."""
+        try:
+            response = self.client.search(index=index_name, body=self.span_metrics_query(
+                start, end, trace_ids, hosts, top_size))
+            return self.parse_span_metrics(response)
+        except Exception:
+            logger.exception("메트릭 집계 오류")
+            return None
+
+    def get_span_bounds(self, index_name: str, trace_ids: Optional[List[str]] = None,
+                        hosts: Optional[List[str]] = None) -> Optional[Tuple[int, int]]:
+        """span startTime의 (최솟값, 최댓값)을 클러스터에서 구합니다. span이 없거나 실패하면 None입니다."""
+        try:
+            response = self.client.search(index=index_name, body=self.span_bounds_query(trace_ids, hosts))
+            return self.parse_span_bounds(response)
+        except Exception:
+            logger.exception("범위 집계 오류")
+            return None
+
+    def get_span_histogram(self, index_name: str, start: int, end: int, interval: int,
+                           trace_ids: Optional[List[str]] = None,
+                           hosts: Optional[List[str]] = None) -> Optional[Dict[int, Dict]]:
+        """span 히스토그램 버킷(버킷 시작 -> 버킷)을 클러스터에서 집계합니다. 실패하면 None입니다."""
+        try:
+            response = self.client.search(index=index_name, body=self.span_histogram_query(
+                start, end, interval, trace_ids, hosts))
+            return self.parse_span_histogram(response)
+        except Exception:
+            logger.exception("히스토그램 집계 오류")
+            return None
+
+    def check_index_status(self, index_name: str) -> Dict:
+        """인덱스 상태를 확인합니다."""
+        try:
+            # 인덱스 존재 여부 확인
+            if not self.client.indices.exists(index=index_name):
+                return {"status": "error", "message": f"인덱스 '{index_name}'이 존재하지 않습니다."}
+
+            # 인덱스 정보 가져오기
+            index_info = self.client.indices.get(index=index_name)
+            doc_count = self.client.count(index=index_name)
+
+            return {
+                "status": "success",
+                "index_name": index_name,
+                "document_count": doc_count['count'],
+                "index_info": index_info
+            }
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    def get_index_version(self, index_name: str) -> Optional[tuple]:
+        """인덱스의 (문서 수, 최대 _seq_no)를 반환합니다. 캐시 무효화에 사용됩니다."""
+        try:
+            response = self.client.search(index=index_name, body=self.index_version_query())
+            return self.parse_index_version(response)
+        except Exception:
+            logger.exception("버전 확인 오류")
+            return None
+
+    def iter_batches(self, index_name: str, query: Optional[Dict] = None, batch_size: int = 500,
+                     source=None, sort: Optional[List] = None, keep_alive: str = "1m") -> Iterator[List[Dict]]:
+        """point-in-time과 search_after로 전체 결과를 batch_size 단위로 순회합니다.
+
+        한 번에 한 페이지만 메모리에 유지하므로 결과 크기와 무관하게 메모리 사용량이 일정합니다.
+        source로 `_source` 필터(필드 목록 또는 False)를 지정할 수 있습니다.
+        """
+        pit_id = self.client.open_point_in_time(index=index_name, keep_alive=keep_alive)['id']
+        try:
+            search_after = None
+            while True:
+                body = self.pit_page_query(pit_id, keep_alive, batch_size, query, source, sort, search_after)
+                response = self.client.search(body=body)
+                pit_id = response.get('pit_id', pit_id)
+                hits = response['hits']['hits']
+                if not hits:
+                    return
+                yield hits
+                if len(hits) < batch_size:
+                    return
+                search_after = hits[-1]['sort']
+        finally:
+            try:
+                self.client.close_point_in_time(id=pit_id)
+            except Exception:
+                logger.exception("PIT 종료 오류")
+
+    def iter_hits(self, index_name: str, query: Optional[Dict] = None, batch_size: int = 500,
+                  source=None, sort: Optional[List] = None, keep_alive: str = "1m") -> Iterator[Dict]:
+        """iter_batches의 결과를 문서 단위로 반환합니다."""
+        for batch in self.iter_batches(index_name, query, batch_size, source, sort, keep_alive):
+            yield from batch
+
+    def search_security_alerts(self, index_name: str, limit: int = 100) -> List[Dict]:
+        """보안 알림이 포함된 이벤트를 검색합니다."""
+        try:
+            response = self.client.search(index=index_name, body=self.security_alerts_query(limit))
+            return response['hits']['hits']
+        except Exception:
+            logger.exception("검색 오류")
+            return []
+
+    def get_all_data(self, index_name: str, limit: int = 10) -> List[Dict]:
+        """모든 데이터를 가져와서 구조를 확인합니다."""
+        try:
+            response = self.client.search(index=index_name, body=self.match_all_query(limit))
+            return response['hits']['hits']
+        except Exception:
+            logger.exception("검색 오류")
+            return []
+
+    def get_process_events(self, index_name: str, limit: int = 100) -> List[Dict]:
+        """프로세스 생성 이벤트를 검색합니다."""
+        # 우선 간단한 쿼리로 테스트
+        try:
+            response = self.client.search(index=index_name, body=self.match_all_query(limit))
+            return response['hits']['hits']
+        except Exception:
+            logger.exception("검색 오류")
+            return []
+
+    def get_file_events(self, index_name: str, limit: int = 100) -> List[Dict]:
+        """파일 생성 이벤트를 검색합니다."""
+        try:
+            response = self.client.search(index=index_name, body=self.file_events_query(limit))
+            return response['hits']['hits']
+        except Exception:
+            logger.exception("검색 오류")
+            return []
+
+    def analyze_security_patterns(self, index_name: str) -> Dict:
+        """보안 패턴을 분석합니다."""
+        try:
+            flattened = self.has_span_fields(index_name)
+            response = self.client.search(index=index_name, body=self.security_patterns_query(flattened))
+            return self.parse_security_patterns(response, flattened)
+        except Exception:
+            logger.exception("분석 오류")
+            return {}
+
+    def search_by_process_id(self, index_name: str, process_id: int) -> List[Dict]:
+        """특정 프로세스 ID의 모든 이벤트를 검색합니다."""
+        query = self.process_id_query(process_id)
+        try:
+            return list(self.iter_hits(index_name, query=query['query'], sort=query['sort']))
+        except Exception:
+            logger.exception("검색 오류")
+            return []
+
+    def get_timeline_analysis(self, index_name: str, interval: str = '1m') -> Dict:
+        """시간대별 이벤트 분석을 수행합니다. interval은 '30s', '5m' 같은 고정 간격입니다."""
+        try:
+            response = self.client.search(index=index_name, body=self.timeline_query(interval))
             return response['aggregations']['events_over_time']['buckets']
+        except Exception:
+            logger.exception("분석 오류")
+            return {}
+
+class AsyncTraceAnalyzer(TraceQueries):
+    """이벤트 루프를 막지 않는 TraceAnalyzer의 비동기 버전입니다.
+
+    커넥션 풀 크기와 타임아웃은 ELASTICSEARCH_POOL_SIZE, ELASTICSEARCH_TIMEOUT,
+    ELASTICSEARCH_MAX_RETRIES 환경변수 또는 생성자 인자로 설정합니다.
+    """
+
+    def __init__(self, hosts=None, username=None, password=None, **options):
+        """AsyncElasticsearch 클라이언트를 초기화합니다."""
+        self.client = LazyClient(lambda: create_client(True, hosts, username, password, **options),
+                                 asynchronous=True)
+        self._span_fields: Dict[str, tuple] = {}
+
+    async def close(self):
+        """커넥션 풀을 닫습니다."""
+        await self.client.close()
+
+    async def has_span_fields(self, index_name: str) -> bool:
+        """인덱스에 펼친 span 필드가 매핑되어 있는지 반환합니다. 없으면 일정 시간 뒤 다시 확인합니다."""
+        cached = self._span_fields.get(index_name)
+        if cached is not None and (cached[0] or time.monotonic() - cached[1] < SPAN_FIELDS_RECHECK):
+            return cached[0]
+        try:
+            response = await self.client.indices.get_mapping(index=index_name)
+            ready = self.mapping_has_span_fields(dict(response))
+        except Exception:
+            logger.exception("매핑 확인 오류")
+            ready = False
+        self._span_fields[index_name] = (ready, time.monotonic())
+        return ready
+
+    async def get_span_metrics(self, index_name: str, start: Optional[int] = None, end: Optional[int] = None,
+                               trace_ids: Optional[List[str]] = None, hosts: Optional[List[str]] = None,
+                               top_size: int = 100) -> Optional[Dict]:
+        """span 메트릭을 클러스터에서 집계합니다. 실패하면 None입니다."""
+        try:
+            response = await self.client.search(index=index_name, body=self.span_metrics_query(
+                start, end, trace_ids, hosts, top_size))
+            return self.parse_span_metrics(response)
+        except Exception:
+            logger.exception("메트릭 집계 오류")
+            return None
+
+    async def get_span_bounds(self, index_name: str, trace_ids: Optional[List[str]] = None,
+                              hosts: Optional[List[str]] = None) -> Optional[Tuple[int, int]]:
+        """span startTime의 (최솟값, 최댓값)을 클러스터에서 구합니다. span이 없거나 실패하면 None입니다."""
+        try:
+            response = await self.client.search(index=index_name, body=self.span_bounds_query(trace_ids, hosts))
+            return self.parse_span_bounds(response)
+        except Exception:
+            logger.exception("범위 집계 오류")
+            return None
+
+    async def get_span_histogram(self, index_name: str, start: int, end: int, interval: int,
+                                 trace_ids: Optional[List[str]] = None,
+                                 hosts: Optional[List[str]] = None) -> Optional[Dict[int, Dict]]:
+        """span 히스토그램 버킷(버킷 시작 -> 버킷)을 클러스터에서 집계합니다. 실패하면 None입니다."""
+        try:
+            response = await self.client.search(index=index_name, body=self.span_histogram_query(
+                start, end, interval, trace_ids, hosts))
+            return self.parse_span_histogram(response)
+        except Exception:
+            logger.exception("히스토그램 집계 오류")
+            return None
+
+    async def check_index_status(self, index_name: str) -> Dict:
+        """인덱스 상태를 확인합니다."""
+        try:
+            if not await self.client.indices.exists(index=index_name):
+                return {"status": "error", "message": f"인덱스 '{index_name}'이 존재하지 않습니다."}
+
+            index_info = await self.client.indices.get(index=index_name)
+            doc_count = await self.client.count(index=index_name)
+
+            return {
+                "status": "success",
+                "index_name": index_name,
+                "document_count": doc_count['count'],
+                "index_info": dict(index_info)
+            }
         except Exception as e:
-            print(f"분석 오류: {e}")
-            return {} 
\ No newline at end of file
+            return {"status": "error", "message": str(e)}
+
+    async def get_index_version(self, index_name: str) -> Optional[tuple]:
+        """인덱스의 (문서 수, 최대 _seq_no)를 반환합니다. 캐시 무효화에 사용됩니다."""
+        try:
+            response = await self.client.search(index=index_name, body=self.index_version_query())
+            return self.parse_index_version(response)
+        except Exception:
+            logger.exception("버전 확인 오류")
+            return None
+
+    async def iter_batches(self, index_name: str, query: Optional[Dict] = None, batch_size: int = 500,
+                           source=None, sort: Optional[List] = None,
+                           keep_alive: str = "1m") -> AsyncIterator[List[Dict]]:
+        """point-in-time과 search_after로 전체 결과를 batch_size 단위로 순회합니다."""
+        pit_id = (await self.client.open_point_in_time(index=index_name, keep_alive=keep_alive))['id']
+        try:
+            search_after = None
+            while True:
+                body = self.pit_page_query(pit_id, keep_alive, batch_size, query, source, sort, search_after)
+                response = await self.client.search(body=body)
+                pit_id = response.get('pit_id', pit_id)
+                hits = response['hits']['hits']
+                if not hits:
+                    return
+                yield hits
+                if len(hits) < batch_size:
+                    return
+                search_after = hits[-1]['sort']
+        finally:
+            try:
+                await self.client.close_point_in_time(id=pit_id)
+            except Exception:
+                logger.exception("PIT 종료 오류")
+
+    async def iter_hits(self, index_name: str, query: Optional[Dict] = None, batch_size: int = 500,
+                        source=None, sort: Optional[List] = None,
+                        keep_alive: str = "1m") -> AsyncIterator[Dict]:
+        """iter_batches의 결과를 문서 단위로 반환합니다."""
+        async for batch in self.iter_batches(index_name, query, batch_size, source, sort, keep_alive):
+            for hit in batch:
+                yield hit
+
+    async def search_security_alerts(self, index_name: str, limit: int = 100) -> List[Dict]:
+        """보안 알림이 포함된 이벤트를 검색합니다."""
+        try:
+            response = await self.client.search(index=index_name, body=self.security_alerts_query(limit))
+            return response['hits']['hits']
+        except Exception:
+            logger.exception("검색 오류")
+            return []
+
+    async def get_all_data(self, index_name: str, limit: int = 10) -> List[Dict]:
+        """모든 데이터를 가져옵니다."""
+        try:
+            response = await self.client.search(index=index_name, body=self.match_all_query(limit))
+            return response['hits']['hits']
+        except Exception:
+            logger.exception("검색 오류")
+            return []
+
+    async def get_process_events(self, index_name: str, limit: int = 100) -> List[Dict]:
+        """프로세스 생성 이벤트를 검색합니다."""
+        try:
+            response = await self.client.search(index=index_name, body=self.match_all_query(limit))
+            return response['hits']['hits']
+        except Exception:
+            logger.exception("검색 오류")
+            return []
+
+    async def get_file_events(self, index_name: str, limit: int = 100) -> List[Dict]:
+        """파일 생성 이벤트를 검색합니다."""
+        try:
+            response = await self.client.search(index=index_name, body=self.file_events_query(limit))
+            return response['hits']['hits']
+        except Exception:
+            logger.exception("검색 오류")
+            return []
+
+    async def analyze_security_patterns(self, index_name: str) -> Dict:
+        """보안 패턴을 분석합니다."""
+        try:
+            flattened = await self.has_span_fields(index_name)
+            response = await self.client.search(index=index_name, body=self.security_patterns_query(flattened))
+            return self.parse_security_patterns(response, flattened)
+        except Exception:
+            logger.exception("분석 오류")
+            return {}
+
+    async def search_by_process_id(self, index_name: str, process_id: int) -> List[Dict]:
+        """특정 프로세스 ID의 모든 이벤트를 검색합니다."""
+        query = self.process_id_query(process_id)
+        try:
+            return [hit async for hit in self.iter_hits(index_name, query=query['query'], sort=query['sort'])]
+        except Exception:
+            logger.exception("검색 오류")
+            return []
+
+    async def get_timeline_analysis(self, index_name: str, interval: str = '1m') -> Dict:
+        """시간대별 이벤트 분석을 수행합니다. interval은 '30s', '5m' 같은 고정 간격입니다."""
+        try:
+            response = await self.client.search(index=index_name, body=self.timeline_query(interval))
+            return response['aggregations']['events_over_time']['buckets']
+        except Exception:
+            logger.exception("분석 오류")
+            return {}
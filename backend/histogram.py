@@ -0,0 +1,177 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+import numpy as np
+import orjson
+
+# 마이크로초 단위 시간 단위 (span startTime은 마이크로초입니다)
+UNITS = {"s": 1_000_000, "m": 60_000_000, "h": 3_600_000_000, "d": 86_400_000_000}
+
+# 자동으로 고를 수 있는 버킷 간격
+NICE_INTERVALS = ["1s", "2s", "5s", "10s", "15s", "30s", "1m", "2m", "5m", "10m", "15m", "30m",
+                  "1h", "3h", "6h", "12h", "1d", "7d", "30d"]
+
+DOWNSAMPLE_METHODS = ("lttb", "minmax")
+
+
+def parse_interval(text: str) -> int:
+    """'30s', '5m', '1h', '1d' 형식의 간격을 마이크로초로 변환합니다."""
+    value, unit = str(text)[:-1], str(text)[-1:]
+    if unit not in UNITS or not value.isdigit() or int(value) <= 0:
+        raise ValueError(f"잘못된 간격: {text}")
+    return int(value) * UNITS[unit]
+
+
+def format_interval(interval: int) -> str:
+    """마이크로초 간격을 나누어 떨어지는 가장 큰 단위로 표시합니다 (Elasticsearch fixed_interval 형식)."""
+    for unit in ("d", "h", "m", "s"):
+        if interval % UNITS[unit] == 0:
+            return f"{interval // UNITS[unit]}{unit}"
+    return f"{max(interval // 1000, 1)}ms"
+
+
+def choose_interval(start: int, end: int, target: int) -> int:
+    """[start, end] 범위를 target개 이하의 버킷으로 나누는 가장 작은 NICE_INTERVALS 간격을 반환합니다."""
+    span = max(end - start, 1)
+    for text in NICE_INTERVALS:
+        interval = parse_interval(text)
+        if span / interval <= target:
+            return interval
+    return parse_interval(NICE_INTERVALS[-1])
+
+
+def empty_bucket(key: int) -> Dict:
+    return {"key": key, "count": 0, "alerts": 0, "eventTypes": {}}
+
+
+def lttb(values: List[float], threshold: int) -> List[int]:
+    """Largest-Triangle-Three-Buckets로 모양을 유지하는 threshold개 점의 위치를 고릅니다.
+
+    x는 위치(등간격 버킷)로 봅니다. 첫 점과 마지막 점은 항상 포함합니다.
+    """
+    size = len(values)
+    if threshold >= size or size < 3:
+        return list(range(size))
+    threshold = max(threshold, 3)
+    y = np.asarray(values, dtype=float)
+    selected = [0]
+    every = (size - 2) / (threshold - 2)
+    previous = 0
+    for bucket in range(threshold - 2):
+        low = int(bucket * every) + 1
+        high = int((bucket + 1) * every) + 1
+        # 다음 구간의 평균점
+        next_low, next_high = high, min(int((bucket + 2) * every) + 1, size)
+        average_x = (next_low + next_high - 1) / 2
+        average_y = y[next_low:next_high].mean() if next_high > next_low else y[-1]
+        candidates = np.arange(low, high)
+        areas = np.abs((previous - average_x) * (y[candidates] - y[previous])
+                       - (previous - candidates) * (average_y - y[previous]))
+        previous = int(candidates[int(np.argmax(areas))])
+        selected.append(previous)
+    selected.append(size - 1)
+    return selected
+
+
+def min_max(values: List[float], threshold: int) -> List[int]:
+    """값을 threshold/2개 구간으로 나눠 구간마다 최솟값과 최댓값 위치를 시간순으로 고릅니다."""
+    size = len(values)
+    if threshold >= size:
+        return list(range(size))
+    y = np.asarray(values, dtype=float)
+    groups = max(threshold // 2, 1)
+    selected = set()
+    for part in np.array_split(np.arange(size), groups):
+        if len(part):
+            selected.add(int(part[np.argmin(y[part])]))
+            selected.add(int(part[np.argmax(y[part])]))
+    return sorted(selected)
+
+
+def downsample(buckets: List[Dict], method: str, points: int, field: str = "count") -> List[Dict]:
+    """차트용으로 buckets를 points개 안팎으로 줄입니다. 고른 버킷은 원래 값을 그대로 유지합니다."""
+    values = [bucket[field] for bucket in buckets]
+    positions = lttb(values, points) if method == "lttb" else min_max(values, points)
+    return [buckets[position] for position in positions]
+
+
+class BucketCache:
+    """끝난(닫힌) 시간 버킷의 집계 결과를 보관하는 LRU 캐시입니다.
+
+    닫힌 구간의 결과는 바뀌지 않으므로 같은 범위를 다시 그릴 때는 열린(최근) 버킷과
+    캐시에 없는 버킷만 새로 집계합니다. 버킷 끝이 `settle`초보다 오래된 경우만 닫힌 것으로 봅니다.
+    늦게 색인된 문서나 재색인으로 닫힌 버킷도 바뀔 수 있으므로 항목은 데이터 버전별로 구분합니다.
+    shared(SharedCache)를 주면 닫힌 버킷을 다른 워커와 나눠 쓰는 2차 캐시로 사용합니다.
+    """
+
+    def __init__(self, max_buckets: int = None, settle: float = None, shared=None):
+        self.max_buckets = max_buckets or int(os.getenv('HISTOGRAM_CACHE_BUCKETS', '100000'))
+        self.settle = settle if settle is not None else float(os.getenv('HISTOGRAM_SETTLE_SECONDS', '300'))
+        self.shared = shared
+        self.shared_ttl = float(os.getenv('HISTOGRAM_SHARED_TTL', '86400'))
+        self._entries: "OrderedDict[Tuple, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    async def histogram(self, scope: Hashable, start: int, end: int, interval: int, now: int,
+                        fetch: Callable[[int, int, int], Awaitable[Optional[Dict[int, Dict]]]],
+                        version: Hashable = '') -> Tuple[List[Dict], int]:
+        """[start, end]를 덮는 interval 간격 버킷 목록과 캐시에서 가져온 버킷 수를 반환합니다.
+
+        범위는 버킷 경계에 맞춰 넓히므로 부분 버킷은 없습니다. fetch(start, end, interval)는 버킷 시작
+        -> 버킷 dict를 반환하고, 실패하면 None을 반환합니다. 시간은 모두 마이크로초입니다.
+        version은 집계 대상 데이터의 버전(인덱스 버전 등)이며, None이면 확인할 수 없으므로 캐시를 쓰지 않습니다.
+        """
+        keys = list(range(start - start % interval, end + 1, interval))
+        scope = (scope, version)
+        with self._lock:
+            found = {}
+            for key in keys if version is not None else ():
+                bucket = self._entries.get((scope, interval, key))
+                if bucket is not None:
+                    self._entries.move_to_end((scope, interval, key))
+                    found[key] = bucket
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+
+        missing = [key for key in keys if key not in found]
+        if missing and self.shared is not None and version is not None:
+            names = {f"hist:{scope[0]!r}:{interval}:{key}": key for key in missing}
+            shared = await self.shared.read_many(list(names), repr(version))
+            with self._lock:
+                for name, data in shared.items():
+                    key = names[name]
+                    found[key] = self._entries[(scope, interval, key)] = orjson.loads(data)
+                self.hits += len(shared)
+                self.misses -= len(shared)
+                while len(self._entries) > self.max_buckets:
+                    self._entries.popitem(last=False)
+            missing = [key for key in missing if key not in found]
+        if missing:
+            # 캐시에 없는 버킷을 모두 덮는 구간을 한 번에 집계합니다.
+            fetched = await fetch(missing[0], missing[-1] + interval - 1, interval)
+            if fetched is None:
+                raise RuntimeError("히스토그램 집계에 실패했습니다.")
+            closed_before = now - int(self.settle * 1_000_000)
+            closed = []
+            with self._lock:
+                for key in missing:
+                    bucket = found[key] = fetched.get(key) or empty_bucket(key)
+                    if version is not None and key + interval <= closed_before:
+                        self._entries[(scope, interval, key)] = bucket
+                        closed.append(key)
+                while len(self._entries) > self.max_buckets:
+                    self._entries.popitem(last=False)
+            if closed and self.shared is not None:
+                await self.shared.write_many([(f"hist:{scope[0]!r}:{interval}:{key}", orjson.dumps(found[key]))
+                                              for key in closed], self.shared_ttl, repr(version))
+        return [found[key] for key in keys], len(keys) - len(missing)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        return {"size": len(self._entries), "capacity": self.max_buckets, "hits": self.hits, "misses": self.misses}
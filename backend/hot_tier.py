@@ -0,0 +1,395 @@
+import asyncio
+import bisect
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from functools import lru_cache
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from metrics_aggregator import _epoch_seconds
+from span_store import SpanStore, SpanStoreBuilder, concat_stores, process_hosts
+
+logger = logging.getLogger(__name__)
+
+# security-logs 매핑의 필드 종류 (query_string을 메모리에서 평가할 때 사용)
+KEYWORD_FIELDS = ("event_type", "severity", "user", "protocol", "status", "source_ip", "destination_ip")
+NUMERIC_FIELDS = ("port", "bytes")
+TEXT_FIELDS = ("message",)
+
+# 메모리에서 평가하지 않는 query_string 문법 (구문, 와일드카드, 범위, 그룹, 부정, 부스트 등)
+_UNSUPPORTED = re.compile(r'["*?~^()\[\]{}<>=!\\/+\-&|]')
+_WORDS = re.compile(r"\w+")
+
+
+def _words(text) -> List[str]:
+    """standard 분석기처럼 소문자 단어 토큰으로 나눕니다."""
+    return _WORDS.findall(str(text).lower())
+
+
+def _term_matcher(field: Optional[str], value: str) -> Optional[Callable[[Dict], bool]]:
+    if field is None:
+        # 기본 필드(*)는 모든 필드에서 찾습니다. 여러 토큰으로 나뉘는 값은 메모리에서 평가하지 않습니다.
+        if _words(value) != [value.lower()]:
+            return None
+        number = int(value) if value.isdigit() else None
+        word = value.lower()
+        return lambda log: (any(log.get(name) == value for name in KEYWORD_FIELDS)
+                            or (number is not None and any(log.get(name) == number for name in NUMERIC_FIELDS))
+                            or any(word in _words(log.get(name) or '') for name in TEXT_FIELDS))
+    if field in KEYWORD_FIELDS:
+        return lambda log: log.get(field) == value
+    if field in NUMERIC_FIELDS:
+        if not value.isdigit():
+            return None
+        number = int(value)
+        return lambda log: log.get(field) == number
+    if field in TEXT_FIELDS:
+        if _words(value) != [value.lower()]:
+            return None
+        word = value.lower()
+        return lambda log: word in _words(log.get(field) or '')
+    # timestamp 등 나머지 필드는 클러스터에 맡깁니다.
+    return None
+
+
+@lru_cache(maxsize=256)
+def compile_query(text: str) -> Optional[Callable[[Dict], bool]]:
+    """query_string 중 단순한 형태(`*`, 단어, `필드:값`을 공백/OR 또는 AND로 연결)를 로그 판정 함수로 바꿉니다.
+
+    그 밖의 문법은 결과가 달라질 수 있으므로 None을 반환하고, 호출하는 쪽은 클러스터로 조회합니다.
+    """
+    tokens = str(text).split()
+    if not tokens or tokens == ["*"]:
+        return lambda log: True
+    conjunction = "AND" in tokens
+    if "NOT" in tokens or (conjunction and "OR" in tokens):
+        return None
+    if conjunction:
+        # a AND b AND c 형태만 허용합니다.
+        if len(tokens) % 2 == 0 or any(token != "AND" for token in tokens[1::2]):
+            return None
+        terms = tokens[::2]
+    else:
+        # query_string의 기본 연산자는 OR입니다.
+        terms = [token for token in tokens if token != "OR"]
+
+    matchers = []
+    for term in terms:
+        field, _, value = term.rpartition(':') if ':' in term else (None, '', term)
+        if field == '' or not value or _UNSUPPORTED.search(value) or (field and _UNSUPPORTED.search(field)):
+            return None
+        matcher = _term_matcher(field or None, value)
+        if matcher is None:
+            return None
+        matchers.append(matcher)
+    if conjunction:
+        return lambda log: all(matcher(log) for matcher in matchers)
+    return lambda log: any(matcher(log) for matcher in matchers)
+
+
+class RecentLogs:
+    """최근 `minutes`분의 보안 로그를 timestamp 순으로 보관하는 메모리 계층입니다.
+
+    수집 요청과 follower가 채우며 `_id`로 중복을 거릅니다. `complete_since`(초) 이후의 로그는
+    빠짐없이 가지고 있으므로 그 범위의 조회는 클러스터 대신 여기서 처리합니다. `listeners`에는
+    새로 추가된 hit 목록을 한 번씩만 넘기므로, 다른 워커나 외부에서 쓴 로그도 follower를 통해 받습니다.
+    """
+
+    def __init__(self, minutes: float = None, max_logs: int = None):
+        self.retention = (minutes or float(os.getenv('HOT_TIER_MINUTES', '15'))) * 60
+        self.max_logs = max_logs or int(os.getenv('HOT_TIER_MAX_LOGS', '200000'))
+        self.complete_since: Optional[float] = None
+        self._times: List[float] = []
+        self._hits: List[Dict] = []
+        self._ids = set()
+        self._lock = threading.Lock()
+        self.listeners: List[Callable[[List[Dict]], None]] = []
+        self.hits = 0
+        self.misses = 0
+
+    def start(self, since: float):
+        """since(초) 이후의 로그를 모두 받은 뒤 호출해 그때부터 조회에 쓰도록 합니다."""
+        with self._lock:
+            if self.complete_since is None:
+                self.complete_since = since
+
+    def add(self, ids: List[str], docs: List[Dict], index: str = "security-logs") -> int:
+        """저장된 로그를 추가하고 새로 추가한 수를 반환합니다. 시작 전이면 follower의 초기 적재에 맡깁니다."""
+        if self.complete_since is None:
+            return 0
+        return self.observe([{"_index": index, "_id": doc_id, "_source": doc} for doc_id, doc in zip(ids, docs)])
+
+    def observe(self, hits: List[Dict]) -> int:
+        added = []
+        with self._lock:
+            for hit in hits:
+                if hit.get('_id') in self._ids:
+                    continue
+                source = hit['_source']
+                timestamp = _epoch_seconds(source.get('timestamp'))
+                if timestamp is None:
+                    continue
+                if isinstance(source.get('timestamp'), datetime):
+                    # 수집 요청의 datetime은 클러스터에 저장된 것과 같은 ISO 문자열로 보관합니다.
+                    hit = {**hit, "_source": {**source, "timestamp": source['timestamp'].isoformat()}}
+                position = bisect.bisect_right(self._times, timestamp)
+                self._times.insert(position, timestamp)
+                self._hits.insert(position, hit)
+                self._ids.add(hit.get('_id'))
+                added.append(hit)
+            self._evict(time.time() - self.retention)
+        if added:
+            for listener in self.listeners:
+                try:
+                    listener(added)
+                except Exception:
+                    logger.exception("최근 로그 리스너 오류")
+        return len(added)
+
+    def boundary(self, end: float) -> Optional[float]:
+        """[?, end] 조회에서 메모리로 처리할 수 있는 구간의 시작(초)을 반환합니다. 겹치지 않으면 None입니다."""
+        since = self.complete_since
+        return since if since is not None and end >= since else None
+
+    def search(self, matcher: Callable[[Dict], bool], start: float, end: float, size: int) -> List[Dict]:
+        """[start, end] 범위에서 matcher에 맞는 로그를 최신순으로 최대 size개 반환합니다."""
+        with self._lock:
+            low = bisect.bisect_left(self._times, start)
+            high = bisect.bisect_right(self._times, end)
+            matched = []
+            for position in range(high - 1, low - 1, -1):
+                if matcher(self._hits[position]['_source']):
+                    matched.append(self._hits[position])
+                    if len(matched) >= size:
+                        break
+        return matched
+
+    def window(self, start: float, end: float, size: int) -> List[Dict]:
+        """[start, end] 범위의 로그 본문을 최근 것부터 최대 size개, 시간순으로 반환합니다."""
+        with self._lock:
+            low = bisect.bisect_left(self._times, start)
+            high = bisect.bisect_right(self._times, end)
+            return [hit['_source'] for hit in self._hits[max(low, high - size):high]]
+
+    def record(self, local: bool):
+        """조회를 메모리만으로 처리했는지(local) 클러스터도 조회했는지 셉니다."""
+        if local:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def stats(self) -> Dict:
+        return {
+            "size": len(self._hits),
+            "capacity": self.max_logs,
+            "completeSince": self.complete_since,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+    def _evict(self, cutoff: float):
+        # 보관 기간을 지났거나 용량을 넘은 오래된 로그를 지우고, 그만큼 완전한 구간의 시작을 늦춥니다.
+        count = max(bisect.bisect_left(self._times, cutoff), len(self._times) - self.max_logs)
+        if count <= 0:
+            return
+        for hit in self._hits[:count]:
+            self._ids.discard(hit.get('_id'))
+        evicted_until = self._times[count - 1]
+        del self._times[:count]
+        del self._hits[:count]
+        self.complete_since = max(self.complete_since or cutoff, cutoff, evicted_until + 1e-6)
+
+
+class RecentSpans:
+    """최근 `minutes`분의 span을 follower가 읽은 묶음(SpanStore) 단위로 보관하는 메모리 계층입니다.
+
+    조회할 때는 묶음을 하나의 SpanStore로 이어 붙여(변경될 때까지 재사용) 기존 집계 함수를 그대로 씁니다.
+    startTime(마이크로초)이 `complete_since` 이후인 span은 follower 지연만큼을 빼고 모두 가지고 있습니다.
+    """
+
+    def __init__(self, minutes: float = None, max_spans: int = None):
+        self.retention = int((minutes or float(os.getenv('HOT_TIER_MINUTES', '15'))) * 60_000_000)
+        self.max_spans = max_spans or int(os.getenv('HOT_TIER_MAX_SPANS', '500000'))
+        self.complete_since: Optional[int] = None
+        self._segments: Deque[Tuple[int, SpanStore]] = deque()
+        self._merged: Optional[SpanStore] = None
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def start(self, since: int):
+        with self._lock:
+            if self.complete_since is None:
+                self.complete_since = since
+
+    def add(self, store: SpanStore):
+        if len(store) == 0:
+            return
+        with self._lock:
+            self._segments.append((int(store.start_time.max()), store))
+            self._size += len(store)
+            self._merged = None
+            self._evict(int(time.time() * 1_000_000) - self.retention)
+
+    def covers(self, start: Optional[int]) -> bool:
+        return self.complete_since is not None and start is not None and start >= self.complete_since
+
+    def boundary(self, interval: int) -> Optional[int]:
+        """메모리로 온전히 계산할 수 있는 첫 interval 버킷의 시작(마이크로초)을 반환합니다."""
+        since = self.complete_since
+        return -(-since // interval) * interval if since is not None else None
+
+    def store(self) -> SpanStore:
+        with self._lock:
+            if self._merged is None:
+                self._merged = concat_stores([store for _, store in self._segments])
+            return self._merged
+
+    def record(self, local: bool):
+        if local:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def stats(self) -> Dict:
+        return {
+            "size": self._size,
+            "segments": len(self._segments),
+            "capacity": self.max_spans,
+            "completeSince": self.complete_since,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+    def _evict(self, cutoff: int):
+        # 묶음의 마지막 span까지 보관 기간을 지났거나 용량을 넘으면 가장 오래된 묶음부터 지웁니다.
+        while self._segments and (self._segments[0][0] < cutoff or self._size > self.max_spans):
+            newest, store = self._segments.popleft()
+            self._size -= len(store)
+            self.complete_since = max(self.complete_since or 0, newest + 1)
+            self._merged = None
+        if self.complete_since is not None:
+            self.complete_since = max(self.complete_since, cutoff)
+
+
+class TierFollower:
+    """security-logs와 trace 인덱스의 새 데이터를 주기적으로 읽어 메모리 계층을 채웁니다.
+
+    시작할 때 최근 `minutes`분을 한 번 적재한 뒤로는 최고 수위 이후만 조회합니다. 늦게 색인되는
+    데이터를 놓치지 않도록 `lateness`초만큼 겹쳐 읽고, 로그는 `_id`, span은 (traceID, spanID)로 중복을 거릅니다.
+    trace_analyzer를 주면 span 필드가 매핑된 trace 인덱스일 때만 span도 따라갑니다.
+    """
+
+    def __init__(self, logs: RecentLogs, spans: RecentSpans, log_analyzer, trace_analyzer=None,
+                 log_index: str = "security-logs", trace_index: str = "trace",
+                 poll_interval: float = None, lateness: float = None, batch_size: int = None):
+        self.logs = logs
+        self.spans = spans
+        self.log_analyzer = log_analyzer
+        self.trace_analyzer = trace_analyzer
+        self.log_index = log_index
+        self.trace_index = trace_index
+        self.poll_interval = poll_interval or float(os.getenv('HOT_TIER_POLL_INTERVAL', '2'))
+        self.lateness = lateness if lateness is not None else float(os.getenv('HOT_TIER_LATENESS_SECONDS', '5'))
+        self.batch_size = batch_size or int(os.getenv('HOT_TIER_POLL_SIZE', '1000'))
+        self.log_watermark: Optional[float] = None
+        self.span_watermark: Optional[int] = None
+        self._recent_spans: Dict[Tuple[str, str], int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.polls = 0
+        self.errors = 0
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> Dict:
+        now = time.time()
+        return {
+            "polls": self.polls,
+            "errors": self.errors,
+            "logs": self.logs.stats(),
+            "spans": self.spans.stats(),
+            "logLagSeconds": round(now - self.log_watermark, 3) if self.log_watermark is not None else None,
+            "spanWatermark": self.span_watermark
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                await self.poll()
+            except Exception:
+                self.errors += 1
+                logger.exception("최근 데이터 계층 갱신 오류")
+            await asyncio.sleep(self.poll_interval)
+
+    async def poll(self):
+        self.polls += 1
+        await self._poll_logs()
+        if self.trace_analyzer is not None and await self.trace_analyzer.has_span_fields(self.trace_index):
+            await self._poll_spans()
+
+    async def _poll_logs(self):
+        if self.log_watermark is None:
+            since = time.time() - self.logs.retention
+        else:
+            since = self.log_watermark - self.lateness
+        after = None
+        while True:
+            # 날짜 필드는 epoch 밀리초도 받으므로 겹쳐 읽을 시점을 숫자로 지정합니다.
+            hits = await self.log_analyzer.logs_since(self.log_index, int(since * 1000), self.batch_size, after)
+            self.logs.observe(hits)
+            times = [timestamp for timestamp in (_epoch_seconds(hit['_source'].get('timestamp')) for hit in hits)
+                     if timestamp is not None]
+            if times:
+                self.log_watermark = max(self.log_watermark or times[-1], times[-1])
+            # 결과는 (timestamp, _id) 순이므로 가득 찬 페이지면 마지막 hit 다음부터 이어 읽습니다.
+            # 같은 timestamp의 로그가 한 페이지보다 많아도 빠지지 않으며, 짧은 페이지를 받아야 끝까지 읽은 것입니다.
+            if len(hits) < self.batch_size:
+                break
+            after = hits[-1]['sort']
+        self.logs.start(since)
+
+    async def _poll_spans(self):
+        now = int(time.time() * 1_000_000)
+        if self.span_watermark is None:
+            since = now - self.spans.retention
+        else:
+            since = self.span_watermark - int(self.lateness * 1_000_000)
+        query = {"nested": {"path": "spans", "query": {"range": {"spans.startTime": {"gt": since}}}}}
+        builder = SpanStoreBuilder()
+        newest = self.span_watermark if self.span_watermark is not None else since
+        count = 0
+        async for hit in self.trace_analyzer.iter_hits(self.trace_index, query=query,
+                                                       source=["traceID", "spans", "processes"]):
+            source = hit['_source']
+            trace_id = source.get('traceID', '')
+            hosts = process_hosts(source.get('processes'))
+            for span in source.get('spans', []):
+                start_time = span.get('startTime', 0)
+                key = (trace_id, span.get('spanID', ''))
+                if start_time <= since or key in self._recent_spans:
+                    continue
+                self._recent_spans[key] = start_time
+                builder.add_span(span, trace_id, hosts.get(span.get('processID'), ''))
+                newest = max(newest, start_time)
+                count += 1
+        self.spans.start(since + 1)
+        if count:
+            self.spans.add(builder.build())
+        self.span_watermark = newest
+        # 다음 조회에서 겹쳐 읽을 구간의 span만 중복 확인용으로 남깁니다.
+        horizon = newest - int(self.lateness * 1_000_000)
+        self._recent_spans = {key: start for key, start in self._recent_spans.items() if start > horizon}
@@ -0,0 +1,419 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+import orjson
+
+from security_log_analyzer import IndexPartitions
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+# 세그먼트 파일 이름 형식 (번호 순으로 정렬됩니다)
+SEGMENT_FORMAT = "{:012d}.log"
+
+
+class SpoolFull(Exception):
+    """스풀에 쌓인(아직 클러스터에 저장하지 않은) 데이터가 한도를 넘었습니다."""
+
+
+def _lock(handle) -> bool:
+    """파일을 배타적으로 잠급니다. 다른 프로세스가 잡고 있으면 False입니다."""
+    try:
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+class IngestSpool:
+    """API와 클러스터 사이에 두는 추가 전용(append-only) 디스크 스풀입니다.
+
+    문서는 `_id`를 붙여 NDJSON 줄로 현재 세그먼트 파일 끝에 쓰고, 세그먼트가 `segment_bytes`를
+    넘으면 다음 번호의 파일로 넘어갑니다. 읽은 위치(세그먼트, 오프셋)는 commit할 때 cursor 파일에
+    원자적으로 기록하고 다 읽은 세그먼트는 지웁니다. 재시작하면 cursor부터 다시 읽으므로 마지막
+    batch가 두 번 저장될 수 있지만 `_id`가 같아 덮어써집니다.
+
+    워커 프로세스마다 `directory` 아래 잠기지 않은 하위 디렉토리(0, 1, ...)를 하나씩 잠가서 씁니다.
+    종료한 워커의 디렉토리는 다음에 시작한 워커가 이어받아 재생합니다.
+    """
+
+    def __init__(self, directory: str = None, segment_bytes: int = None, max_bytes: int = None,
+                 fsync: bool = None):
+        self.root = directory or os.getenv('INGEST_SPOOL_DIR', os.path.join('data', 'spool'))
+        self.segment_bytes = segment_bytes or int(os.getenv('INGEST_SPOOL_SEGMENT_MB', '64')) * 1024 * 1024
+        self.max_bytes = max_bytes or int(os.getenv('INGEST_SPOOL_MAX_MB', '1024')) * 1024 * 1024
+        self.fsync = fsync if fsync is not None else os.getenv('INGEST_SPOOL_FSYNC', 'false').lower() == 'true'
+        self._lock = threading.Lock()
+        self.directory = None
+        self._lock_file = None
+        self._writer = None
+        self._reader = None
+        self._sizes: Dict[int, int] = {}
+        self._cursor = (0, 0)
+        self._pending = 0
+        self._oldest: Optional[float] = None
+        self.appended = 0
+        self.committed = 0
+        self.rejected = 0
+
+    def open(self):
+        """하위 디렉토리를 잠그고 세그먼트와 cursor를 읽습니다. 여러 번 불러도 한 번만 엽니다."""
+        with self._lock:
+            if self.directory is not None:
+                return
+            os.makedirs(self.root, exist_ok=True)
+            number = 0
+            while True:
+                directory = os.path.join(self.root, str(number))
+                os.makedirs(directory, exist_ok=True)
+                handle = open(os.path.join(directory, "lock"), "a+b")
+                if _lock(handle):
+                    break
+                handle.close()
+                number += 1
+            self.directory, self._lock_file = directory, handle
+            self._recover()
+
+    def close(self):
+        with self._lock:
+            for handle in (self._writer, self._reader, self._lock_file):
+                if handle is not None:
+                    handle.close()
+            self._writer = self._reader = self._lock_file = None
+            self.directory = None
+
+    def append(self, docs: List[Dict]) -> List[str]:
+        """문서를 스풀에 쓰고 부여한 `_id` 목록을 반환합니다. 쌓인 데이터가 max_bytes를 넘으면 SpoolFull입니다."""
+        if not docs:
+            return []
+        spooled_at = time.time()
+        ids = [uuid.uuid4().hex for _ in docs]
+        data = b"".join(orjson.dumps({"id": doc_id, "t": spooled_at, "doc": doc}) + b"\n"
+                        for doc_id, doc in zip(ids, docs))
+        self.open()
+        with self._lock:
+            if self._pending_bytes() + len(data) > self.max_bytes:
+                raise SpoolFull(f"수집 스풀이 가득 찼습니다 ({self.max_bytes // (1024 * 1024)}MB).")
+            segment = max(self._sizes)
+            if self._sizes[segment] >= self.segment_bytes:
+                segment = self._rotate()
+            self._writer.write(data)
+            self._writer.flush()
+            if self.fsync:
+                os.fsync(self._writer.fileno())
+            self._sizes[segment] += len(data)
+            if not self._pending:
+                self._oldest = spooled_at
+            self._pending += len(docs)
+            self.appended += len(docs)
+        return ids
+
+    def read(self, max_docs: int) -> Tuple[List[Dict], Tuple[int, int]]:
+        """cursor부터 max_docs개 이하의 기록과 그 다음 위치를 반환합니다. commit 전에는 cursor가 그대로입니다."""
+        self.open()
+        with self._lock:
+            segment, offset = self._cursor
+            records = []
+            while len(records) < max_docs and segment in self._sizes:
+                end = self._sizes[segment]
+                if offset >= end:
+                    if segment == max(self._sizes):
+                        break
+                    segment, offset = segment + 1, 0
+                    continue
+                reader = self._open_reader(segment)
+                reader.seek(offset)
+                while len(records) < max_docs and offset < end:
+                    line = reader.readline()
+                    offset += len(line)
+                    try:
+                        records.append(orjson.loads(line))
+                    except orjson.JSONDecodeError:
+                        # 손상된 줄은 클러스터로 보낼 문서가 아니므로 기록만 하고 건너뜁니다.
+                        logger.error("스풀의 읽을 수 없는 기록을 건너뜁니다",
+                                     extra={"segment": self._path(segment), "offset": offset - len(line)})
+                        self._pending = max(self._pending - 1, 0)
+            if records:
+                self._oldest = records[0]["t"]
+            return records, (segment, offset)
+
+    def commit(self, position: Tuple[int, int], count: int):
+        """position까지 처리했다고 기록하고 다 읽은 세그먼트를 지웁니다."""
+        with self._lock:
+            self._write_cursor(position)
+            self._cursor = position
+            for segment in [segment for segment in self._sizes if segment < position[0]]:
+                self._remove(segment)
+            self._pending = max(self._pending - count, 0)
+            self.committed += count
+            if not self._pending:
+                self._oldest = None
+
+    def reject(self, records: List[Dict], errors: List[str]):
+        """클러스터가 거부한 문서(매핑 오류 등)를 rejected.ndjson에 남깁니다."""
+        with self._lock:
+            with open(os.path.join(self.directory, "rejected.ndjson"), "ab") as handle:
+                for record, error in zip(records, errors):
+                    handle.write(orjson.dumps({**record, "error": error}) + b"\n")
+            self.rejected += len(records)
+
+    def lag_seconds(self) -> float:
+        """가장 오래된 미처리 문서가 스풀에 들어온 뒤 지난 시간입니다."""
+        oldest = self._oldest
+        return round(max(time.time() - oldest, 0.0), 3) if self._pending and oldest is not None else 0.0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            pending_bytes = self._pending_bytes() if self.directory is not None else 0
+            segments = len(self._sizes)
+        return {
+            "directory": self.directory,
+            "pendingDocs": self._pending,
+            "pendingBytes": pending_bytes,
+            "capacityBytes": self.max_bytes,
+            "lagSeconds": self.lag_seconds(),
+            "segments": segments,
+            "appended": self.appended,
+            "committed": self.committed,
+            "rejected": self.rejected
+        }
+
+    def _recover(self):
+        # 세그먼트 크기와 cursor를 읽고, 쓰다 끊긴 마지막 줄은 잘라냅니다.
+        segments = sorted(int(name[:-4]) for name in os.listdir(self.directory)
+                          if name.endswith(".log") and name[:-4].isdigit())
+        self._sizes = {segment: os.path.getsize(self._path(segment)) for segment in segments}
+        cursor = self._valid_cursor(self._read_cursor(), segments)
+        self._cursor = cursor
+        if segments:
+            last = segments[-1]
+            with open(self._path(last), "r+b") as handle:
+                data = handle.read()
+                complete = data.rfind(b"\n") + 1
+                if complete < len(data):
+                    logger.warning("스풀 세그먼트의 끊긴 마지막 기록을 버립니다: %s", self._path(last))
+                    handle.truncate(complete)
+                    self._sizes[last] = complete
+            self._writer = open(self._path(last), "ab")
+        else:
+            self._sizes = {cursor[0]: 0}
+            self._writer = open(self._path(cursor[0]), "ab")
+
+        # 남아 있는 미처리 문서 수와 가장 오래된 기록 시각
+        self._pending = 0
+        self._oldest = None
+        for segment in sorted(self._sizes):
+            if segment < cursor[0]:
+                continue
+            with open(self._path(segment), "rb") as handle:
+                if segment == cursor[0]:
+                    handle.seek(cursor[1])
+                data = handle.read()
+            if data and self._oldest is None:
+                try:
+                    self._oldest = orjson.loads(data[:data.index(b"\n")])["t"]
+                except (orjson.JSONDecodeError, KeyError, TypeError):
+                    self._oldest = time.time()
+            self._pending += data.count(b"\n")
+        if self._pending:
+            logger.info("스풀에 남은 문서를 재생합니다", extra={"directory": self.directory, "docs": self._pending})
+
+    def _valid_cursor(self, cursor: Tuple[int, int], segments: List[int]) -> Tuple[int, int]:
+        # 오프셋은 cursor의 세그먼트가 남아 있고 그 안의 줄 경계일 때만 씁니다. 세그먼트가 없어졌으면
+        # 같은 번호 이후의 첫 세그먼트(없으면 처음 세그먼트)를 처음부터 읽습니다.
+        segment, offset = cursor
+        if segment not in segments:
+            later = [number for number in segments if number >= segment]
+            if segments or offset:
+                logger.warning("스풀 cursor의 세그먼트가 없어 처음부터 읽습니다", extra={"cursor": list(cursor)})
+            return (later[0] if later else segments[0] if segments else segment), 0
+        if offset > 0:
+            with open(self._path(segment), "rb") as handle:
+                handle.seek(offset - 1)
+                boundary = handle.read(1)
+            if boundary != b"\n":
+                logger.warning("스풀 cursor가 줄 경계가 아니어서 세그먼트를 처음부터 읽습니다",
+                               extra={"cursor": list(cursor)})
+                return segment, 0
+        return segment, offset
+
+    def _rotate(self) -> int:
+        segment = max(self._sizes) + 1
+        self._writer.close()
+        self._writer = open(self._path(segment), "ab")
+        self._sizes[segment] = 0
+        return segment
+
+    def _remove(self, segment: int):
+        if self._reader is not None and self._reader.name == self._path(segment):
+            self._reader.close()
+            self._reader = None
+        del self._sizes[segment]
+        try:
+            os.remove(self._path(segment))
+        except OSError:
+            logger.exception("스풀 세그먼트 삭제 오류")
+
+    def _open_reader(self, segment: int):
+        path = self._path(segment)
+        if self._reader is None or self._reader.name != path:
+            if self._reader is not None:
+                self._reader.close()
+            self._reader = open(path, "rb")
+        return self._reader
+
+    def _pending_bytes(self) -> int:
+        segment, offset = self._cursor
+        return sum(size for number, size in self._sizes.items() if number >= segment) - offset
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, SEGMENT_FORMAT.format(segment))
+
+    def _read_cursor(self) -> Tuple[int, int]:
+        try:
+            with open(os.path.join(self.directory, "cursor.json"), "rb") as handle:
+                cursor = orjson.loads(handle.read())
+            return cursor["segment"], cursor["offset"]
+        except FileNotFoundError:
+            return 0, 0
+
+    def _write_cursor(self, position: Tuple[int, int]):
+        path = os.path.join(self.directory, "cursor.json")
+        with open(path + ".tmp", "wb") as handle:
+            handle.write(orjson.dumps({"segment": position[0], "offset": position[1]}))
+            if self.fsync:
+                handle.flush()
+                os.fsync(handle.fileno())
+        os.replace(path + ".tmp", path)
+
+
+class SpoolReplayer:
+    """스풀의 문서를 bulk로 클러스터에 저장하는 백그라운드 스레드입니다.
+
+    연결 실패, 429, 5xx는 `backoff`초부터 두 배씩(최대 `max_backoff`초) 기다렸다가 그 문서만 다시
+    보내며, 한 batch가 모두 저장(또는 거부)되어야 cursor를 옮깁니다. 그 밖의 오류(매핑 오류 등)는
+    다시 보내도 실패하므로 rejected.ndjson에 남기고 넘어갑니다.
+    """
+
+    def __init__(self, spool: IngestSpool, client, index_name: str, batch_size: int = None,
+                 backoff: float = None, max_backoff: float = None, poll_interval: float = None,
+                 partitions: IndexPartitions = None):
+        self.spool = spool
+        self.client = client
+        self.index_name = index_name
+        self.partitions = partitions or IndexPartitions()
+        self.batch_size = batch_size or int(os.getenv('INGEST_SPOOL_BATCH', '1000'))
+        self.min_backoff = backoff or float(os.getenv('INGEST_SPOOL_BACKOFF', '0.5'))
+        self.max_backoff = max_backoff or float(os.getenv('INGEST_SPOOL_MAX_BACKOFF', '30'))
+        self.poll_interval = poll_interval or float(os.getenv('INGEST_SPOOL_POLL_INTERVAL', '0.2'))
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.backoff = 0.0
+        self.batches = 0
+        self.retries = 0
+        self.indexed = 0
+        self.last_error: Optional[str] = None
+
+    def start(self):
+        if self._thread is None:
+            self.spool.open()
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="ingest-spool-replayer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """스레드를 멈춥니다. 남은 문서는 스풀에 그대로 두고 다음 시작 때 재생합니다."""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def notify(self):
+        """새 문서가 들어왔음을 알려 대기 중인 스레드를 깨웁니다."""
+        self._wake.set()
+
+    def stats(self) -> Dict:
+        return {
+            **self.spool.stats(),
+            "indexed": self.indexed,
+            "batches": self.batches,
+            "retries": self.retries,
+            "backoffSeconds": self.backoff,
+            "lastError": self.last_error
+        }
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                records, position = self.spool.read(self.batch_size)
+            except Exception:
+                logger.exception("스풀 읽기 오류")
+                self._stopped.wait(self.max_backoff)
+                continue
+            if not records:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            if self._replay(records):
+                self.spool.commit(position, len(records))
+                self.batches += 1
+
+    def _replay(self, records: List[Dict]) -> bool:
+        """records를 모두 저장(또는 거부)하면 True, 그 전에 멈추면 False입니다."""
+        pending = records
+        while pending:
+            retry, rejected, errors = self._send(pending)
+            if rejected:
+                logger.warning("클러스터가 거부한 스풀 문서를 rejected.ndjson에 남깁니다",
+                               extra={"docs": len(rejected), "error": errors[0]})
+                self.spool.reject(rejected, errors)
+            self.indexed += len(pending) - len(retry) - len(rejected)
+            if not retry:
+                self.backoff = 0.0
+                return True
+            self.retries += 1
+            self.backoff = min(max(self.backoff * 2, self.min_backoff), self.max_backoff)
+            if self._stopped.wait(self.backoff):
+                return False
+            pending = retry
+        return True
+
+    def _send(self, records: List[Dict]) -> Tuple[List[Dict], List[Dict], List[str]]:
+        """bulk로 보내고 (다시 보낼 기록, 거부된 기록, 거부 사유)를 반환합니다."""
+        from opensearchpy import helpers
+        actions = ({"_index": self.partitions.index_for(self.index_name, record["doc"].get("timestamp")),
+                    "_id": record["id"], "_source": record["doc"]} for record in records)
+        retry, rejected, errors = [], [], []
+        try:
+            results = helpers.streaming_bulk(self.client, actions, chunk_size=self.batch_size, max_retries=0,
+                                             raise_on_error=False, raise_on_exception=False)
+            for record, (ok, info) in zip(records, results):
+                if ok:
+                    continue
+                _, item = info.popitem()
+                status = item.get('status')
+                if not isinstance(status, int) or status == 429 or status >= 500:
+                    retry.append(record)
+                    self.last_error = str(item.get('error') or item.get('exception'))
+                else:
+                    rejected.append(record)
+                    errors.append(str(item.get('error')))
+        except Exception as e:
+            logger.exception("스풀 재생 중 오류 발생")
+            self.last_error = str(e)
+            done = {record["id"] for record in rejected}
+            return [record for record in records if record["id"] not in done], rejected, errors
+        return retry, rejected, errors
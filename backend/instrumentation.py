@@ -0,0 +1,371 @@
+import atexit
+import contextvars
+import logging
+import os
+import queue
+import re
+import sys
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from typing import Callable, Dict, List, Optional
+import orjson
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# PROMETHEUS_MULTIPROC_DIR을 지정하면 워커마다 카운터/히스토그램 값을 그 디렉토리의 파일에 쓰고
+# /metrics는 모든 워커의 값을 합쳐 반환합니다. 지정하지 않으면 /metrics는 응답한 워커의 값만 담습니다.
+MULTIPROCESS = bool(os.getenv('PROMETHEUS_MULTIPROC_DIR'))
+
+# 시간을 재는 검색 클라이언트 메서드 (나머지 속성은 그대로 전달합니다)
+BACKEND_METHODS = ("search", "count", "bulk", "index", "get", "open_point_in_time",
+                   "close_point_in_time", "update_by_query")
+
+REQUEST_SECONDS = Histogram(
+    "aidetector_http_request_duration_seconds", "API 요청 처리 시간 (응답 시작까지)",
+    ["method", "route", "status"])
+RESPONSE_BYTES = Histogram(
+    "aidetector_http_response_size_bytes", "API 응답 본문 크기",
+    ["route"], buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216))
+BACKEND_SECONDS = Histogram(
+    "aidetector_backend_request_duration_seconds", "Elasticsearch/OpenSearch 호출의 왕복 시간",
+    ["backend", "operation", "index", "query"])
+BACKEND_TOOK_SECONDS = Histogram(
+    "aidetector_backend_took_seconds", "Elasticsearch/OpenSearch 응답의 took (클러스터 안 처리 시간)",
+    ["backend", "operation", "index", "query"])
+BACKEND_ERRORS = Counter(
+    "aidetector_backend_request_errors_total", "실패한 Elasticsearch/OpenSearch 호출 수",
+    ["backend", "operation", "index"])
+STAGE_SECONDS = Histogram(
+    "aidetector_stage_duration_seconds", "span 디코딩, 컬럼 빌드, 규칙 평가 등 처리 단계별 시간",
+    ["stage"])
+STARTUP_SECONDS = Gauge(
+    "aidetector_startup_seconds", "API 모듈 import, 시작(lifespan), 준비(규칙 로드 완료)까지 걸린 시간",
+    ["phase"], multiprocess_mode="liveall")
+
+# 시간 분할 인덱스 이름의 날짜(시간) 접미사
+_PARTITION_SUFFIX = re.compile(r"-\d{4}\.\d{2}\.\d{2}(?:\.\d{2})?$")
+
+# 요청별 프로파일 (단계 이름, 초) 목록. 프로파일링을 요청하지 않았으면 None입니다.
+_profile: contextvars.ContextVar[Optional[List]] = contextvars.ContextVar("profile", default=None)
+
+logger = logging.getLogger(__name__)
+
+
+def record(section: str, seconds: float):
+    """현재 요청이 프로파일링 중이면 구간 시간을 추가합니다."""
+    sections = _profile.get()
+    if sections is not None:
+        sections.append((section, seconds))
+
+
+@contextmanager
+def timed(stage: str):
+    """블록 실행 시간을 단계 히스토그램과 요청 프로파일에 기록합니다."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        record(stage, elapsed)
+
+
+def query_type(body) -> str:
+    """본문의 최상위 쿼리 종류를 반환합니다 (집계가 있으면 '+aggs'를 붙입니다)."""
+    if not isinstance(body, dict):
+        return "none"
+    query = body.get("query")
+    name = next(iter(query), "match_all") if isinstance(query, dict) else "match_all"
+    if "aggs" in body or "aggregations" in body:
+        name += "+aggs"
+    return name
+
+
+def index_label(index: str) -> str:
+    """시간 분할 인덱스 이름(`security-logs-2024.01.31` 등)을 `security-logs-*`로 묶어 라벨 수를 제한합니다."""
+    return ",".join(dict.fromkeys(_PARTITION_SUFFIX.sub("-*", name) for name in index.split(",")))
+
+
+class InstrumentedClient:
+    """검색 클라이언트 호출의 왕복 시간과 응답의 took을 메서드, index, 쿼리 종류별로 기록합니다.
+
+    동기/비동기 클라이언트 모두 감쌀 수 있습니다. 실패한 호출은 오류 수를 센 뒤 그대로 다시 발생시킵니다.
+    """
+
+    def __init__(self, client, backend: str):
+        self._client = client
+        self._backend = backend
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name not in BACKEND_METHODS:
+            return attribute
+
+        def instrumented(*args, **kwargs):
+            body = kwargs.get("body")
+            index = kwargs.get("index") or (args[0] if args and isinstance(args[0], str) else None)
+            if index is None:
+                # PIT 검색은 본문의 pit id로 index를 정합니다.
+                index = "_pit" if isinstance(body, dict) and "pit" in body else "_all"
+            elif not isinstance(index, str):
+                index = ",".join(index)
+            index = index_label(index)
+            labels = (self._backend, name, index, query_type(body))
+            started = time.perf_counter()
+            try:
+                result = attribute(*args, **kwargs)
+            except Exception:
+                BACKEND_ERRORS.labels(*labels[:3]).inc()
+                raise
+            if hasattr(result, "__await__"):
+                return self._finish_async(result, labels, started)
+            self._observe(result, labels, started)
+            return result
+
+        return instrumented
+
+    async def _finish_async(self, awaitable, labels, started):
+        try:
+            result = await awaitable
+        except Exception:
+            BACKEND_ERRORS.labels(*labels[:3]).inc()
+            raise
+        self._observe(result, labels, started)
+        return result
+
+    @staticmethod
+    def _observe(result, labels, started):
+        elapsed = time.perf_counter() - started
+        BACKEND_SECONDS.labels(*labels).observe(elapsed)
+        record(f"{labels[0]}.{labels[1]}", elapsed)
+        try:
+            took = result.get("took")
+        except AttributeError:
+            took = None
+        if isinstance(took, (int, float)):
+            BACKEND_TOOK_SECONDS.labels(*labels).observe(took / 1000)
+
+
+def _worker_labels() -> List[str]:
+    # 다중 프로세스 모드에서 수집 시점에 읽는 값은 응답한 워커의 것이므로 worker(pid) 라벨로 구분합니다.
+    return ["worker"] if MULTIPROCESS else []
+
+
+def _worker_values() -> List[str]:
+    return [str(os.getpid())] if MULTIPROCESS else []
+
+
+class CacheStatsCollector:
+    """/metrics 수집 시점에 캐시별 stats()를 읽어 적중/미스 카운터와 적중률 게이지로 내보냅니다.
+
+    각 stats 함수는 hits, misses와 선택적으로 size(또는 entries)를 담은 dict를 반환해야 합니다.
+    """
+
+    def __init__(self):
+        self.sources: Dict[str, Callable[[], Dict]] = {}
+
+    def add(self, name: str, stats: Callable[[], Dict]):
+        self.sources[name] = stats
+
+    def collect(self):
+        labels = ["cache", *_worker_labels()]
+        hits = CounterMetricFamily("aidetector_cache_hits", "캐시 적중 수", labels=labels)
+        misses = CounterMetricFamily("aidetector_cache_misses", "캐시 미스 수", labels=labels)
+        ratio = GaugeMetricFamily("aidetector_cache_hit_ratio", "캐시 적중률", labels=labels)
+        entries = GaugeMetricFamily("aidetector_cache_entries", "캐시 항목 수", labels=labels)
+        worker = _worker_values()
+        for name, stats in list(self.sources.items()):
+            try:
+                values = stats()
+            except Exception:
+                logger.exception("캐시 통계 수집 오류: %s", name)
+                continue
+            total = values["hits"] + values["misses"]
+            hits.add_metric([name, *worker], values["hits"])
+            misses.add_metric([name, *worker], values["misses"])
+            ratio.add_metric([name, *worker], values["hits"] / total if total else 0.0)
+            size = values.get("size", values.get("entries"))
+            if size is not None:
+                entries.add_metric([name, *worker], size)
+        return [hits, misses, ratio, entries]
+
+
+class ProcessGauge:
+    """/metrics 수집 시점에 set_function으로 받은 함수 값을 읽는 이 프로세스의 게이지입니다.
+
+    prometheus_client의 Gauge.set_function 값은 다중 프로세스 모드에서 내보내지지 않으므로 대신 씁니다.
+    """
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._function: Optional[Callable[[], float]] = None
+
+    def set_function(self, function: Callable[[], float]):
+        self._function = function
+
+    def collect(self):
+        gauge = GaugeMetricFamily(self.name, self.documentation, labels=_worker_labels())
+        if self._function is not None:
+            try:
+                gauge.add_metric(_worker_values(), float(self._function()))
+            except Exception:
+                logger.exception("게이지 수집 오류: %s", self.name)
+        return [gauge]
+
+
+cache_metrics = CacheStatsCollector()
+INGEST_SPOOL_LAG = ProcessGauge(
+    "aidetector_ingest_spool_lag_seconds", "수집 스풀에서 가장 오래 기다린 미저장 문서의 대기 시간")
+INGEST_SPOOL_PENDING = ProcessGauge(
+    "aidetector_ingest_spool_pending_docs", "수집 스풀에 쌓여 클러스터 저장을 기다리는 문서 수")
+_PROCESS_COLLECTORS = (cache_metrics, INGEST_SPOOL_LAG, INGEST_SPOOL_PENDING)
+
+if MULTIPROCESS:
+    _registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(_registry)
+else:
+    _registry = REGISTRY
+for _collector in _PROCESS_COLLECTORS:
+    _registry.register(_collector)
+
+
+def metrics_payload():
+    """Prometheus 텍스트 형식의 본문과 Content-Type을 반환합니다."""
+    return generate_latest(_registry), CONTENT_TYPE_LATEST
+
+
+def mark_worker_dead():
+    """다중 프로세스 모드에서 종료하는 워커의 live 게이지 파일을 정리합니다."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def _wants_profile(scope) -> bool:
+    for name, value in scope.get("headers", ()):
+        if name == b"x-profile":
+            return value not in (b"", b"0", b"false")
+    query = scope.get("query_string", b"")
+    return b"profile=1" in query or b"profile=true" in query
+
+
+def _server_timing(sections: List, total: float) -> bytes:
+    """같은 이름의 구간을 합쳐 Server-Timing 헤더 값을 만듭니다 (밀리초)."""
+    merged: Dict[str, List] = {}
+    for name, seconds in sections:
+        entry = merged.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+    parts = [f'{name.replace(" ", "_")};dur={seconds * 1000:.2f};desc="{count}x"'
+             for name, (seconds, count) in merged.items()]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts).encode("latin-1", "replace")
+
+
+class MetricsMiddleware:
+    """요청마다 경로 템플릿별 처리 시간, 상태 코드, 응답 크기를 기록하는 ASGI 미들웨어입니다.
+
+    `REQUEST_PROFILING`이 켜져 있으면 `X-Profile: 1` 헤더나 `profile=1` 쿼리를 보낸 요청에
+    백엔드 호출과 처리 단계별 시간을 Server-Timing 응답 헤더로 돌려줍니다.
+    """
+
+    def __init__(self, app, profiling: bool = None):
+        self.app = app
+        self.profiling = (profiling if profiling is not None
+                          else os.getenv('REQUEST_PROFILING', 'true').lower() == 'true')
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        sections = [] if self.profiling and _wants_profile(scope) else None
+        token = _profile.set(sections)
+        started = time.perf_counter()
+        state = {"status": 500, "elapsed": None, "size": 0}
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                state["elapsed"] = time.perf_counter() - started
+                if sections is not None:
+                    message = {**message, "headers": [*message.get("headers", ()),
+                                                      (b"server-timing", _server_timing(sections, state["elapsed"]))]}
+            elif message["type"] == "http.response.body":
+                state["size"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            _profile.reset(token)
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            elapsed = state["elapsed"] if state["elapsed"] is not None else time.perf_counter() - started
+            REQUEST_SECONDS.labels(scope["method"], path, str(state["status"])).observe(elapsed)
+            RESPONSE_BYTES.labels(path).observe(state["size"])
+            if sections is not None and logger.isEnabledFor(logging.DEBUG):
+                logger.debug("요청 프로파일", extra={"route": path, "sections": sections, "total": elapsed})
+
+
+# ========== 구조화 로깅 ==========
+
+# LogRecord 기본 속성. 나머지(extra로 넘긴 값)는 JSON 필드로 출력합니다.
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """로그 한 줄을 JSON 객체 하나로 출력합니다."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode()
+
+
+class _LocalQueueHandler(QueueHandler):
+    """같은 프로세스 안의 큐로 보내므로 메시지만 합치고 포맷과 출력은 리스너 스레드에 맡깁니다."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+_listener: Optional[QueueListener] = None
+
+
+def configure_logging(level: str = None, fmt: str = None):
+    """LOG_LEVEL 이상의 로그를 LOG_FORMAT(json|text) 형식으로 표준 에러에 씁니다.
+
+    호출한 스레드는 레코드를 큐에 넣기만 하고, 포맷과 쓰기는 백그라운드 리스너 스레드가 합니다.
+    여러 번 호출해도 한 번만 설정합니다.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    level = (level or os.getenv('LOG_LEVEL', 'INFO')).upper()
+    fmt = fmt or os.getenv('LOG_FORMAT', 'json')
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if fmt == 'json'
+                         else logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    records = queue.SimpleQueue()
+    _listener = QueueListener(records, handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_LocalQueueHandler(records))
@@ -0,0 +1,46 @@
+import threading
+from typing import Callable
+
+
+async def _closed():
+    return None
+
+
+class LazyClient:
+    """처음 사용할 때 factory로 검색 클라이언트를 만드는 프록시입니다.
+
+    모듈을 불러오거나 분석기를 만드는 시점에는 클라이언트 라이브러리를 불러오거나 연결 설정을
+    읽지 않으므로 서버가 빨리 뜨고, 클러스터에 닿지 않아도 시작에 실패하지 않습니다.
+    close() 후 다시 사용하면 새 클라이언트를 만듭니다.
+    """
+
+    def __init__(self, factory: Callable, asynchronous: bool = False):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+        self.asynchronous = asynchronous
+
+    @property
+    def created(self) -> bool:
+        return self._client is not None
+
+    def get(self):
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+                client = self._client
+        return client
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def close(self):
+        """만든 클라이언트만 닫습니다. 비동기 클라이언트면 await할 수 있는 값을 반환합니다."""
+        with self._lock:
+            client, self._client = self._client, None
+        if client is None:
+            return _closed() if self.asynchronous else None
+        return client.close()
+
@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+"""
+Elasticsearch 없이 trace.json / NDJSON 덤프를 조회하는 로컬 trace 백엔드
+
+덤프를 한 번 스트리밍 파싱해 span 단위의 Arrow IPC 파일로 변환하고,
+조회할 때는 파일을 메모리 매핑해 필요한 컬럼과 행만 읽습니다.
+
+    python local_trace_store.py trace.json --index trace
+    TRACE_BACKEND=local python analyze_trace_data.py
+"""
+
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+import logging
+import os
+import numpy as np
+import orjson
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from elasticsearch_analyzer import TraceQueries
+from histogram import parse_interval
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+logger = logging.getLogger(__name__)
+
+# span 한 행. 필터에 쓰는 태그는 컬럼으로 펼치고, 원본 span은 JSON 그대로 보관합니다.
+SPAN_SCHEMA = pa.schema([
+    ("trace_id", pa.string()),
+    ("span_id", pa.string()),
+    ("operation_name", pa.string()),
+    ("start_time", pa.int64()),
+    ("duration", pa.int64()),
+    ("event_id", pa.string()),
+    ("pid", pa.string()),
+    ("image", pa.string()),
+    ("alert", pa.string()),
+    ("span", pa.binary())
+])
+
+_TAG_COLUMNS = {
+    "sysmon.event_id": "event_id",
+    "sysmon.pid": "pid",
+    "Image": "image",
+    "sigma.alert": "alert"
+}
+
+
+def local_index_path(index_name: str, data_dir: str = None) -> str:
+    data_dir = data_dir or os.getenv('TRACE_LOCAL_DIR', 'data')
+    return os.path.join(data_dir, f"{index_name}.arrow")
+
+
+def _is_ndjson(path: str) -> bool:
+    return path.endswith(('.ndjson', '.jsonl'))
+
+
+def _iter_json_items(path: str) -> Iterator[Dict]:
+    """JSON 파일에서 trace 문서 또는 span 객체를 하나씩 꺼냅니다."""
+    if ijson is None:
+        # ijson이 없으면 파일 전체를 읽습니다.
+        with open(path, 'rb') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            yield from data['data'] if 'data' in data else [data]
+        else:
+            yield from data
+        return
+
+    with open(path, 'rb') as f:
+        first = f.read(64).lstrip()[:1]
+    if first == b'[':
+        with open(path, 'rb') as f:
+            yield from ijson.items(f, 'item', use_float=True)
+        return
+
+    # Jaeger UI 내보내기({"data": [...]}) 또는 trace 문서 하나
+    found = False
+    with open(path, 'rb') as f:
+        for trace in ijson.items(f, 'data.item', use_float=True):
+            found = True
+            yield trace
+    if found:
+        return
+    with open(path, 'rb') as f:
+        trace_id = next(ijson.items(f, 'traceID'), '')
+    with open(path, 'rb') as f:
+        for span in ijson.items(f, 'spans.item', use_float=True):
+            yield {"traceID": trace_id, "spans": [span]}
+
+
+def _iter_ndjson_items(path: str) -> Iterator[Dict]:
+    with open(path, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield orjson.loads(line)
+
+
+def iter_source_spans(path: str) -> Iterator[Tuple[str, Dict]]:
+    """trace.json(Jaeger 내보내기, trace 문서 배열) 또는 NDJSON(줄마다 trace 문서나 span)에서
+    (traceID, span)을 스트리밍으로 반환합니다."""
+    items = _iter_ndjson_items(path) if _is_ndjson(path) else _iter_json_items(path)
+    for item in items:
+        if 'spans' in item:
+            for span in item['spans']:
+                yield item.get('traceID', span.get('traceID', '')), span
+        else:
+            yield item.get('traceID', ''), item
+
+
+def _span_row(trace_id: str, span: Dict) -> Dict:
+    row = {
+        "trace_id": trace_id,
+        "span_id": span.get('spanID', ''),
+        "operation_name": span.get('operationName', ''),
+        "start_time": span.get('startTime', 0),
+        "duration": span.get('duration', 0),
+        "event_id": None,
+        "pid": None,
+        "image": None,
+        "alert": None,
+        "span": orjson.dumps(span)
+    }
+    for tag in span.get('tags', []):
+        column = _TAG_COLUMNS.get(tag.get('key'))
+        if column is not None and tag.get('value') is not None:
+            row[column] = str(tag['value'])
+    return row
+
+
+def convert_trace_file(source_path: str, output_path: str, batch_rows: int = None) -> int:
+    """덤프 파일을 Arrow IPC 파일로 변환하고 span 수를 반환합니다.
+
+    batch_rows개씩 레코드 배치로 기록하므로 덤프 크기와 관계없이 메모리 사용량이 일정합니다.
+    """
+    batch_rows = batch_rows or int(os.getenv('TRACE_LOCAL_BATCH_ROWS', '50000'))
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    temp_path = f"{output_path}.tmp"
+    count = 0
+    rows = []
+    with pa.OSFile(temp_path, 'wb') as sink, pa.ipc.new_file(sink, SPAN_SCHEMA) as writer:
+        for trace_id, span in iter_source_spans(source_path):
+            rows.append(_span_row(trace_id, span))
+            if len(rows) >= batch_rows:
+                writer.write_batch(pa.RecordBatch.from_pylist(rows, schema=SPAN_SCHEMA))
+                count += len(rows)
+                rows = []
+        if rows:
+            writer.write_batch(pa.RecordBatch.from_pylist(rows, schema=SPAN_SCHEMA))
+            count += len(rows)
+    os.replace(temp_path, output_path)
+    return count
+
+
+class LocalTraceIndex:
+    """메모리 매핑한 Arrow IPC 파일 하나입니다. 컬럼 배열은 처음 사용할 때 만듭니다."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = os.stat(path).st_mtime_ns
+        self.table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+        trace_ids = self.table.column('trace_id')
+        self.trace_ids: List[str] = pc.unique(trace_ids).to_pylist()
+        self.trace_codes = pc.index_in(trace_ids, value_set=pa.array(self.trace_ids, pa.string())).to_numpy()
+        self._columns: Dict[str, np.ndarray] = {}
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def numbers(self, name: str) -> np.ndarray:
+        if name not in self._columns:
+            self._columns[name] = self.table.column(name).to_numpy()
+        return self._columns[name]
+
+    def equals(self, name: str, value) -> np.ndarray:
+        return pc.fill_null(pc.equal(self.table.column(name), str(value)), False).to_numpy()
+
+    def present(self, name: str) -> np.ndarray:
+        return pc.is_valid(self.table.column(name)).to_numpy()
+
+    def decode_spans(self, rows: np.ndarray) -> List[Dict]:
+        return [orjson.loads(raw) for raw in self.table.column('span').take(pa.array(rows)).to_pylist()]
+
+
+class LocalTraceAnalyzer(TraceQueries):
+    """TraceAnalyzer와 같은 메서드로 로컬 Arrow 파일을 조회합니다.
+
+    검색 결과(hit)는 trace 문서 단위이며, 조건이 있는 조회에서는 `_source.spans`에
+    조건에 맞는 span만 담깁니다. 쿼리는 TraceQueries가 만드는 형태(match_all, nested,
+    bool must/filter, startTime range, sysmon.pid/event_id term)만 지원합니다.
+    """
+
+    def __init__(self, data_dir: str = None):
+        self.data_dir = data_dir or os.getenv('TRACE_LOCAL_DIR', 'data')
+        self._indices: Dict[str, LocalTraceIndex] = {}
+
+    def open_index(self, index_name: str) -> LocalTraceIndex:
+        """인덱스 파일을 열고, 파일이 바뀌었으면 다시 엽니다."""
+        path = local_index_path(index_name, self.data_dir)
+        index = self._indices.get(index_name)
+        if index is None or index.mtime != os.stat(path).st_mtime_ns:
+            index = self._indices[index_name] = LocalTraceIndex(path)
+        return index
+
+    def import_file(self, source_path: str, index_name: str) -> int:
+        """덤프 파일을 인덱스로 가져옵니다."""
+        count = convert_trace_file(source_path, local_index_path(index_name, self.data_dir))
+        self._indices.pop(index_name, None)
+        return count
+
+    def check_index_status(self, index_name: str) -> Dict:
+        """인덱스 상태를 확인합니다."""
+        path = local_index_path(index_name, self.data_dir)
+        if not os.path.exists(path):
+            return {"status": "error", "message": f"인덱스 '{index_name}'이 존재하지 않습니다."}
+        try:
+            index = self.open_index(index_name)
+            return {
+                "status": "success",
+                "index_name": index_name,
+                "document_count": len(index.trace_ids),
+                "index_info": {index_name: {"path": path, "spans": len(index),
+                                            "size_bytes": os.path.getsize(path)}}
+            }
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    def get_index_version(self, index_name: str) -> Optional[tuple]:
+        """(trace 수, 파일 수정 시각)을 반환합니다. 캐시 무효화에 사용됩니다."""
+        try:
+            index = self.open_index(index_name)
+            return (len(index.trace_ids), index.mtime)
+        except Exception:
+            logger.exception("버전 확인 오류")
+            return None
+
+    def match_rows(self, index: LocalTraceIndex, query: Optional[Dict] = None,
+                   sort: Optional[List] = None) -> np.ndarray:
+        """query에 맞는 span 행 번호를 sort 순서로 반환합니다."""
+        mask = self._query_mask(index, query)
+        rows = np.arange(len(index)) if mask is None else np.flatnonzero(mask)
+        for clause in sort or []:
+            field, options = next(iter(clause.items()))
+            if field not in ('startTime', 'spans.startTime'):
+                continue
+            order = options.get('order', 'asc') if isinstance(options, dict) else options
+            rows = rows[np.argsort(index.numbers('start_time')[rows], kind='stable')]
+            if order == 'desc':
+                rows = rows[::-1]
+        return rows
+
+    def _query_mask(self, index: LocalTraceIndex, query: Optional[Dict]) -> Optional[np.ndarray]:
+        if not query or 'match_all' in query:
+            return None
+        if 'nested' in query:
+            return self._query_mask(index, query['nested']['query'])
+        if 'bool' in query:
+            mask = None
+            for clause in query['bool'].get('must', []) + query['bool'].get('filter', []):
+                clause_mask = self._query_mask(index, clause)
+                if clause_mask is not None:
+                    mask = clause_mask if mask is None else mask & clause_mask
+            return mask
+        if 'range' in query:
+            field, bounds = next(iter(query['range'].items()))
+            if field in ('startTime', 'spans.startTime'):
+                values = index.numbers('start_time')
+                mask = np.ones(len(index), dtype=bool)
+                for op, compare in (('gt', np.greater), ('gte', np.greater_equal),
+                                    ('lt', np.less), ('lte', np.less_equal)):
+                    if op in bounds:
+                        mask &= compare(values, bounds[op])
+                return mask
+        if 'term' in query:
+            field, value = next(iter(query['term'].items()))
+            column = _TAG_COLUMNS.get(field.replace('spans.', '').replace('tags.', '', 1))
+            if column is not None:
+                return index.equals(column, value.get('value') if isinstance(value, dict) else value)
+        raise ValueError(f"로컬 백엔드에서 지원하지 않는 쿼리입니다: {json.dumps(query)[:200]}")
+
+    def _hits(self, index_name: str, index: LocalTraceIndex, rows: np.ndarray,
+              source=None, limit: Optional[int] = None) -> Iterator[Dict]:
+        # 행을 trace별로 묶되, trace 순서는 rows에서 처음 나온 순서를 따릅니다.
+        codes = index.trace_codes[rows]
+        _, first, inverse = np.unique(codes, return_index=True, return_inverse=True)
+        order = np.argsort(np.argsort(first)[inverse], kind='stable')
+        rows, codes = rows[order], codes[order]
+        groups = np.split(rows, np.flatnonzero(np.diff(codes)) + 1) if len(rows) else []
+        for count, group in enumerate(groups):
+            if limit is not None and count >= limit:
+                return
+            trace_id = index.trace_ids[index.trace_codes[group[0]]]
+            hit = {"_index": index_name, "_id": trace_id}
+            if source is not False:
+                document = {"traceID": trace_id, "spans": index.decode_spans(group)}
+                if isinstance(source, (list, tuple)):
+                    document = {key: value for key, value in document.items() if key in source}
+                hit["_source"] = document
+            yield hit
+
+    def iter_batches(self, index_name: str, query: Optional[Dict] = None, batch_size: int = 500,
+                     source=None, sort: Optional[List] = None, keep_alive: str = "1m") -> Iterator[List[Dict]]:
+        """query에 맞는 trace 문서를 batch_size 단위로 순회합니다. keep_alive는 무시됩니다."""
+        index = self.open_index(index_name)
+        batch = []
+        for hit in self._hits(index_name, index, self.match_rows(index, query, sort), source):
+            batch.append(hit)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def iter_hits(self, index_name: str, query: Optional[Dict] = None, batch_size: int = 500,
+                  source=None, sort: Optional[List] = None, keep_alive: str = "1m") -> Iterator[Dict]:
+        """iter_batches의 결과를 문서 단위로 반환합니다."""
+        for batch in self.iter_batches(index_name, query, batch_size, source, sort, keep_alive):
+            yield from batch
+
+    def _search(self, index_name: str, rows_of, limit: int, sort: Optional[List] = None) -> List[Dict]:
+        try:
+            index = self.open_index(index_name)
+            rows = rows_of(index)
+            if sort:
+                rows = rows[np.argsort(index.numbers('start_time')[rows], kind='stable')[::-1]]
+            return list(self._hits(index_name, index, rows, limit=limit))
+        except Exception:
+            logger.exception("검색 오류")
+            return []
+
+    def search_security_alerts(self, index_name: str, limit: int = 100) -> List[Dict]:
+        """보안 알림이 포함된 이벤트를 검색합니다."""
+        return self._search(index_name, lambda index: np.flatnonzero(index.present('alert')), limit)
+
+    def get_all_data(self, index_name: str, limit: int = 10) -> List[Dict]:
+        """모든 데이터를 가져와서 구조를 확인합니다."""
+        return self._search(index_name, lambda index: np.arange(len(index)), limit)
+
+    def get_process_events(self, index_name: str, limit: int = 100) -> List[Dict]:
+        """프로세스 생성 이벤트를 검색합니다."""
+        return self._search(index_name, lambda index: np.flatnonzero(index.equals('event_id', '1')), limit)
+
+    def get_file_events(self, index_name: str, limit: int = 100) -> List[Dict]:
+        """파일 생성 이벤트를 최근 순으로 검색합니다."""
+        return self._search(index_name, lambda index: np.flatnonzero(index.equals('event_id', '11')),
+                            limit, sort=[{"startTime": {"order": "desc"}}])
+
+    def setup_span_fields(self, index_name: str, backfill: bool = True) -> Dict:
+        return {"status": "error", "message": "로컬 trace 백엔드에는 ingest pipeline이 없습니다."}
+
+    def has_span_fields(self, index_name: str) -> bool:
+        """로컬 파일은 클러스터 집계를 쓰지 않으므로 메트릭은 trace 캐시에서 계산합니다."""
+        return False
+
+    def analyze_security_patterns(self, index_name: str) -> Dict:
+        """보안 패턴을 분석합니다."""
+        try:
+            index = self.open_index(index_name)
+
+            def top_terms(name: str) -> List[Dict]:
+                counts = pc.value_counts(pc.drop_null(index.table.column(name)))
+                buckets = [{"key": item['values'], "doc_count": item['counts']} for item in counts.to_pylist()]
+                return sorted(buckets, key=lambda bucket: bucket["doc_count"], reverse=True)[:10]
+
+            return {"alert_types": top_terms('alert'), "process_images": top_terms('image')}
+        except Exception:
+            logger.exception("분석 오류")
+            return {}
+
+    def search_by_process_id(self, index_name: str, process_id: int) -> List[Dict]:
+        """특정 프로세스 ID의 모든 이벤트를 검색합니다."""
+        query = self.process_id_query(process_id)
+        try:
+            return list(self.iter_hits(index_name, query=query['query'], sort=query['sort']))
+        except Exception:
+            logger.exception("검색 오류")
+            return []
+
+    def get_timeline_analysis(self, index_name: str, interval: str = '1m') -> Dict:
+        """interval 간격의 이벤트 수를 반환합니다. 이벤트가 없는 구간은 생략합니다."""
+        try:
+            index = self.open_index(index_name)
+            # span startTime은 마이크로초입니다.
+            step = parse_interval(interval)
+            seconds = index.numbers('start_time') // step * (step // 1_000_000)
+            event_ids = index.table.column('event_id').to_pylist()
+            keys, inverse = np.unique(seconds, return_inverse=True)
+            event_counts: List[Dict[str, int]] = [{} for _ in keys]
+            for position, event_id in zip(inverse.tolist(), event_ids):
+                if event_id is not None:
+                    counts = event_counts[position]
+                    counts[event_id] = counts.get(event_id, 0) + 1
+            totals = np.bincount(inverse, minlength=len(keys))
+
+            buckets = []
+            for position, second in enumerate(keys.tolist()):
+                event_types = sorted(event_counts[position].items(), key=lambda item: item[1], reverse=True)
+                buckets.append({
+                    "key_as_string": datetime.fromtimestamp(second, timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+                    "key": second * 1000,
+                    "doc_count": int(totals[position]),
+                    "event_types": {"buckets": [{"key": key, "doc_count": count} for key, count in event_types]}
+                })
+            return buckets
+        except Exception:
+            logger.exception("분석 오류")
+            return {}
+
+
+class AsyncLocalTraceAnalyzer(LocalTraceAnalyzer):
+    """AsyncTraceAnalyzer와 같은 비동기 메서드를 제공합니다. 파일 조회는 스레드 풀에서 실행됩니다."""
+
+    async def close(self):
+        self._indices.clear()
+
+    async def _run(self, method, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, method, *args)
+
+    async def check_index_status(self, index_name: str) -> Dict:
+        return await self._run(super().check_index_status, index_name)
+
+    async def get_index_version(self, index_name: str) -> Optional[tuple]:
+        return await self._run(super().get_index_version, index_name)
+
+    async def iter_batches(self, index_name: str, query: Optional[Dict] = None, batch_size: int = 500,
+                           source=None, sort: Optional[List] = None,
+                           keep_alive: str = "1m") -> AsyncIterator[List[Dict]]:
+        """페이지마다 span 디코딩을 스레드 풀에서 수행하며 trace 문서를 순회합니다."""
+        batches = super().iter_batches(index_name, query, batch_size, source, sort, keep_alive)
+        while True:
+            batch = await self._run(next, batches, None)
+            if batch is None:
+                return
+            yield batch
+
+    async def iter_hits(self, index_name: str, query: Optional[Dict] = None, batch_size: int = 500,
+                        source=None, sort: Optional[List] = None,
+                        keep_alive: str = "1m") -> AsyncIterator[Dict]:
+        async for batch in self.iter_batches(index_name, query, batch_size, source, sort, keep_alive):
+            for hit in batch:
+                yield hit
+
+    async def search_security_alerts(self, index_name: str, limit: int = 100) -> List[Dict]:
+        return await self._run(super().search_security_alerts, index_name, limit)
+
+    async def get_all_data(self, index_name: str, limit: int = 10) -> List[Dict]:
+        return await self._run(super().get_all_data, index_name, limit)
+
+    async def get_process_events(self, index_name: str, limit: int = 100) -> List[Dict]:
+        return await self._run(super().get_process_events, index_name, limit)
+
+    async def get_file_events(self, index_name: str, limit: int = 100) -> List[Dict]:
+        return await self._run(super().get_file_events, index_name, limit)
+
+    async def has_span_fields(self, index_name: str) -> bool:
+        return False
+
+    async def analyze_security_patterns(self, index_name: str) -> Dict:
+        return await self._run(super().analyze_security_patterns, index_name)
+
+    async def search_by_process_id(self, index_name: str, process_id: int) -> List[Dict]:
+        query = self.process_id_query(process_id)
+        try:
+            return [hit async for hit in self.iter_hits(index_name, query=query['query'], sort=query['sort'])]
+        except Exception:
+            logger.exception("검색 오류")
+            return []
+
+    async def get_timeline_analysis(self, index_name: str, interval: str = '1m') -> Dict:
+        return await self._run(super().get_timeline_analysis, index_name, interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="trace.json / NDJSON 덤프를 로컬 trace 인덱스로 변환합니다.")
+    parser.add_argument("source", help="trace.json, Jaeger 내보내기 또는 NDJSON 파일")
+    parser.add_argument("--index", default="trace", help="인덱스 이름 (기본값: trace)")
+    parser.add_argument("--data-dir", default=None, help="인덱스 파일 디렉터리 (기본값: TRACE_LOCAL_DIR 또는 data)")
+    args = parser.parse_args()
+
+    analyzer = LocalTraceAnalyzer(args.data_dir)
+    count = analyzer.import_file(args.source, args.index)
+    print(f"✓ {count}개 span을 {local_index_path(args.index, analyzer.data_dir)}에 저장했습니다.")
+
+
+if __name__ == "__main__":
+    main()
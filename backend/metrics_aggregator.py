@@ -0,0 +1,240 @@
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+from span_store import MISSING
+
+
+class SpaceSaving:
+    """Space-Saving 알고리즘으로 상위 항목을 근사하는 고정 크기 카운터입니다.
+
+    capacity개까지만 보관하며, 가득 차면 가장 작은 항목을 새 항목으로 교체합니다.
+    카디널리티와 관계없이 메모리 사용량이 일정합니다.
+    """
+
+    __slots__ = ("capacity", "counts")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts: Dict = {}
+
+    def add(self, item, count: int = 1):
+        if item in self.counts:
+            self.counts[item] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = count
+        else:
+            smallest = min(self.counts, key=self.counts.get)
+            self.counts[item] = self.counts.pop(smallest) + count
+
+    def merge(self, other: "SpaceSaving"):
+        for item, count in other.counts.items():
+            self.counts[item] = self.counts.get(item, 0) + count
+        if len(self.counts) > self.capacity:
+            self.counts = dict(self.top(self.capacity))
+
+    def top(self, n: int) -> List[Tuple]:
+        return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:n]
+
+
+class MinuteBucket:
+    """1분 동안의 합계, 정확한 분포(counters), 상위 항목(heavy)입니다."""
+
+    __slots__ = ("totals", "counters", "heavy")
+
+    def __init__(self, heavy_fields: Iterable[str], capacity: int):
+        self.totals = Counter()
+        self.counters: Dict[str, Counter] = {}
+        self.heavy = {field: SpaceSaving(capacity) for field in heavy_fields}
+
+
+class RollingMetricsAggregator:
+    """분 단위 버킷으로 메트릭을 누적하고, 임의의 시간 범위를 메모리에서 합산합니다.
+
+    분포 수가 적은 필드(severity, event_type 등)는 정확히 세고, IP나 알림 유형처럼
+    카디널리티가 큰 필드는 SpaceSaving으로 상위 항목만 보관합니다. 가장 최근 버킷에서
+    retention_minutes보다 오래된 버킷은 버립니다.
+    """
+
+    def __init__(self, heavy_fields: Iterable[str] = (), retention_minutes: int = None,
+                 capacity: int = None):
+        self.heavy_fields = tuple(heavy_fields)
+        self.retention_minutes = retention_minutes or int(os.getenv('METRICS_RETENTION_MINUTES', '1440'))
+        self.capacity = capacity or int(os.getenv('METRICS_TOPK_CAPACITY', '100'))
+        self.complete_since: Optional[float] = None
+        # 모든 수집 경로의 데이터를 받는 공급원(예: 클러스터를 따라가는 follower)이 이 시점(초) 이후를
+        # 빠짐없이 더합니다. None이면 일부 경로만 보므로 covers()는 항상 False입니다.
+        self.live_since: Optional[float] = None
+        self._buckets: "OrderedDict[int, MinuteBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, timestamp: float, totals: Dict[str, int] = None,
+               counters: Dict[str, Dict] = None, heavy: Dict[str, Dict] = None):
+        """timestamp(초)가 속한 분 버킷에 값을 더합니다."""
+        minute = int(timestamp // 60)
+        with self._lock:
+            bucket = self._bucket(minute)
+            if totals:
+                bucket.totals.update(totals)
+            for field, values in (counters or {}).items():
+                bucket.counters.setdefault(field, Counter()).update(values)
+            for field, values in (heavy or {}).items():
+                summary = bucket.heavy[field]
+                for item, count in values.items():
+                    summary.add(item, count)
+
+    def query(self, start: Optional[float] = None, end: Optional[float] = None) -> MinuteBucket:
+        """[start, end] 범위(초)의 버킷을 합친 결과를 반환합니다."""
+        start_minute = int(start // 60) if start is not None else None
+        end_minute = int(end // 60) if end is not None else None
+        merged = MinuteBucket(self.heavy_fields, self.capacity)
+        with self._lock:
+            for minute, bucket in self._buckets.items():
+                if start_minute is not None and minute < start_minute:
+                    continue
+                if end_minute is not None and minute > end_minute:
+                    continue
+                merged.totals.update(bucket.totals)
+                for field, counter in bucket.counters.items():
+                    merged.counters.setdefault(field, Counter()).update(counter)
+                for field, summary in bucket.heavy.items():
+                    merged.heavy[field].merge(summary)
+        return merged
+
+    def covers(self, start: Optional[float]) -> bool:
+        """start 이후의 데이터를 빠짐없이 가지고 있는지 반환합니다.
+
+        가장 최근 버킷에서 retention_minutes보다 오래된 버킷은 버렸으므로 그 이전 범위는 포함하지 않습니다.
+        """
+        if start is None or self.live_since is None or self.complete_since is None:
+            return False
+        with self._lock:
+            newest = next(reversed(self._buckets), None)
+        if newest is not None and start < (newest - self.retention_minutes + 1) * 60:
+            return False
+        return start >= self.complete_since
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _bucket(self, minute: int) -> MinuteBucket:
+        bucket = self._buckets.get(minute)
+        if bucket is not None:
+            return bucket
+        bucket = MinuteBucket(self.heavy_fields, self.capacity)
+        newest = next(reversed(self._buckets), minute)
+        if minute <= newest - self.retention_minutes:
+            # 보관 기간 밖의 데이터는 버립니다.
+            return bucket
+
+        self._buckets[minute] = bucket
+        if minute < newest:
+            # 늦게 도착한 데이터는 순서를 맞춰 다시 정렬합니다.
+            self._buckets = OrderedDict(sorted(self._buckets.items()))
+            return bucket
+        while next(iter(self._buckets)) <= minute - self.retention_minutes:
+            self._buckets.popitem(last=False)
+        return bucket
+
+
+def terms_buckets(counter_items: Iterable[Tuple]) -> Dict:
+    """(값, 개수) 목록을 OpenSearch terms 집계와 같은 형식으로 변환합니다."""
+    return {"buckets": [{"key": key, "doc_count": count} for key, count in counter_items]}
+
+
+def _epoch_seconds(timestamp) -> Optional[float]:
+    # 클러스터처럼 시간대가 없는 시각은 UTC로 봅니다. 숫자는 epoch 밀리초입니다.
+    if isinstance(timestamp, (int, float)):
+        return timestamp / 1000
+    if not isinstance(timestamp, datetime):
+        try:
+            timestamp = datetime.fromisoformat(str(timestamp).replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+
+def record_logs(aggregator: RollingMetricsAggregator, logs: Iterable[Dict], since: float = None):
+    """저장된 보안 로그를 분 버킷에 더합니다. since(초)를 주면 그 이전 로그는 건너뜁니다."""
+    for log in logs:
+        timestamp = _epoch_seconds(log.get('timestamp'))
+        if timestamp is None or (since is not None and timestamp < since):
+            continue
+        aggregator.record(
+            timestamp,
+            totals={"events": 1},
+            counters={"severity": {log.get('severity'): 1}, "event_type": {log.get('event_type'): 1}},
+            heavy={"source_ip": {log.get('source_ip'): 1}, "destination_ip": {log.get('destination_ip'): 1}}
+        )
+
+
+def record_histogram(aggregator: RollingMetricsAggregator, buckets: List[Dict]):
+    """minute_metrics_query의 date_histogram 결과를 분 버킷에 더합니다."""
+    for bucket in buckets:
+        def terms(name):
+            return {item['key']: item['doc_count'] for item in bucket[name]['buckets']}
+        aggregator.record(
+            bucket['key'] / 1000,
+            totals={"events": bucket['doc_count']},
+            counters={"severity": terms("severity"), "event_type": terms("event_type")},
+            heavy={"source_ip": terms("source_ip"), "destination_ip": terms("destination_ip")}
+        )
+
+
+class SpanMetricsRecorder:
+    """trace 캐시가 새로 읽은 span 중 trace별 최고 수위(startTime) 이후의 것만 집계기에 더합니다.
+
+    호스트마다 trace 문서가 따로 색인되므로, 늦게 색인된 trace의 span이 다른 trace의 최신 span보다
+    이르더라도 빠뜨리지 않도록 수위는 traceID별로 둡니다.
+    """
+
+    def __init__(self, aggregator: RollingMetricsAggregator):
+        self.aggregator = aggregator
+        self.watermarks: Dict[str, int] = {}
+
+    def __call__(self, snapshot):
+        store = snapshot.store
+        if len(store) == 0:
+            return
+        if self.aggregator.live_since is None:
+            # trace 캐시는 인덱스 전체를 읽으므로 첫 snapshot부터 모든 span을 빠짐없이 더합니다.
+            self.aggregator.complete_since = 0.0
+            self.aggregator.live_since = time.time()
+        rows = np.flatnonzero(store.after_watermarks(self.watermarks))
+        if len(rows) == 0:
+            return
+
+        # span startTime은 마이크로초입니다.
+        minutes, inverse = np.unique(store.start_time[rows] // 60_000_000, return_inverse=True)
+        size = len(minutes)
+        alert_codes = store.alert.codes[rows]
+        has_alert = alert_codes != MISSING
+        spans = np.bincount(inverse, minlength=size)
+        alerts = np.bincount(inverse, weights=has_alert, minlength=size)
+        process_events = np.bincount(inverse, weights=store.event_id.equals('1')[rows], minlength=size)
+        file_events = np.bincount(inverse, weights=store.event_id.equals('11')[rows], minlength=size)
+
+        alert_types: Dict[int, Counter] = {}
+        for position, code in zip(inverse[has_alert].tolist(), alert_codes[has_alert].tolist()):
+            alert_types.setdefault(position, Counter())[store.alert.categories[code]] += 1
+        images: Dict[int, Counter] = {}
+        image_codes = store.image.codes[rows]
+        has_image = image_codes != MISSING
+        pairs, counts = np.unique(np.stack([inverse[has_image], image_codes[has_image]]), axis=1, return_counts=True)
+        for (position, code), count in zip(pairs.T.tolist(), counts.tolist()):
+            images.setdefault(position, Counter())[store.image.categories[code]] = count
+
+        for position, minute in enumerate(minutes.tolist()):
+            self.aggregator.record(minute * 60, totals={
+                "spans": int(spans[position]),
+                "alerts": int(alerts[position]),
+                "processEvents": int(process_events[position]),
+                "fileEvents": int(file_events[position])
+            }, heavy={"sigma_alert": alert_types.get(position, {}), "image": images.get(position, {})})
+        store.advance_watermarks(rows, self.watermarks)
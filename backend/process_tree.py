@@ -0,0 +1,169 @@
+from bisect import bisect_left
+from typing import Dict, List, Optional
+import numpy as np
+
+from span_store import SpanStore, MISSING
+
+
+class ProcessTreeIndex:
+    """프로세스 생성 이벤트(Event ID 1)로 만든 부모/자식 트리 인덱스입니다.
+
+    프로세스는 PID 재사용을 구분하기 위해 (pid, startTime)으로 식별합니다.
+    자식의 부모는 ppid와 같은 PID를 가진 프로세스 중 자식보다 먼저 시작한
+    가장 최근 프로세스입니다. 전위 순회 번호(tin/tout)로 조상 판별과
+    하위 트리 조회를, 누적 합으로 하위 트리 알림 수를 O(1)에 계산합니다.
+    PID는 호스트마다 따로이므로 span_rows로 trace 하나의 행(오름차순)만 골라 만듭니다.
+    """
+
+    def __init__(self, store: SpanStore, span_rows: Optional[np.ndarray] = None):
+        self.store = store
+        self.span_rows = np.arange(len(store)) if span_rows is None else span_rows
+        create_code = store.event_id.code('1')
+        creates = self.span_rows[store.event_id.codes[self.span_rows] == create_code] \
+            if create_code != MISSING else self.span_rows[:0]
+        rows = creates[np.argsort(store.start_time[creates], kind='stable')]
+        self.rows = rows
+        self.pid_codes = store.pid.codes[rows]
+        self.start_times = store.start_time[rows]
+        count = len(rows)
+
+        # PID별 프로세스 목록 (시작 시간 순)
+        self._instances: Dict[int, List[int]] = {}
+        for node, pid in enumerate(self.pid_codes.tolist()):
+            self._instances.setdefault(pid, []).append(node)
+
+        self.parent = np.full(count, -1, dtype=np.int64)
+        self.children: List[List[int]] = [[] for _ in range(count)]
+        ppid_codes = store.ppid.codes[rows].tolist()
+        for node, ppid in enumerate(ppid_codes):
+            parent = self._parent_of(node, ppid)
+            if parent >= 0:
+                self.parent[node] = parent
+                self.children[parent].append(node)
+
+        self.own_alerts = self._count_alerts()
+        self._build_order()
+
+    def _parent_of(self, node: int, ppid_code: int) -> int:
+        if ppid_code == MISSING:
+            return -1
+        ppid = self.store.ppid.categories[ppid_code]
+        pid_code = self.store.pid.code(ppid)
+        candidates = self._instances.get(pid_code)
+        if not candidates:
+            return -1
+        # 노드 번호가 (startTime, 원래 순서) 순이므로 node보다 작은 번호만 부모가 될 수 있습니다.
+        position = bisect_left(candidates, node)
+        return candidates[position - 1] if position > 0 else -1
+
+    def _instance_at(self, pid_code: int, start_time: int) -> int:
+        """pid_code 프로세스 중 start_time 시점에 실행 중이던 프로세스를 반환합니다."""
+        candidates = self._instances.get(pid_code)
+        if not candidates:
+            return -1
+        starts = self.start_times[candidates]
+        position = int(np.searchsorted(starts, start_time, side='right'))
+        return candidates[position - 1] if position > 0 else -1
+
+    def _count_alerts(self) -> np.ndarray:
+        # 알림 span을 해당 시점에 실행 중이던 프로세스에 배정합니다.
+        counts = np.zeros(len(self.rows), dtype=np.int64)
+        alert_rows = self.span_rows[self.store.alert.codes[self.span_rows] != MISSING]
+        for pid, start in zip(self.store.pid.codes[alert_rows].tolist(),
+                              self.store.start_time[alert_rows].tolist()):
+            node = self._instance_at(pid, start)
+            if node >= 0:
+                counts[node] += 1
+        return counts
+
+    def _build_order(self):
+        count = len(self.rows)
+        self.tin = np.zeros(count, dtype=np.int64)
+        self.tout = np.zeros(count, dtype=np.int64)
+        self.depth = np.zeros(count, dtype=np.int64)
+        order = []
+        self.roots = [node for node in range(count) if self.parent[node] < 0]
+
+        for root in self.roots:
+            stack = [(root, False)]
+            while stack:
+                node, done = stack.pop()
+                if done:
+                    self.tout[node] = len(order)
+                    continue
+                self.tin[node] = len(order)
+                order.append(node)
+                stack.append((node, True))
+                for child in reversed(self.children[node]):
+                    self.depth[child] = self.depth[node] + 1
+                    stack.append((child, False))
+
+        self.order = np.array(order, dtype=np.int64)
+        self._alert_prefix = np.concatenate(([0], np.cumsum(self.own_alerts[self.order])))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def find(self, pid: str, start_time: Optional[int] = None) -> int:
+        """(pid, startTime)에 해당하는 노드를 찾습니다. start_time이 없으면 가장 최근 프로세스입니다."""
+        candidates = self._instances.get(self.store.pid.code(pid))
+        if not candidates:
+            return -1
+        if start_time is None:
+            return candidates[-1]
+        for node in candidates:
+            if self.start_times[node] == start_time:
+                return node
+        return -1
+
+    def is_ancestor(self, ancestor: int, node: int) -> bool:
+        return self.tin[ancestor] < self.tin[node] and self.tout[node] <= self.tout[ancestor]
+
+    def ancestors(self, node: int) -> List[int]:
+        """부모부터 루트까지의 노드를 반환합니다."""
+        result = []
+        node = int(self.parent[node])
+        while node >= 0:
+            result.append(node)
+            node = int(self.parent[node])
+        return result
+
+    def descendants(self, node: int) -> np.ndarray:
+        """하위 프로세스 전체를 전위 순회 순서로 반환합니다."""
+        return self.order[self.tin[node] + 1:self.tout[node]]
+
+    def subtree_alerts(self, node: int) -> int:
+        return int(self._alert_prefix[self.tout[node]] - self._alert_prefix[self.tin[node]])
+
+    def node_info(self, node: int) -> Dict:
+        """노드 하나를 응답 형식으로 변환합니다."""
+        store = self.store
+        row = int(self.rows[node])
+        return {
+            "traceID": store.trace.value(row),
+            "host": store.host.value(row),
+            "pid": store.pid.value(row),
+            "ppid": store.ppid.value(row),
+            "image": store.image.value(row),
+            "commandLine": store.command_line[row],
+            "startTime": int(store.start_time[row]),
+            "hasAlert": bool(store.alert.codes[row] != MISSING),
+            "alert": store.alert.value(row),
+            "depth": int(self.depth[node]),
+            "alertCount": int(self.own_alerts[node]),
+            "subtreeAlertCount": self.subtree_alerts(node),
+            "descendantCount": int(self.tout[node] - self.tin[node] - 1)
+        }
+
+    def subtree(self, node: int, max_depth: Optional[int] = None) -> Dict:
+        """node를 루트로 하는 하위 트리를 max_depth 단계까지 중첩 dict로 반환합니다."""
+        info = self.node_info(node)
+        children = self.children[node]
+        if max_depth is not None and max_depth <= 0:
+            info["children"] = []
+            info["truncated"] = bool(children)
+            return info
+        next_depth = None if max_depth is None else max_depth - 1
+        info["children"] = [self.subtree(child, next_depth) for child in children]
+        info["truncated"] = False
+        return info
@@ -118,8 +118,38 @@ def test_sample_data(client, index_name):
     except Exception as e:
         print(f"데이터 확인 실패: {e}")
 
+def test_local_backend():
+    """로컬 trace 백엔드(TRACE_BACKEND=local) 확인"""
+    from local_trace_store import LocalTraceAnalyzer
+
+    analyzer = LocalTraceAnalyzer()
+    print(f"=== 로컬 trace 인덱스 ({analyzer.data_dir}) ===")
+    names = sorted(f[:-len('.arrow')] for f in os.listdir(analyzer.data_dir)
+                   if f.endswith('.arrow')) if os.path.isdir(analyzer.data_dir) else []
+    if not names:
+        print("인덱스가 없습니다.")
+        print("python local_trace_store.py trace.json 으로 trace 데이터를 변환하세요.")
+        return
+
+    for index_name in names:
+        status = analyzer.check_index_status(index_name)
+        info = status['index_info'][index_name]
+        print(f"- {index_name}: {status['document_count']} 문서, {info['spans']} span")
+
+    hits = analyzer.get_all_data(names[0], limit=1)
+    if hits:
+        source = hits[0]['_source']
+        print(f"\n✓ 첫 번째 문서: traceID={source.get('traceID')}, spans={len(source.get('spans', []))}")
+
+    print(f"\n=== 테스트 완료 ===")
+    print("다음 단계: TRACE_BACKEND=local python analyze_trace_data.py 를 실행하세요")
+
 def main():
     """메인 함수"""
+    if os.getenv('TRACE_BACKEND', 'elasticsearch') == 'local':
+        test_local_backend()
+        return
+
     print("Elasticsearch 빠른 테스트 시작")
     
     # 1. 연결 테스트
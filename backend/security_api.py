@@ -1,13 +1,59 @@
-from fastapi import FastAPI, HTTPException
+import time
+
+# 모듈을 불러오는 데(무거운 의존성 포함) 걸린 시간을 /api/ready로 보고합니다.
+_import_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
 from typing import List, Dict, Optional
-from datetime import datetime
-from security_log_analyzer import SecurityLogAnalyzer
-from elasticsearch_analyzer import TraceAnalyzer
-import re
+from datetime import datetime, timedelta, timezone
+from heapq import merge
+from collections import deque
+from security_log_analyzer import SecurityLogAnalyzer, AsyncSecurityLogAnalyzer, BulkLogWriter, query_now
+from elasticsearch_analyzer import AsyncTraceAnalyzer
+from trace_cache import TraceCache
+from span_store import SpanStore, MISSING
+from anomaly_model import AnomalyModelManager
+from process_tree import ProcessTreeIndex
+from timeline import TimelineEngine
+from histogram import (DOWNSAMPLE_METHODS, BucketCache, choose_interval, downsample as downsample_buckets,
+                       format_interval, parse_interval)
+from alert_stream import AlertBroadcaster
+from ingest_spool import IngestSpool, SpoolFull, SpoolReplayer
+from hot_tier import RecentLogs, RecentSpans, TierFollower, compile_query
+from shared_cache import SharedCache, shared_cache_enabled
+from cmdline import cache_stats, clean_cmd, image_name, parse_command_line
+from single_flight import CoalescingClient, SingleFlight
+from instrumentation import (INGEST_SPOOL_LAG, INGEST_SPOOL_PENDING, STARTUP_SECONDS, InstrumentedClient, MetricsMiddleware, cache_metrics,
+                             configure_logging, mark_worker_dead, metrics_payload, timed)
+from sigma_rules import RuleEngine, SpanRuleRecorder
+from metrics_aggregator import (RollingMetricsAggregator, SpanMetricsRecorder, _epoch_seconds, record_histogram,
+                                record_logs, terms_buckets)
+import orjson
+import numpy as np
+import asyncio
+import base64
+import json
+import logging
+import os
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """백그라운드 작업을 시작하고, 종료할 때 작업과 만들어진 클라이언트를 정리합니다."""
+    await start_background_tasks()
+    try:
+        yield
+    finally:
+        await close_clients()
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # CORS 설정
 app.add_middleware(
@@ -18,9 +64,101 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 응답 압축 (brotli-asgi가 있으면 brotli, 없으면 gzip)
+try:
+    from brotli_asgi import BrotliMiddleware
+    app.add_middleware(BrotliMiddleware, minimum_size=1024)
+except ImportError:
+    app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# 경로별 처리 시간/응답 크기 기록과 요청별 프로파일 (가장 바깥에서 압축 후 크기를 잽니다)
+app.add_middleware(MetricsMiddleware)
+
 # 분석기 인스턴스 생성
-analyzer = SecurityLogAnalyzer()
-trace_analyzer = TraceAnalyzer()
+# 핸들러는 비동기 클라이언트를 await하고, bulk writer는 자체 스레드에서 동기 클라이언트를 사용합니다.
+analyzer = AsyncSecurityLogAnalyzer()
+if os.getenv('TRACE_BACKEND', 'elasticsearch') == 'local':
+    # Elasticsearch 없이 로컬 Arrow 파일(local_trace_store.py로 변환)을 조회합니다.
+    from local_trace_store import AsyncLocalTraceAnalyzer
+    trace_analyzer = AsyncLocalTraceAnalyzer()
+else:
+    trace_analyzer = AsyncTraceAnalyzer()
+# 클라이언트는 처음 조회할 때 만들어집니다 (LazyClient). /api/ready에서 생성 여부를 보고합니다.
+search_clients = {name: backend.client for backend, name in ((analyzer, "opensearch"), (trace_analyzer, "elasticsearch"))
+                  if hasattr(backend, 'client')}
+for backend, name in ((analyzer, "opensearch"), (trace_analyzer, "elasticsearch")):
+    if hasattr(backend, 'client'):
+        backend.client = InstrumentedClient(backend.client, name)
+# 대시보드 위젯이 동시에 보내는 같은 조회(index + 정규화한 본문)를 클러스터 호출 하나로 합칩니다.
+query_flight = SingleFlight()
+if os.getenv('QUERY_COALESCING', 'true').lower() == 'true':
+    for backend in (analyzer, trace_analyzer):
+        if hasattr(backend, 'client'):  # 로컬 trace 백엔드에는 클라이언트가 없습니다.
+            backend.client = CoalescingClient(backend.client, query_flight)
+# 워커 프로세스가 여러 개면 trace snapshot, 클러스터 조회 결과, 닫힌 히스토그램 버킷을 워커끼리 나눠 씁니다.
+shared_cache = SharedCache() if shared_cache_enabled() else None
+SHARED_QUERY_TTL = float(os.getenv('SHARED_CACHE_QUERY_TTL', '10'))
+trace_cache = TraceCache(trace_analyzer, shared=shared_cache)
+write_client = InstrumentedClient(SecurityLogAnalyzer().client, "opensearch")
+log_writer = BulkLogWriter(write_client, "security-logs")
+# 수집한 로그는 디스크 스풀에 먼저 쓰고 백그라운드에서 bulk로 클러스터에 저장합니다 (INGEST_SPOOL=false면 바로 저장).
+INGEST_SPOOL = os.getenv('INGEST_SPOOL', 'true').lower() == 'true'
+ingest_spool = IngestSpool()
+spool_replayer = SpoolReplayer(ingest_spool, write_client, "security-logs")
+INGEST_SPOOL_LAG.set_function(ingest_spool.lag_seconds)
+INGEST_SPOOL_PENDING.set_function(lambda: ingest_spool.stats()["pendingDocs"])
+anomaly_models = AnomalyModelManager(analyzer, "security-logs")
+alert_broadcaster = AlertBroadcaster(trace_cache, analyzer)
+trace_cache.add_listener(alert_broadcaster.on_snapshot)
+
+# 분 단위 메트릭 집계기. /api/metrics와 /api/trace/metrics의 시간 범위 조회를 메모리에서 처리합니다.
+log_metrics = RollingMetricsAggregator(heavy_fields=("source_ip", "destination_ip"))
+trace_metrics = RollingMetricsAggregator(heavy_fields=("sigma_alert", "image"))
+trace_cache.add_listener(SpanMetricsRecorder(trace_metrics))
+METRICS_BACKFILL_MINUTES = int(os.getenv('METRICS_BACKFILL_MINUTES', '60'))
+# auto: trace 인덱스에 펼친 span 필드가 있으면 /api/trace/metrics를 클러스터 집계로 계산, cache: 항상 trace 캐시
+TRACE_METRICS_SOURCE = os.getenv('TRACE_METRICS_SOURCE', 'auto')
+TOP_IMAGES = 10
+
+# Sigma 규칙 엔진. 새 trace snapshot과 수집되는 보안 로그에 적용합니다.
+rule_engine = RuleEngine()
+trace_cache.add_listener(SpanRuleRecorder(rule_engine))
+
+# 사용자 행동(프로세스 시작/종료) 타임라인과 세션. 새 snapshot에서 워터마크 이후 이벤트만 처리합니다.
+timeline = TimelineEngine()
+trace_cache.add_listener(timeline)
+recent_detections = deque(maxlen=int(os.getenv('RULE_DETECTIONS_BUFFER', '1000')))
+
+# 닫힌 시간 버킷의 히스토그램 집계 결과
+histogram_cache = BucketCache(shared=shared_cache)
+HISTOGRAM_MAX_BUCKETS = int(os.getenv('HISTOGRAM_MAX_BUCKETS', '5000'))
+
+# 최근 데이터 계층. 최근 HOT_TIER_MINUTES분의 보안 로그와 span을 메모리에 두고 그 범위의 조회를 처리합니다.
+recent_logs = RecentLogs()
+recent_spans = RecentSpans()
+tier_follower = TierFollower(recent_logs, recent_spans, analyzer,
+                             trace_analyzer if TRACE_METRICS_SOURCE == 'auto' else None)
+HOT_TIER = os.getenv('HOT_TIER', 'true').lower() == 'true'
+# 검색 결과 수 (클러스터 기본 size와 같습니다)
+LOG_SEARCH_SIZE = 10
+
+# /metrics 수집 시점에 읽는 캐시 적중률
+cache_metrics.add("trace_snapshots", trace_cache.stats)
+cache_metrics.add("query_coalescing", lambda: {**query_flight.stats(), "hits": query_flight.coalesced,
+                                               "misses": query_flight.executed})
+cache_metrics.add("command_lines", lambda: cache_stats()["commandLines"])
+cache_metrics.add("images", lambda: cache_stats()["images"])
+cache_metrics.add("histogram_buckets", histogram_cache.stats)
+cache_metrics.add("hot_logs", recent_logs.stats)
+cache_metrics.add("hot_spans", recent_spans.stats)
+if shared_cache is not None:
+    cache_metrics.add("shared", shared_cache.stats)
+
+async def shared_query(key: str, compute):
+    """공유 캐시가 켜져 있으면 같은 시간 구간(query_now)의 클러스터 조회를 워커 하나만 실행하고 결과를 나눠 씁니다."""
+    if shared_cache is None:
+        return await compute()
+    return await shared_cache.get_or_compute(key, query_now().isoformat(), compute, SHARED_QUERY_TTL)
 
 class LogEntry(BaseModel):
     timestamp: datetime
@@ -44,40 +182,300 @@ class SearchQuery(BaseModel):
 async def ingest_log(log_entry: LogEntry):
     """새로운 보안 로그를 저장합니다."""
     try:
-        response = analyzer.ingest_log("security-logs", log_entry.dict())
-        return {"status": "success", "id": response["_id"]}
+        log_data = log_entry.dict()
+        if INGEST_SPOOL:
+            log_id = (await spool_logs([log_data]))[0]
+        else:
+            response = await analyzer.ingest_log("security-logs", log_data)
+            if response is None:
+                raise HTTPException(status_code=503, detail="로그를 저장하지 못했습니다.")
+            log_id = response["_id"]
+        recent_logs.add([log_id], [log_data])
+        detections = publish_detections(rule_engine.evaluate_records([log_data]), [log_id], [log_data])
+        return {"status": "success", "id": log_id,
+                "detections": [{key: detection[key] for key in ("ruleId", "rule", "level")}
+                               for _, detection in detections]}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def spool_logs(docs: List[Dict]) -> List[str]:
+    """로그를 수집 스풀에 쓰고 부여한 _id 목록을 반환합니다. 스풀이 가득 차 있으면 429로 응답합니다."""
+    try:
+        ids = await asyncio.get_running_loop().run_in_executor(None, ingest_spool.append, docs)
+    except SpoolFull as e:
+        raise HTTPException(status_code=429, detail=str(e),
+                            headers={"Retry-After": str(max(int(spool_replayer.backoff), 1))})
+    spool_replayer.notify()
+    return ids
+
+def publish_detections(matches: List, ids: List, docs: List[Dict]) -> List:
+    """규칙에 일치한 보안 로그를 최근 탐지 목록에 넣고 SSE 구독자에게 알림으로 보냅니다.
+
+    (docs 안의 위치, 탐지) 목록을 문서 순서로 반환합니다.
+    """
+    detections = []
+    for rule, rows in matches:
+        for row in rows.tolist():
+            detections.append((row, {"source": "sigma", "ruleId": rule.id, "rule": rule.title,
+                                     "level": rule.level, "id": ids[row], **docs[row]}))
+    detections.sort(key=lambda item: item[0])
+    for _, detection in detections:
+        recent_detections.append(detection)
+        alert_broadcaster.publish("alert", detection)
+    return detections
+
+def parse_bulk_body(body: bytes) -> List:
+    """JSON 배열 또는 NDJSON 본문을 (순번, 객체 또는 오류) 목록으로 변환합니다."""
+    text = body.decode('utf-8').strip()
+    if not text:
+        return []
+    if text.startswith('['):
+        return list(enumerate(json.loads(text)))
+
+    items = []
+    for line_no, line in enumerate(text.splitlines()):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            items.append((line_no, json.loads(line)))
+        except json.JSONDecodeError as e:
+            items.append((line_no, e))
+    return items
+
+@app.post("/api/logs/bulk")
+async def ingest_logs_bulk(request: Request):
+    """NDJSON 또는 JSON 배열로 받은 보안 로그를 bulk로 저장합니다."""
+    try:
+        items = parse_bulk_body(await request.body())
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"잘못된 요청 본문: {str(e)}")
+
+    started = time.perf_counter()
+    errors = []
+    docs = []
+    positions = []
+    for position, item in items:
+        if isinstance(item, Exception):
+            errors.append({"index": position, "error": str(item)})
+            continue
+        try:
+            docs.append(LogEntry(**item).dict())
+            positions.append(position)
+        except (ValidationError, TypeError) as e:
+            errors.append({"index": position, "error": str(e)})
+
+    try:
+        if INGEST_SPOOL:
+            results = [{"status": "success", "id": log_id} for log_id in await spool_logs(docs)]
+        else:
+            results = await asyncio.wrap_future(log_writer.submit(docs))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    ids = []
+    stored = []
+    stored_positions = []
+    for position, doc, result in zip(positions, docs, results):
+        if result["status"] == "success":
+            ids.append(result["id"])
+            stored.append(doc)
+            stored_positions.append(position)
+        else:
+            errors.append({"index": position, "error": result["error"], "code": result.get("code")})
+    errors.sort(key=lambda error: error["index"])
+    recent_logs.add(ids, stored)
+    with timed("rule_evaluation"):
+        matches = await asyncio.get_running_loop().run_in_executor(None, rule_engine.evaluate_records, stored)
+    detections = publish_detections(matches, ids, stored)
+
+    took = time.perf_counter() - started
+    return {
+        "status": "success" if not errors else ("partial" if ids else "error"),
+        "received": len(items),
+        "indexed": len(ids),
+        "failed": len(errors),
+        "ids": ids,
+        "errors": errors,
+        "detections": [{"index": stored_positions[row], "id": detection["id"], "ruleId": detection["ruleId"],
+                        "rule": detection["rule"], "level": detection["level"]} for row, detection in detections],
+        "took_ms": round(took * 1000, 1),
+        "docs_per_sec": round(len(ids) / took, 1) if took > 0 else 0.0,
+        "writer": spool_replayer.stats() if INGEST_SPOOL else log_writer.stats()
+    }
+
+def feed_log_metrics(hits: List[Dict]):
+    """최근 로그 계층에 새로 들어온 로그를 메트릭 집계기에 더합니다. 시작 이전 로그는 초기 적재가 채웁니다."""
+    record_logs(log_metrics, [hit['_source'] for hit in hits], since=log_metrics.live_since)
+
+recent_logs.listeners.append(feed_log_metrics)
+
+async def backfill_log_metrics(started_at: datetime):
+    """서버 시작 이전의 로그를 분 단위 집계로 읽어 메트릭 집계기를 채웁니다."""
+    log_metrics.complete_since = started_at.timestamp()
+    start_time = started_at - timedelta(minutes=METRICS_BACKFILL_MINUTES)
+    try:
+        buckets = await analyzer.get_minute_metrics("security-logs", start_time, started_at,
+                                                    log_metrics.capacity)
+    except Exception:
+        logger.exception("메트릭 초기 적재 오류")
+        return
+    record_histogram(log_metrics, buckets)
+    log_metrics.complete_since = start_time.timestamp()
+
+async def ensure_log_index():
+    """보안 로그 인덱스(시간 분할이면 인덱스 템플릿)를 준비합니다. 클러스터에 닿지 않아도 시작은 계속합니다."""
+    try:
+        await analyzer.create_index("security-logs")
+    except Exception:
+        logger.exception("보안 로그 인덱스 준비 오류")
+
+# 준비 상태. 시작 작업은 포트를 연 뒤 백그라운드로 진행하고, 규칙을 불러오면 준비된 것으로 봅니다.
+readiness = {"ready": False, "startupSeconds": None, "readySeconds": None, "error": None}
+
+async def start_background_tasks():
+    started = time.perf_counter()
+    readiness.update(ready=False, startupSeconds=None, readySeconds=None, error=None)
+    anomaly_models.start()
+    if INGEST_SPOOL:
+        spool_replayer.start()
+    metrics_started = datetime.now(timezone.utc)
+    if HOT_TIER:
+        # follower가 클러스터에서 모든 워커와 외부 writer, spool 재생이 쓴 로그를 읽어 집계기를 채웁니다.
+        # follower가 없으면 이 프로세스가 받은 로그만 보게 되므로 메트릭은 항상 클러스터에서 조회합니다.
+        log_metrics.live_since = metrics_started.timestamp()
+        tier_follower.start()
+    loop = asyncio.get_running_loop()
+    loop.create_task(ensure_log_index())
+    loop.create_task(backfill_log_metrics(metrics_started))
+    loop.create_task(load_rules(started))
+    readiness["startupSeconds"] = round(time.perf_counter() - started, 4)
+    STARTUP_SECONDS.labels("startup").set(readiness["startupSeconds"])
+
+async def load_rules(started: float):
+    """Sigma 규칙을 불러온 뒤 준비 상태로 바꿉니다. 실패하면 준비되지 않은 상태로 오류를 보고합니다."""
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, rule_engine.load)
+    except Exception as e:
+        logger.exception("규칙 로드 오류")
+        readiness["error"] = str(e)
+        return
+    readiness["readySeconds"] = round(time.perf_counter() - started, 4)
+    readiness["ready"] = True
+    STARTUP_SECONDS.labels("ready").set(readiness["readySeconds"])
+    logger.info("준비 완료", extra={"importSeconds": IMPORT_SECONDS, **readiness})
+
+async def close_clients():
+    await anomaly_models.stop()
+    await tier_follower.stop()
+    await alert_broadcaster.stop()
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, log_writer.close)
+    await loop.run_in_executor(None, spool_replayer.stop)
+    ingest_spool.close()
+    await analyzer.close()
+    await trace_analyzer.close()
+    mark_worker_dead()
+
+@app.get("/api/ready")
+async def get_readiness():
+    """요청을 받을 준비가 되었는지 반환합니다. 준비 전이면 503이며 import/시작 시간을 함께 보고합니다.
+
+    클러스터 연결은 확인하지 않습니다. 클라이언트는 처음 조회할 때 만들어지므로 `clients`는 생성 여부입니다.
+    """
+    return ORJSONResponse({
+        **readiness,
+        "importSeconds": IMPORT_SECONDS,
+        "clients": {name: client.created for name, client in search_clients.items()},
+        "rules": len(rule_engine.rules)
+    }, status_code=200 if readiness["ready"] else 503)
+
 @app.post("/api/logs/search")
 async def search_logs(search_query: SearchQuery):
-    """보안 로그를 검색합니다."""
+    """보안 로그를 검색합니다.
+
+    단순한 쿼리의 최근 범위는 메모리 계층에서 최신순으로 찾고, 그보다 오래된 범위만 클러스터에 묻습니다.
+    """
     try:
-        results = analyzer.search_logs(
-            "security-logs",
-            search_query.query,
-            search_query.start_time,
-            search_query.end_time
-        )
-        return {"results": results}
+        matcher = compile_query(search_query.query)
+        start, end = search_query.start_time, search_query.end_time
+        # 시간대가 없는 시각은 클러스터처럼 UTC로 해석합니다.
+        start_at, end_at = (_epoch_seconds(start), _epoch_seconds(end)) if start and end else (None, None)
+        since = recent_logs.boundary(end_at) if matcher and start and end else None
+        if since is None:
+            results = await analyzer.search_logs("security-logs", search_query.query, start, end)
+            return {"results": results, "source": "opensearch"}
+
+        results = recent_logs.search(matcher, max(start_at, since), end_at, LOG_SEARCH_SIZE)
+        local = start_at >= since or len(results) >= LOG_SEARCH_SIZE
+        recent_logs.record(local)
+        if local:
+            return {"results": results, "source": "memory"}
+        # 경계의 로그는 양쪽에서 모두 나올 수 있으므로 _id로 한 번만 넣습니다.
+        older = await analyzer.search_logs("security-logs", search_query.query, start,
+                                           datetime.fromtimestamp(since, timezone.utc))
+        seen = {hit['_id'] for hit in results}
+        results += [hit for hit in older if hit['_id'] not in seen]
+        return {"results": results[:LOG_SEARCH_SIZE], "source": "tiered"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def anomaly_window_logs(size: int = 1000) -> List[Dict]:
+    """최근 1시간의 로그를 최대 size개 반환합니다. 메모리 계층에 있는 범위는 클러스터에 묻지 않습니다."""
+    end = time.time()
+    start = end - 3600
+    since = recent_logs.boundary(end)
+    if since is None:
+        return await analyzer.get_window_logs("security-logs", size)
+    logs = recent_logs.window(max(start, since), end, size)
+    local = start >= since or len(logs) >= size
+    recent_logs.record(local)
+    if local:
+        return logs
+    older = await analyzer.get_logs_between("security-logs", datetime.fromtimestamp(start, timezone.utc),
+                                            datetime.fromtimestamp(since, timezone.utc), size - len(logs))
+    return older + logs
+
 @app.get("/api/logs/anomalies")
 async def get_anomalies():
-    """이상 탐지된 로그를 반환합니다."""
+    """이상 탐지된 로그를 반환합니다. 학습된 모델로 최근 로그를 평가만 합니다."""
     try:
-        anomalies = analyzer.detect_anomalies("security-logs")
-        return {"anomalies": anomalies}
+        logs = await anomaly_window_logs()
+        return await anomaly_models.detect(logs)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def log_metrics_response(start: float) -> Dict:
+    """메모리 집계기에서 get_security_metrics와 같은 형식의 응답을 만듭니다."""
+    merged = log_metrics.query(start)
+    return {
+        "total_events": {"value": merged.totals["events"]},
+        "severity_distribution": terms_buckets(merged.counters.get("severity", {}).most_common(10)),
+        "event_types": terms_buckets(merged.counters.get("event_type", {}).most_common(10)),
+        "top_source_ips": terms_buckets(merged.heavy["source_ip"].top(10)),
+        "top_destination_ips": terms_buckets(merged.heavy["destination_ip"].top(10))
+    }
+
 @app.get("/api/metrics")
-async def get_metrics():
-    """보안 메트릭을 반환합니다."""
+async def get_metrics(window: str = '1h'):
+    """보안 메트릭을 반환합니다. 집계기가 window 전체를 가지고 있으면 메모리에서 계산합니다."""
     try:
-        metrics = analyzer.get_security_metrics("security-logs")
-        return metrics
+        try:
+            start = datetime.now() - analyzer.parse_time_window(window)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        # follower가 첫 조회를 마치기 전에는 시작 직후의 로그가 아직 집계기에 없습니다.
+        if recent_logs.complete_since is not None and log_metrics.covers(start.timestamp()):
+            return {**log_metrics_response(start.timestamp()), "source": "memory"}
+        metrics = await shared_query(f"security_metrics:{window}",
+                                     lambda: analyzer.get_security_metrics("security-logs", window))
+        return {**metrics, "source": "opensearch"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -87,106 +485,373 @@ async def get_metrics():
 async def get_trace_status():
     """Trace 인덱스 상태를 반환합니다."""
     try:
-        status = trace_analyzer.check_index_status("trace")
+        status = await trace_analyzer.check_index_status("trace")
         return status
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/stats")
+async def get_backend_stats():
+    """백엔드 조회 합치기(coalescing) 비율과 trace 캐시, 스트림, 명령줄 캐시 상태를 반환합니다."""
+    return {
+        "coalescing": query_flight.stats(),
+        "traceCache": trace_cache.stats(),
+        "stream": alert_broadcaster.stats(),
+        "commandLineCache": cache_stats(),
+        "timeline": timeline.stats(),
+        "histogramCache": histogram_cache.stats(),
+        "hotTier": tier_follower.stats(),
+        "sharedCache": shared_cache.stats() if shared_cache is not None else None,
+        "ingestSpool": spool_replayer.stats() if INGEST_SPOOL else None
+    }
+
+@app.get("/metrics", include_in_schema=False)
+async def get_prometheus_metrics():
+    """경로/백엔드 호출별 히스토그램과 캐시 적중률을 Prometheus 텍스트 형식으로 반환합니다.
+
+    PROMETHEUS_MULTIPROC_DIR이 없으면 응답한 워커 하나의 값입니다.
+    """
+    body, content_type = metrics_payload()
+    return Response(body, headers={"Content-Type": content_type})
+
+# ========== 응답 페이지/필드 선택 ==========
+# 응답 필드별로 SpanStore 행에서 값을 꺼내는 함수. 요청한 필드만 계산합니다.
+ALERT_FIELDS = {
+    "id": lambda store, row: store.span_id[row],
+    "traceID": lambda store, row: store.trace.value(row),
+    "host": lambda store, row: store.host.value(row),
+    "operationName": lambda store, row: store.operation.value(row),
+    "alert": lambda store, row: store.alert.value(row),
+    "image": lambda store, row: store.image.value(row),
+    "commandLine": lambda store, row: store.command_line[row],
+    "pid": lambda store, row: store.pid.value(row),
+    "eventId": lambda store, row: store.event_id.value(row),
+    "startTime": lambda store, row: int(store.start_time[row]),
+    "duration": lambda store, row: int(store.duration[row]),
+    "status": lambda store, row: "ERROR" if store.error[row] else "OK"
+}
+
+def select_fields(fields: Optional[str], available: Dict) -> List:
+    """fields= 파라미터(쉼표 구분)를 검증해 (이름, 함수) 목록으로 반환합니다."""
+    if not fields:
+        return list(available.items())
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"알 수 없는 필드: {', '.join(unknown)}")
+    return [(name, available[name]) for name in names]
+
+def project_rows(store: SpanStore, rows, getters: List) -> List[Dict]:
+    """선택한 행과 필드만으로 응답 dict를 만듭니다."""
+    return [{name: getter(store, row) for name, getter in getters} for row in rows]
+
+def encode_cursor(snapshot, offset: int, scope: str = '') -> str:
+    payload = json.dumps({"v": list(snapshot.version or ()), "o": offset, "f": scope}).encode()
+    return base64.urlsafe_b64encode(payload).decode()
+
+def paginate(snapshot, rows, cursor: Optional[str], limit: Optional[int], scope: str = ''):
+    """cursor 다음부터 limit개의 행과 다음 cursor를 반환합니다.
+
+    cursor에는 snapshot 버전이 들어 있어, 그 사이 데이터가 바뀌면 409를 반환합니다.
+    필터(scope)가 첫 페이지와 다르면 400을 반환합니다.
+    """
+    offset = 0
+    if cursor:
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            offset = int(payload["o"])
+        except (ValueError, KeyError, TypeError):
+            raise HTTPException(status_code=400, detail="잘못된 cursor입니다.")
+        if payload.get("v") != list(snapshot.version or ()):
+            raise HTTPException(status_code=409, detail="데이터가 변경되었습니다. 처음부터 다시 조회하세요.")
+        if payload.get("f", '') != scope:
+            raise HTTPException(status_code=400, detail="cursor와 필터 조건이 다릅니다.")
+    if limit is None:
+        return rows[offset:], None
+    end = offset + limit
+    return rows[offset:end], (encode_cursor(snapshot, end, scope) if end < len(rows) else None)
+
+# ========== trace/호스트/시간 필터 ==========
+def split_values(value: Optional[str]) -> Optional[List[str]]:
+    return [item.strip() for item in value.split(',') if item.strip()] if value else None
+
+class TraceScope:
+    """traceID/host(쉼표 구분)와 start/end(startTime, 마이크로초) 필터입니다."""
+
+    def __init__(self, trace_id: Optional[str] = None, host: Optional[str] = None,
+                 start: Optional[int] = None, end: Optional[int] = None):
+        self.trace_ids = split_values(trace_id)
+        self.hosts = split_values(host)
+        self.start = start
+        self.end = end
+
+    @property
+    def key(self) -> str:
+        if not (self.trace_ids or self.hosts or self.start is not None or self.end is not None):
+            return ''
+        return json.dumps([self.trace_ids, self.hosts, self.start, self.end])
+
+    def mask(self, store: SpanStore) -> Optional[np.ndarray]:
+        return store.filter_mask(self.trace_ids, self.hosts, self.start, self.end)
+
+    def select(self, store: SpanStore, rows: np.ndarray) -> np.ndarray:
+        """rows 중 필터에 맞는 행만 순서를 유지해 반환합니다."""
+        mask = self.mask(store)
+        return rows if mask is None else rows[mask[rows]]
+
+def trace_scope(trace_id: Optional[str] = Query(None, alias="traceID"), host: Optional[str] = None,
+                start: Optional[int] = None, end: Optional[int] = None) -> TraceScope:
+    return TraceScope(trace_id, host, start, end)
+
+def scope_trace_ids(store: SpanStore, rows: np.ndarray) -> List[str]:
+    """rows에 포함된 traceID를 처음 등장한 순서로 반환합니다."""
+    codes = store.trace.codes[rows]
+    unique, first = np.unique(codes, return_index=True)
+    return [store.trace.categories[code] for code in unique[np.argsort(first)]]
+
 @app.get("/api/trace/security-alerts")
-async def get_security_alerts():
-    """보안 알림이 포함된 trace 데이터를 반환합니다."""
+async def get_security_alerts(cursor: Optional[str] = None,
+                              limit: Optional[int] = Query(None, ge=1, le=1000),
+                              fields: Optional[str] = None,
+                              scope: TraceScope = Depends(trace_scope)):
+    """보안 알림이 포함된 trace 데이터를 반환합니다. cursor/limit로 페이지를, fields로 필드를 선택합니다.
+
+    traceID/host/start/end로 범위를 좁힐 수 있으며, 여러 trace의 알림은 startTime 순으로 병합됩니다.
+    """
     try:
-        # 전체 데이터 가져오기
-        data = trace_analyzer.get_all_data("trace", limit=1)
-        if not data:
+        getters = select_fields(fields, ALERT_FIELDS)
+        snapshot = await trace_cache.get("trace")
+        if snapshot is None:
             return {"alerts": [], "total": 0}
         
-        source = data[0]['_source']
-        spans = source.get('spans', [])
+        store = snapshot.store
         
-        # 보안 알림 추출
-        security_alerts = []
-        for span in spans:
-            span_tags = {tag['key']: tag['value'] for tag in span.get('tags', [])}
-            
-            if 'sigma.alert' in span_tags:
-                alert = {
-                    "id": span.get('spanID', ''),
-                    "operationName": span.get('operationName', ''),
-                    "alert": span_tags.get('sigma.alert', ''),
-                    "image": span_tags.get('Image', ''),
-                    "commandLine": span_tags.get('CommandLine', ''),
-                    "pid": span_tags.get('sysmon.pid', ''),
-                    "eventId": span_tags.get('sysmon.event_id', ''),
-                    "startTime": span.get('startTime', 0),
-                    "duration": span.get('duration', 0),
-                    "status": "ERROR" if span_tags.get('error') == True else "OK"
-                }
-                security_alerts.append(alert)
+        # 보안 알림 추출 (trace별 문서 순서를 유지하며 시간순 병합)
+        alert_rows = snapshot.derived(
+            "alert_rows", lambda store: store.merge_by_time(store.partition(np.flatnonzero(store.alert.present()))))
+        alert_rows = scope.select(store, alert_rows)
+        page, next_cursor = paginate(snapshot, alert_rows, cursor, limit, scope.key)
         
-        return {
-            "alerts": security_alerts,
-            "total": len(security_alerts),
-            "traceID": source.get('traceID', '')
-        }
+        return ORJSONResponse({
+            "alerts": project_rows(store, page.tolist(), getters),
+            "total": len(alert_rows),
+            "traceID": snapshot.trace_id,
+            "nextCursor": next_cursor
+        })
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def store_metrics(store: SpanStore, mask: Optional[np.ndarray] = None) -> Dict:
+    def count(condition: np.ndarray) -> int:
+        return int(np.count_nonzero(condition if mask is None else condition & mask))
+
+    alert_types = store.alert_types(mask)
+    rows = np.flatnonzero(mask) if mask is not None else np.arange(len(store))
+    return {
+        "totalSpans": len(rows),
+        "securityAlerts": count(store.alert.present()),
+        "processEvents": count(store.event_id.equals('1')),
+        "fileEvents": count(store.event_id.equals('11')),
+        "alertTypes": len(alert_types),
+        "alertTypesList": alert_types,
+        "traceCount": len(np.unique(store.trace.codes[rows])),
+        "hostCount": len(np.unique(store.host.codes[rows][store.host.codes[rows] != MISSING])),
+        "topImages": top_images(store, rows)
+    }
+
+def top_images(store: SpanStore, rows: np.ndarray) -> List[Dict]:
+    """rows에서 span 수가 많은 Image 상위 TOP_IMAGES개를 반환합니다."""
+    codes = store.image.codes[rows]
+    counts = np.bincount(codes[codes != MISSING], minlength=len(store.image.categories))
+    order = np.argsort(-counts, kind='stable')[:TOP_IMAGES]
+    return [{"image": store.image.categories[code], "count": int(counts[code])} for code in order if counts[code]]
+
+def window_trace_metrics(start: Optional[int], end: Optional[int]) -> Dict:
+    """분 단위 집계기에서 [start, end] (마이크로초) 범위의 메트릭을 합산합니다."""
+    merged = trace_metrics.query(start / 1_000_000 if start is not None else None,
+                                 end / 1_000_000 if end is not None else None)
+    alert_types = [alert for alert, _ in merged.heavy["sigma_alert"].top(trace_metrics.capacity)]
+    return {
+        "totalSpans": merged.totals["spans"],
+        "securityAlerts": merged.totals["alerts"],
+        "processEvents": merged.totals["processEvents"],
+        "fileEvents": merged.totals["fileEvents"],
+        "alertTypes": len(alert_types),
+        "alertTypesList": alert_types,
+        "topImages": [{"image": image, "count": count} for image, count in merged.heavy["image"].top(TOP_IMAGES)]
+    }
+
+def recent_span_metrics(scope: TraceScope) -> Dict:
+    """최근 데이터 계층의 span으로 scope 범위의 메트릭을 계산합니다."""
+    store = recent_spans.store()
+    mask = scope.mask(store)
+    trace_ids = scope_trace_ids(store, np.flatnonzero(mask))
+    return {"traceID": trace_ids[0] if trace_ids else '', **store_metrics(store, mask)}
+
 @app.get("/api/trace/metrics")
-async def get_trace_metrics():
-    """Trace 데이터 메트릭을 반환합니다."""
+async def get_trace_metrics(scope: TraceScope = Depends(trace_scope)):
+    """Trace 데이터 메트릭을 반환합니다.
+
+    trace 인덱스에 펼친 span 필드(setup_span_fields)가 있으면 클러스터에서 집계해 버킷만 받습니다.
+    그렇지 않으면 trace 캐시를 사용합니다. start/end(startTime, 마이크로초)만 지정하면 분 단위
+    집계기로, traceID/host를 지정하면 해당 trace들의 span으로 정확히 계산합니다.
+    start가 최근 데이터 계층 범위 안이면 클러스터 대신 메모리의 span으로 계산합니다.
+    """
     try:
-        # 전체 데이터 가져오기
-        data = trace_analyzer.get_all_data("trace", limit=1)
-        if not data:
+        if TRACE_METRICS_SOURCE == 'auto' and await trace_analyzer.has_span_fields("trace"):
+            # trace/호스트 수는 두 계층에서 따로 센 값을 합칠 수 없으므로 최근 범위 안의 조회만 메모리에서 처리합니다.
+            local = recent_spans.covers(scope.start)
+            recent_spans.record(local)
+            if local:
+                metrics = await asyncio.get_running_loop().run_in_executor(None, recent_span_metrics, scope)
+                return {**metrics, "source": "memory"}
+            metrics = await shared_query(
+                f"trace_metrics:{scope.key}",
+                lambda: trace_analyzer.get_span_metrics("trace", scope.start, scope.end, scope.trace_ids,
+                                                        scope.hosts, trace_metrics.capacity))
+            if metrics is not None:
+                return {**metrics, "source": "cluster"}
+
+        snapshot = await trace_cache.get("trace")
+        if snapshot is None:
             return {"error": "No data found"}
         
-        source = data[0]['_source']
-        spans = source.get('spans', [])
-        
-        # 메트릭 계산
-        total_spans = len(spans)
-        security_alerts = 0
-        process_events = 0
-        file_events = 0
-        alert_types = set()
+        # 전체 메트릭은 snapshot마다 한 번만 계산하고, 시간 범위만 있으면 집계기가 그 범위를 빠짐없이
+        # 가지고 있을 때만(보관 기간 안) 분 단위 집계기를 사용합니다.
+        if not scope.key:
+            metrics = snapshot.derived("metrics", store_metrics)
+        elif not (scope.trace_ids or scope.hosts) and trace_metrics.covers(
+                scope.start / 1_000_000 if scope.start is not None else None):
+            metrics = window_trace_metrics(scope.start, scope.end)
+        else:
+            mask = scope.mask(snapshot.store)
+            trace_ids = scope_trace_ids(snapshot.store, np.flatnonzero(mask))
+            metrics = {**store_metrics(snapshot.store, mask), "traceID": trace_ids[0] if trace_ids else ''}
         
-        for span in spans:
-            span_tags = {tag['key']: tag['value'] for tag in span.get('tags', [])}
-            
-            if 'sigma.alert' in span_tags:
-                security_alerts += 1
-                alert_types.add(span_tags['sigma.alert'])
-            
-            if span_tags.get('sysmon.event_id') == '1':
-                process_events += 1
-            elif span_tags.get('sysmon.event_id') == '11':
-                file_events += 1
-        
-        return {
-            "totalSpans": total_spans,
-            "securityAlerts": security_alerts,
-            "processEvents": process_events,
-            "fileEvents": file_events,
-            "alertTypes": len(alert_types),
-            "traceID": source.get('traceID', ''),
-            "alertTypesList": list(alert_types)
-        }
+        return {"traceID": snapshot.trace_id, **metrics, "source": "cache"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# ========== 전처리 함수 ==========
-def clean_cmd(cmd: str) -> str:
-    """CommandLine에서 주요 실행 파일만 추출"""
-    if isinstance(cmd, str):
-        match = re.search(r'([a-zA-Z0-9_-]+\.exe)', cmd)
-        return match.group(1) if match else cmd
-    return cmd
+def store_histogram(store: SpanStore, start: int, end: int, interval: int,
+                    trace_ids: Optional[List[str]] = None, hosts: Optional[List[str]] = None) -> Dict[int, Dict]:
+    """trace 캐시의 span으로 [start, end]의 interval 간격 히스토그램 버킷(버킷 시작 -> 버킷)을 만듭니다."""
+    rows = np.flatnonzero(store.filter_mask(trace_ids, hosts, start, end))
+    keys, inverse = np.unique(store.start_time[rows] // interval * interval, return_inverse=True)
+    counts = np.bincount(inverse, minlength=len(keys))
+    alerts = np.bincount(inverse, weights=store.alert.codes[rows] != MISSING, minlength=len(keys))
+    buckets = {key: {"key": key, "count": int(count), "alerts": int(alert), "eventTypes": {}}
+               for key, count, alert in zip(keys.tolist(), counts.tolist(), alerts.tolist())}
+
+    event_codes = store.event_id.codes[rows]
+    has_event = event_codes != MISSING
+    if has_event.any():
+        pairs, pair_counts = np.unique(np.stack([inverse[has_event], event_codes[has_event]]), axis=1,
+                                       return_counts=True)
+        for (position, code), count in zip(pairs.T.tolist(), pair_counts.tolist()):
+            buckets[int(keys[position])]["eventTypes"][store.event_id.categories[code]] = count
+    return buckets
+
+def store_bounds(store: SpanStore, trace_ids: Optional[List[str]] = None,
+                 hosts: Optional[List[str]] = None) -> Optional[tuple]:
+    mask = store.filter_mask(trace_ids, hosts)
+    times = store.start_time if mask is None else store.start_time[mask]
+    return (int(times.min()), int(times.max())) if len(times) else None
+
+@app.get("/api/trace/histogram")
+async def get_trace_histogram(buckets: int = Query(200, ge=1, le=HISTOGRAM_MAX_BUCKETS),
+                              interval: Optional[str] = None,
+                              downsample: Optional[str] = None,
+                              points: int = Query(100, ge=3, le=HISTOGRAM_MAX_BUCKETS),
+                              scope: TraceScope = Depends(trace_scope)):
+    """span 수, 알림 수, Event ID별 수의 시간 히스토그램을 반환합니다.
+
+    interval을 주지 않으면 start~end(없으면 데이터 전체) 범위가 buckets개 이하가 되는 간격을 고릅니다.
+    downsample=lttb|minmax이면 차트용으로 points개 안팎의 버킷만 남깁니다. 닫힌 버킷은 인덱스 버전별로
+    캐시하므로 데이터가 그대로면 같은 범위를 다시 그릴 때 최근 버킷만 새로 집계합니다.
+    """
+    try:
+        if downsample is not None and downsample not in DOWNSAMPLE_METHODS:
+            raise HTTPException(status_code=400, detail=f"지원하지 않는 다운샘플링: {downsample}")
+        try:
+            step = parse_interval(interval) if interval else None
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        loop = asyncio.get_running_loop()
+        if TRACE_METRICS_SOURCE == 'auto' and await trace_analyzer.has_span_fields("trace"):
+            source = "cluster"
+            version = await trace_analyzer.get_index_version("trace")
+            bounds = None
+            if scope.start is None or scope.end is None:
+                bounds = await trace_analyzer.get_span_bounds("trace", scope.trace_ids, scope.hosts)
 
+            async def fetch(start: int, end: int, step: int):
+                # 최근 데이터 계층이 온전히 가진 버킷은 메모리에서, 그 이전 버킷만 클러스터에서 집계합니다.
+                boundary = recent_spans.boundary(step)
+                recent_spans.record(boundary is not None and start >= boundary)
+                if boundary is None or end < boundary:
+                    return await trace_analyzer.get_span_histogram("trace", start, end, step,
+                                                                   scope.trace_ids, scope.hosts)
+                recent = await loop.run_in_executor(None, lambda: store_histogram(
+                    recent_spans.store(), max(start, boundary), end, step, scope.trace_ids, scope.hosts))
+                if start >= boundary:
+                    return recent
+                older = await trace_analyzer.get_span_histogram("trace", start, boundary - 1, step,
+                                                                scope.trace_ids, scope.hosts)
+                return {**older, **recent} if older is not None else None
+        else:
+            source = "cache"
+            snapshot = await trace_cache.get("trace")
+            if snapshot is None:
+                return {"buckets": [], "totalBuckets": 0, "source": source}
+            store = snapshot.store
+            version = snapshot.version
+            bounds = store_bounds(store, scope.trace_ids, scope.hosts)
+
+            async def fetch(start: int, end: int, step: int):
+                return await loop.run_in_executor(None, store_histogram, store, start, end, step,
+                                                  scope.trace_ids, scope.hosts)
+
+        if bounds is None and (scope.start is None or scope.end is None):
+            return {"buckets": [], "totalBuckets": 0, "source": source}
+        start = scope.start if scope.start is not None else bounds[0]
+        end = scope.end if scope.end is not None else bounds[1]
+        if end < start:
+            raise HTTPException(status_code=400, detail="end가 start보다 앞섭니다.")
+        step = step or choose_interval(start, end, buckets)
+        if end // step - start // step + 1 > HISTOGRAM_MAX_BUCKETS:
+            raise HTTPException(status_code=400, detail=f"버킷이 {HISTOGRAM_MAX_BUCKETS}개를 넘습니다. interval을 늘리세요.")
+
+        with timed("histogram"):
+            result, cached = await histogram_cache.histogram(
+                (source, tuple(scope.trace_ids or ()), tuple(scope.hosts or ())), start, end, step,
+                int(time.time() * 1_000_000), fetch, version)
+        total = len(result)
+        if downsample:
+            result = downsample_buckets(result, downsample, points)
+        return ORJSONResponse({
+            "interval": format_interval(step),
+            "intervalMicros": step,
+            "start": start - start % step,
+            "end": end - end % step + step - 1,
+            "buckets": result,
+            "totalBuckets": total,
+            "cachedBuckets": cached,
+            "downsample": downsample,
+            "source": source
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ========== 전처리 함수 ==========
 def get_user_action_description(event: Dict) -> str:
     """사용자 행동 설명 생성 (실행/종료 명시)"""
     event_id = event.get('eventType', '')
-    image = event.get('image', '').split('\\')[-1] if event.get('image') else 'unknown'
+    image = image_name(event.get('image')) if event.get('image') else 'unknown'
     
     if event_id == '1':
         return f"{image} 실행"
@@ -197,144 +862,288 @@ def get_user_action_description(event: Dict) -> str:
     else:
         return f"{image} 작업"
 
+def behavior_description(action) -> str:
+    return get_user_action_description({"eventType": action.event_id, "image": action.image})
+
+TIMELINE_FIELDS = {
+    "timestamp": lambda action: action.timestamp,
+    "traceID": lambda action: action.trace_id,
+    "host": lambda action: action.host,
+    "operationName": lambda action: action.operation,
+    "eventType": lambda action: action.event_id,
+    "image": lambda action: action.image,
+    "hasAlert": lambda action: bool(action.alert),
+    "alert": lambda action: action.alert,
+    "pid": lambda action: action.pid,
+    "parentPid": lambda action: action.ppid,
+    "commandLine": lambda action: action.command_line,
+    "mainCommand": lambda action: clean_cmd(action.command_line),
+    "executable": lambda action: parse_command_line(action.command_line).executable,
+    "arguments": lambda action: parse_command_line(action.command_line).arguments,
+    "scriptHost": lambda action: parse_command_line(action.command_line).script_host,
+    "encodedPayload": lambda action: parse_command_line(action.command_line).encoded,
+    "user": lambda action: action.user,
+    "duration": lambda action: action.duration,
+    "eventName": lambda action: action.event_name,
+    "sessionId": lambda action: action.session,
+    "behaviorDescription": behavior_description
+}
+
 @app.get("/api/trace/timeline")
-async def get_trace_timeline():
-    """Trace 이벤트 타임라인을 반환합니다 (14개 사용자 행동 정확히 추출)."""
+async def get_trace_timeline(cursor: Optional[str] = None,
+                             limit: Optional[int] = Query(None, ge=1, le=1000),
+                             fields: Optional[str] = None,
+                             scope: TraceScope = Depends(trace_scope)):
+    """Trace 이벤트 타임라인(프로세스 시작/종료를 PID 기준으로 중복 제거한 사용자 행동)을 반환합니다.
+
+    행동은 타임라인 엔진에 시간순으로 누적되며, start/end는 정렬된 인덱스에서 bisect로,
+    traceID/host는 그 범위 안에서 고릅니다.
+    """
     try:
-        data = trace_analyzer.get_all_data("trace", limit=1)
-        if not data:
+        getters = select_fields(fields, TIMELINE_FIELDS)
+        # 새 snapshot을 읽으면 listener인 타임라인 엔진이 새 이벤트만 반영합니다.
+        with timed("trace_cache"):
+            snapshot = await trace_cache.get("trace")
+        if snapshot is None:
             return {"timeline": []}
         
-        source = data[0]['_source']
-        spans = source.get('spans', [])
-        
-        # ========== 14개 사용자 행동 정확 추출 로직 시작 ==========
-        
-        # 1. 스팬들을 처리하여 기본 이벤트 리스트 생성
-        all_events = []
-        for span in spans:
-            span_tags = {tag['key']: tag['value'] for tag in span.get('tags', [])}
-            
-            # CommandLine 정리
-            raw_cmd = span_tags.get('CommandLine', '')
-            cleaned_cmd = clean_cmd(raw_cmd)
-            
-            event = {
-                "timestamp": span.get('startTime', 0),
-                "operationName": span.get('operationName', ''),
-                "eventType": span_tags.get('sysmon.event_id', 'unknown'),
-                "image": span_tags.get('Image', ''),
-                "hasAlert": 'sigma.alert' in span_tags,
-                "alert": span_tags.get('sigma.alert', ''),
-                "pid": span_tags.get('sysmon.pid', ''),
-                "parentPid": span_tags.get('sysmon.ppid', ''),
-                "commandLine": raw_cmd,
-                "mainCommand": cleaned_cmd,
-                "user": span_tags.get('User', ''),
-                "duration": span.get('duration', 0),
-                "eventName": span_tags.get('EventName', '')
-            }
-            all_events.append(event)
-        
-        # 2. 시간순 정렬
-        all_events.sort(key=lambda x: x['timestamp'])
-        
-        # 3. 프로세스 시작/종료 이벤트만 추출
-        process_events = []
-        for event in all_events:
-            event_id = event['eventType']
-            
-            # 프로세스 시작 (Event ID 1)
-            if event_id == '1':
-                event['behaviorDescription'] = get_user_action_description(event)
-                process_events.append(event)
-            # 프로세스 종료 (Event ID 5)
-            elif event_id == '5':
-                event['behaviorDescription'] = get_user_action_description(event)
-                process_events.append(event)
-        
-        # 4. PID 기준으로 중복 제거
-        final_events = []
-        pid_status = {}  # {PID: 현재상태}
-        
-        for event in process_events:
-            event_id = event['eventType']
-            pid = event.get('pid', '')
-            
-            if not pid:  # PID가 없으면 건너뛰기
-                continue
-                
-            current_status = pid_status.get(pid, '종료됨')
-            
-            if event_id == '1':  # 프로세스 시작
-                if current_status == '종료됨':
-                    final_events.append(event)
-                    pid_status[pid] = '실행중'
-            elif event_id == '5':  # 프로세스 종료
-                if current_status == '실행중':
-                    final_events.append(event)
-                    pid_status[pid] = '종료됨'
-        
-        print(f"🔄 14개 사용자 행동 정확 추출 결과:")
-        print(f"  - 전체 이벤트: {len(all_events)}개")
-        print(f"  - 프로세스 이벤트: {len(process_events)}개")
-        print(f"  - 최종 사용자 행동: {len(final_events)}개")
-        
-        # 프로세스별 통계
-        process_counts = {}
-        for event in final_events:
-            image = event.get('image', '').split('\\')[-1]
-            process_counts[image] = process_counts.get(image, 0) + 1
-        
-        print(f"  - 프로세스별 행동 수: {process_counts}")
+        actions = timeline.actions(scope.start, scope.end, scope.trace_ids, scope.hosts)
+        page, next_cursor = paginate(timeline, actions, cursor, limit, scope.key)
         
-        # 사용자 행동 시퀀스 출력
-        print("📋 최종 사용자 행동 시퀀스:")
-        for i, event in enumerate(final_events):
-            print(f"  {i+1}. {event.get('behaviorDescription', 'Unknown')}")
-        
-        # ========== 14개 사용자 행동 정확 추출 로직 끝 ==========
-        
-        return {"timeline": final_events}
+        return ORJSONResponse({
+            "timeline": [{name: getter(action) for name, getter in getters} for action in page],
+            "total": len(actions),
+            "nextCursor": next_cursor
+        })
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/trace/sessions")
+async def get_action_sessions(cursor: Optional[str] = None,
+                              limit: Optional[int] = Query(None, ge=1, le=1000),
+                              running: Optional[bool] = None,
+                              scope: TraceScope = Depends(trace_scope)):
+    """프로세스 실행 세션(시작, 종료, 실행 시간, 자식 세션)을 시작 순으로 반환합니다.
+
+    start/end는 세션 시작 시각 기준이며, running=true/false로 실행 중인 세션만 또는 종료된 세션만 고릅니다.
+    """
+    try:
+        snapshot = await trace_cache.get("trace")
+        if snapshot is None:
+            return {"sessions": [], "total": 0}
+
+        sessions = timeline.sessions(scope.start, scope.end, scope.trace_ids, scope.hosts, running)
+        page, next_cursor = paginate(timeline, sessions, cursor, limit, json.dumps([scope.key, running]))
+        return ORJSONResponse({
+            "sessions": [session.to_dict() for session in page],
+            "total": len(sessions),
+            "statistics": timeline.stats(),
+            "nextCursor": next_cursor
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/trace/sessions/{session_id}")
+async def get_action_session(session_id: int):
+    """세션 하나와 그 자식 세션 목록을 반환합니다."""
+    session = timeline.session(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"세션을 찾을 수 없습니다: {session_id}")
+    children = [timeline.session(child) for child in session.children]
+    return {"session": session.to_dict(),
+            "children": [child.to_dict() for child in children if child is not None]}
+
+@app.get("/api/trace/stream")
+async def stream_trace_alerts(request: Request):
+    """새 보안 알림과 메트릭 변화량을 Server-Sent Events로 전달합니다."""
+    queue = alert_broadcaster.subscribe()
+
+    async def events():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                yield b"event: " + message["event"].encode() + b"\ndata: " + orjson.dumps(message["data"]) + b"\n\n"
+        finally:
+            alert_broadcaster.unsubscribe(queue)
+
+    # 압축 미들웨어가 스트림을 버퍼링하지 않도록 Content-Encoding을 명시합니다.
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "Content-Encoding": "identity",
+        "X-Accel-Buffering": "no"
+    })
+
+# ========== Sigma 규칙 ==========
+@app.get("/api/rules")
+async def list_rules():
+    """불러온 Sigma 규칙과 규칙별 탐지 수/평가 비용, 전체 통계를 반환합니다."""
+    return {
+        "rules": [rule_engine.describe(rule) for rule in rule_engine.rules],
+        "statistics": rule_engine.summary(),
+        "errors": rule_engine.load_errors
+    }
+
+@app.post("/api/rules/reload")
+async def reload_rules():
+    """규칙 디렉터리를 다시 읽어 컴파일합니다. 규칙별 카운터는 유지됩니다."""
+    try:
+        loaded = await asyncio.get_running_loop().run_in_executor(None, rule_engine.load)
+        return {"status": "success", "loaded": loaded, "version": rule_engine.version,
+                "errors": rule_engine.load_errors}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/rules/detections")
+async def get_rule_detections(limit: int = Query(100, ge=1, le=1000), rule: Optional[str] = None):
+    """수집 시점에 규칙에 일치한 최근 보안 로그를 최신순으로 반환합니다."""
+    detections = [detection for detection in reversed(recent_detections)
+                  if rule is None or detection["ruleId"] == rule]
+    return {"detections": detections[:limit], "total": len(detections)}
+
+@app.get("/api/rules/{rule_id}")
+async def get_rule(rule_id: str):
+    """규칙 하나의 정보와 detection 정의를 반환합니다."""
+    rule = rule_engine.rule(rule_id)
+    if rule is None:
+        raise HTTPException(status_code=404, detail=f"규칙을 찾을 수 없습니다: {rule_id}")
+    return {**rule_engine.describe(rule), "logsource": rule.logsource, "detection": rule.document.get('detection')}
+
+@app.get("/api/trace/rule-matches")
+async def get_rule_matches(cursor: Optional[str] = None,
+                           limit: Optional[int] = Query(None, ge=1, le=1000),
+                           fields: Optional[str] = None,
+                           rule: Optional[str] = None,
+                           scope: TraceScope = Depends(trace_scope)):
+    """Sigma 규칙에 일치한 span을 startTime 순으로 반환합니다. rule(쉼표 구분)로 규칙을 고를 수 있습니다."""
+    try:
+        getters = select_fields(fields, ALERT_FIELDS)
+        snapshot = await trace_cache.get("trace")
+        if snapshot is None:
+            return {"matches": [], "total": 0}
+
+        store = snapshot.store
+        loop = asyncio.get_running_loop()
+        # 규칙을 다시 읽은 뒤라면 한 번 다시 평가합니다 (이미 센 span이므로 탐지 수는 더하지 않습니다).
+        matches = await loop.run_in_executor(
+            None, snapshot.derived, rule_engine.matches_key,
+            lambda store: rule_engine.evaluate_store(store, np.zeros(len(store), dtype=bool)))
+
+        positions = np.arange(len(matches["rows"]))
+        rule_ids = split_values(rule)
+        if rule_ids:
+            selected = [index for index, matched in enumerate(matches["rules"]) if matched.id in rule_ids]
+            positions = positions[np.isin(matches["rule_index"], selected)]
+        mask = scope.mask(store)
+        if mask is not None:
+            positions = positions[mask[matches["rows"][positions]]]
+        page, next_cursor = paginate(snapshot, positions, cursor, limit,
+                                     json.dumps([scope.key, rule_ids, rule_engine.version]))
+
+        items = []
+        for position in page.tolist():
+            matched = matches["rules"][matches["rule_index"][position]]
+            items.append({"ruleId": matched.id, "rule": matched.title, "level": matched.level,
+                          **project_rows(store, [int(matches["rows"][position])], getters)[0]})
+        return ORJSONResponse({
+            "matches": items,
+            "total": len(positions),
+            "rulesVersion": rule_engine.version,
+            "nextCursor": next_cursor
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def build_process_trees(store: SpanStore) -> List[ProcessTreeIndex]:
+    """trace마다 프로세스 트리 인덱스를 만듭니다."""
+    return [ProcessTreeIndex(store, rows) for rows in store.partition(np.arange(len(store)))]
+
+async def load_process_trees(scope: Optional[TraceScope] = None) -> List[ProcessTreeIndex]:
+    """캐시된 trace들의 프로세스 트리 인덱스 중 scope의 traceID/host에 맞는 것을 반환합니다.
+
+    인덱스는 snapshot마다 처음 한 번만 만듭니다.
+    """
+    snapshot = await trace_cache.get("trace")
+    if snapshot is None:
+        return []
+    loop = asyncio.get_running_loop()
+    trees = await loop.run_in_executor(None, snapshot.derived, "process_trees", build_process_trees)
+    if scope is None or not (scope.trace_ids or scope.hosts):
+        return trees
+    store = snapshot.store
+    selected = set(np.unique(store.trace.codes[store.filter_mask(scope.trace_ids, scope.hosts)]).tolist())
+    return [tree for tree in trees if store.trace.codes[tree.span_rows[0]] in selected]
+
+def find_process(trees: List[ProcessTreeIndex], pid: str, start_time: Optional[int]):
+    """(pid, startTime) 프로세스를 찾습니다. start_time이 없으면 모든 trace 중 가장 최근 프로세스입니다."""
+    found = None
+    for tree in trees:
+        node = tree.find(pid, start_time)
+        if node >= 0 and (found is None or tree.start_times[node] > found[0].start_times[found[1]]):
+            found = (tree, node)
+    if found is None:
+        raise HTTPException(status_code=404, detail=f"프로세스를 찾을 수 없습니다: {pid}")
+    return found
+
 @app.get("/api/trace/process-tree")
-async def get_process_tree():
-    """프로세스 트리 구조를 반환합니다."""
+async def get_process_tree(depth: Optional[int] = None, scope: TraceScope = Depends(trace_scope)):
+    """프로세스 트리 구조를 반환합니다. 루트부터 depth 단계까지 자식을 중첩해 반환합니다.
+
+    trace마다 따로 만든 트리의 루트를 startTime 순으로 병합하며, traceID/host로 trace를 고릅니다.
+    """
     try:
-        data = trace_analyzer.get_all_data("trace", limit=1)
-        if not data:
-            return {"processes": []}
-        
-        source = data[0]['_source']
-        spans = source.get('spans', [])
-        
-        # 프로세스별 정보 수집
-        processes = {}
-        for span in spans:
-            span_tags = {tag['key']: tag['value'] for tag in span.get('tags', [])}
-            
-            if span_tags.get('sysmon.event_id') == '1':  # Process creation event
-                pid = span_tags.get('sysmon.pid', '')
-                ppid = span_tags.get('sysmon.ppid', '')
-                
-                process_info = {
-                    "pid": pid,
-                    "ppid": ppid,
-                    "image": span_tags.get('Image', ''),
-                    "commandLine": span_tags.get('CommandLine', ''),
-                    "startTime": span.get('startTime', 0),
-                    "hasAlert": 'sigma.alert' in span_tags,
-                    "alert": span_tags.get('sigma.alert', ''),
-                    "children": []
-                }
-                processes[pid] = process_info
+        trees = await load_process_trees(scope)
+        if not trees:
+            return {"processes": [], "total": 0}
         
-        return {"processes": list(processes.values())}
+        roots = merge(*([(tree, root) for root in tree.roots] for tree in trees),
+                      key=lambda item: item[0].start_times[item[1]])
+        return {
+            "processes": [tree.subtree(root, depth) for tree, root in roots],
+            "total": sum(len(tree) for tree in trees)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/trace/process-tree/{pid}")
+async def get_process_subtree(pid: str, start_time: Optional[int] = None, depth: Optional[int] = 2,
+                              scope: TraceScope = Depends(trace_scope)):
+    """(pid, startTime) 프로세스의 하위 트리를 depth 단계까지 반환합니다."""
+    try:
+        tree, node = find_process(await load_process_trees(scope), pid, start_time)
+        return {"process": tree.subtree(node, depth)}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/trace/process-tree/{pid}/ancestors")
+async def get_process_ancestors(pid: str, start_time: Optional[int] = None,
+                                scope: TraceScope = Depends(trace_scope)):
+    """(pid, startTime) 프로세스의 부모부터 루트까지를 반환합니다."""
+    try:
+        tree, node = find_process(await load_process_trees(scope), pid, start_time)
+        return {
+            "process": tree.node_info(node),
+            "ancestors": [tree.node_info(ancestor) for ancestor in tree.ancestors(node)]
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+IMPORT_SECONDS = round(time.perf_counter() - _import_started, 4)
+STARTUP_SECONDS.labels("import").set(IMPORT_SECONDS)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8002) 
\ No newline at end of file
@@ -1,27 +1,142 @@
-from opensearchpy import OpenSearch, helpers
-from datetime import datetime, timedelta
-import pandas as pd
-import numpy as np
-from sklearn.ensemble import IsolationForest
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import Future
+import asyncio
 import json
+import logging
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
+from lazy_client import LazyClient
+
 load_dotenv()
 
-class SecurityLogAnalyzer:
-    def __init__(self):
-        self.client = OpenSearch(
-            hosts=[{'host': os.getenv('OPENSEARCH_HOST', 'localhost'), 'port': 9200}],
-            http_auth=(os.getenv('OPENSEARCH_USER', 'admin'), os.getenv('OPENSEARCH_PASSWORD', 'admin')),
-            use_ssl=True,
-            verify_certs=False,
-            ssl_show_warn=False
-        )
-        
-    def create_index(self, index_name):
-        """보안 로그를 저장할 인덱스를 생성합니다."""
-        index_settings = {
+logger = logging.getLogger(__name__)
+
+def build_client_options(pool_size=None, timeout=None, max_retries=None) -> Dict:
+    """동기/비동기 OpenSearch 클라이언트가 공유하는 연결 설정을 만듭니다."""
+    return {
+        "hosts": [{'host': os.getenv('OPENSEARCH_HOST', 'localhost'), 'port': 9200}],
+        "http_auth": (os.getenv('OPENSEARCH_USER', 'admin'), os.getenv('OPENSEARCH_PASSWORD', 'admin')),
+        "use_ssl": True,
+        "verify_certs": False,
+        "ssl_show_warn": False,
+        # 커넥션 풀 크기와 요청 타임아웃
+        "pool_maxsize": pool_size or int(os.getenv('OPENSEARCH_POOL_SIZE', '10')),
+        "timeout": timeout or float(os.getenv('OPENSEARCH_TIMEOUT', '30')),
+        "max_retries": max_retries if max_retries is not None else int(os.getenv('OPENSEARCH_MAX_RETRIES', '3')),
+        "retry_on_timeout": True
+    }
+
+def create_client(asynchronous: bool = False, **options):
+    """OpenSearch 클라이언트를 만듭니다. opensearchpy는 불러오는 데 시간이 걸려 처음 만들 때 불러옵니다."""
+    from opensearchpy import AsyncOpenSearch, OpenSearch
+    return (AsyncOpenSearch if asynchronous else OpenSearch)(**build_client_options(**options))
+
+def query_now() -> datetime:
+    """현재 시각을 QUERY_TIME_BUCKET초 단위로 내림해 naive UTC로 반환합니다.
+
+    같은 구간에 동시에 들어온 "최근 N분" 쿼리가 같은 본문이 되어 single-flight로 합쳐질 수 있습니다.
+    클러스터와 인덱스 분할(_utc)처럼 UTC 기준이므로 서버의 시간대와 관계없이 같은 범위를 조회합니다.
+    """
+    bucket = max(int(os.getenv('QUERY_TIME_BUCKET', '1')), 1)
+    seconds = int(time.time())
+    return datetime.fromtimestamp(seconds - seconds % bucket, timezone.utc).replace(tzinfo=None)
+
+def _utc(value) -> Optional[datetime]:
+    """시각을 클러스터가 해석하는 naive UTC datetime으로 바꿉니다. 시간대가 없는 값은 UTC로 봅니다."""
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value / 1000, timezone.utc).replace(tzinfo=None)
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+class IndexPartitions:
+    """보안 로그를 시간 단위 인덱스(`security-logs-2024.01.31`, hour면 `security-logs-2024.01.31.13`)로 나눕니다.
+
+    문서는 timestamp가 속한 구간의 인덱스에 쓰고, 시간 범위 조회는 범위와 겹치는 인덱스만 대상으로 합니다.
+    시작 시각이 없거나 `max_targets`개보다 많은 인덱스에 걸치면 `<base>-*` 패턴으로 조회합니다.
+    LOG_INDEX_PERIOD=none이면 예전처럼 base 인덱스 하나에 쓰고 읽습니다.
+    """
+
+    FORMATS = {"day": "%Y.%m.%d", "hour": "%Y.%m.%d.%H"}
+
+    def __init__(self, period: str = None, max_targets: int = None):
+        self.period = (period or os.getenv('LOG_INDEX_PERIOD', 'day')).lower()
+        if self.period not in ("day", "hour", "none"):
+            raise ValueError(f"지원하지 않는 인덱스 분할 단위: {self.period}")
+        self.max_targets = max_targets or int(os.getenv('LOG_INDEX_MAX_TARGETS', '64'))
+
+    @property
+    def enabled(self) -> bool:
+        return self.period != "none"
+
+    @property
+    def step(self) -> timedelta:
+        return timedelta(days=1) if self.period == "day" else timedelta(hours=1)
+
+    def pattern(self, base: str) -> str:
+        return f"{base}-*" if self.enabled else base
+
+    def index_for(self, base: str, timestamp) -> str:
+        """timestamp의 문서를 쓸 인덱스 이름입니다. timestamp를 읽을 수 없으면 현재 구간에 씁니다."""
+        if not self.enabled:
+            return base
+        moment = _utc(timestamp) or datetime.now(timezone.utc).replace(tzinfo=None)
+        return f"{base}-{moment.strftime(self.FORMATS[self.period])}"
+
+    def indices(self, base: str, start=None, end=None) -> str:
+        """[start, end] 범위와 겹치는 인덱스 이름을 쉼표로 이어 반환합니다. end가 없으면 현재까지입니다."""
+        if not self.enabled:
+            return base
+        start = _utc(start) if start is not None else None
+        if start is None:
+            return self.pattern(base)
+        end = _utc(end) if end is not None else None
+        if end is None:
+            # 수집 시각을 현지 시각(naive)으로 쓴 문서도 포함하도록 UTC와 현지 시각 중 늦은 쪽의 다음 구간까지 봅니다.
+            end = max(datetime.now(timezone.utc).replace(tzinfo=None), datetime.now()) + self.step
+        moment = start.replace(minute=0, second=0, microsecond=0)
+        if self.period == "day":
+            moment = moment.replace(hour=0)
+        names = []
+        while moment <= end:
+            if len(names) >= self.max_targets:
+                return self.pattern(base)
+            names.append(f"{base}-{moment.strftime(self.FORMATS[self.period])}")
+            moment += self.step
+        return ",".join(names) or self.index_for(base, start)
+
+class SecurityLogQueries:
+    """SecurityLogAnalyzer와 AsyncSecurityLogAnalyzer가 공유하는 쿼리 본문입니다."""
+
+    partitions: IndexPartitions
+
+    def search_target(self, index_name, start_time=None, end_time=None) -> Dict:
+        """[start_time, end_time]과 겹치는 인덱스만 조회하는 search 인자입니다. 아직 없는 인덱스는 건너뜁니다."""
+        if not self.partitions.enabled:
+            return {"index": index_name}
+        return {"index": self.partitions.indices(index_name, start_time, end_time), "ignore_unavailable": True}
+
+    def index_template(self, index_name, alias: bool = True) -> Dict:
+        """`<index_name>-*` 인덱스에 index_settings()의 설정과 매핑, 읽기 alias(index_name)를 적용하는 템플릿입니다."""
+        template = self.index_settings()
+        if alias:
+            template["aliases"] = {index_name: {}}
+        return {"index_patterns": [self.partitions.pattern(index_name)], "template": template, "priority": 100}
+
+    @staticmethod
+    def index_settings() -> Dict:
+        return {
             "settings": {
                 "index": {
                     "number_of_shards": 1,
@@ -44,25 +159,9 @@ class SecurityLogAnalyzer:
                 }
             }
         }
-        
-        if not self.client.indices.exists(index=index_name):
-            self.client.indices.create(index=index_name, body=index_settings)
-            
-    def ingest_log(self, index_name, log_data):
-        """보안 로그를 OpenSearch에 저장합니다."""
-        try:
-            response = self.client.index(
-                index=index_name,
-                body=log_data,
-                refresh=True
-            )
-            return response
-        except Exception as e:
-            print(f"로그 저장 중 오류 발생: {str(e)}")
-            return None
-            
-    def search_logs(self, index_name, query, start_time=None, end_time=None):
-        """보안 로그를 검색합니다."""
+
+    @staticmethod
+    def search_query(query, start_time=None, end_time=None) -> Dict:
         search_query = {
             "query": {
                 "bool": {
@@ -70,9 +169,11 @@ class SecurityLogAnalyzer:
                         {"query_string": {"query": query}}
                     ]
                 }
-            }
+            },
+            # 메모리 계층 결과와 이어 붙일 수 있도록 최신순으로 받습니다.
+            "sort": [{"timestamp": {"order": "desc"}}]
         }
-        
+
         if start_time and end_time:
             search_query["query"]["bool"]["filter"] = [
                 {
@@ -84,59 +185,83 @@ class SecurityLogAnalyzer:
                     }
                 }
             ]
-            
-        response = self.client.search(
-            index=index_name,
-            body=search_query
-        )
-        return response['hits']['hits']
-        
-    def detect_anomalies(self, index_name, time_window='1h'):
-        """이상 탐지를 수행합니다."""
+        return search_query
+
+    @staticmethod
+    def anomaly_window() -> Tuple[datetime, datetime]:
+        # 이상 탐지에 사용하는 최근 1시간 윈도우
+        end_time = query_now()
+        return end_time - timedelta(hours=1), end_time
+
+    @classmethod
+    def anomaly_window_query(cls) -> Dict:
         # 시간 윈도우 내의 로그 데이터 수집
-        end_time = datetime.now()
-        start_time = end_time - timedelta(hours=1)
-        
-        query = {
+        return cls.range_query(*cls.anomaly_window())
+
+    @staticmethod
+    def range_query(start_time: datetime, end_time: datetime, inclusive: bool = True) -> Dict:
+        # [start_time, end_time] (inclusive=False이면 end_time 제외) 범위의 로그
+        return {
             "query": {
                 "range": {
                     "timestamp": {
                         "gte": start_time.isoformat(),
-                        "lte": end_time.isoformat()
+                        "lte" if inclusive else "lt": end_time.isoformat()
                     }
                 }
             }
         }
-        
-        response = self.client.search(
-            index=index_name,
-            body=query,
-            size=1000
-        )
-        
-        # 데이터 전처리
-        logs = [hit['_source'] for hit in response['hits']['hits']]
-        if not logs:
-            return []
-            
-        df = pd.DataFrame(logs)
-        
-        # 이상 탐지 모델 학습 및 예측
-        model = IsolationForest(contamination=0.1, random_state=42)
-        features = df[['bytes', 'port']].fillna(0)
-        df['anomaly_score'] = model.fit_predict(features)
-        
-        # 이상 탐지된 로그 반환
-        anomalies = df[df['anomaly_score'] == -1].to_dict('records')
-        return anomalies
-        
-    def get_security_metrics(self, index_name, time_window='1h'):
-        """보안 메트릭을 계산합니다."""
-        end_time = datetime.now()
-        start_time = end_time - timedelta(hours=1)
-        
-        # 기본 집계 쿼리
+
+    @staticmethod
+    def sample_query(start_time: datetime, end_time: datetime, size: int) -> Dict:
+        # 시간 윈도우 내의 로그를 무작위로 표본 추출
+        return {
+            "size": size,
+            "_source": ["bytes", "port"],
+            "query": {
+                "function_score": {
+                    "query": {
+                        "range": {
+                            "timestamp": {
+                                "gte": start_time.isoformat(),
+                                "lte": end_time.isoformat()
+                            }
+                        }
+                    },
+                    "random_score": {"seed": int(end_time.timestamp()), "field": "_seq_no"},
+                    "boost_mode": "replace"
+                }
+            }
+        }
+
+    @staticmethod
+    def since_query(timestamp, size: int, search_after: Optional[List] = None) -> Dict:
+        # timestamp 이후(포함)의 로그를 시간순으로 조회. 같은 timestamp는 _id 순이라 search_after로 이어 읽을 수 있습니다.
         query = {
+            "size": size,
+            "query": {"range": {"timestamp": {"gte": timestamp}}},
+            "sort": [{"timestamp": {"order": "asc"}}, {"_id": {"order": "asc"}}]
+        }
+        if search_after is not None:
+            query["search_after"] = search_after
+        return query
+
+    @staticmethod
+    def parse_time_window(time_window: str) -> timedelta:
+        """'15m', '1h', '7d' 형식의 시간 윈도우를 timedelta로 변환합니다."""
+        units = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days"}
+        value, unit = str(time_window)[:-1], str(time_window)[-1:]
+        if unit not in units or not value.isdigit() or int(value) <= 0:
+            raise ValueError(f"잘못된 시간 윈도우: {time_window}")
+        return timedelta(**{units[unit]: int(value)})
+
+    @classmethod
+    def metrics_query(cls, time_window: str = '1h', end_time: datetime = None) -> Dict:
+        end_time = end_time or query_now()
+        start_time = end_time - cls.parse_time_window(time_window)
+
+        # 기본 집계 쿼리
+        return {
             "size": 0,
             "query": {
                 "range": {
@@ -154,14 +279,365 @@ class SecurityLogAnalyzer:
                 "top_destination_ips": {"terms": {"field": "destination_ip", "size": 10}}
             }
         }
-        
+
+    @staticmethod
+    def minute_metrics_query(start_time: datetime, end_time: datetime, top_size: int) -> Dict:
+        # 분 단위 메트릭 버킷 (메모리 집계기 초기 적재용)
+        return {
+            "size": 0,
+            "query": {
+                "range": {
+                    "timestamp": {
+                        "gte": start_time.isoformat(),
+                        "lt": end_time.isoformat()
+                    }
+                }
+            },
+            "aggs": {
+                "minutes": {
+                    "date_histogram": {"field": "timestamp", "fixed_interval": "1m"},
+                    "aggs": {
+                        "severity": {"terms": {"field": "severity", "size": 20}},
+                        "event_type": {"terms": {"field": "event_type", "size": 50}},
+                        "source_ip": {"terms": {"field": "source_ip", "size": top_size}},
+                        "destination_ip": {"terms": {"field": "destination_ip", "size": top_size}}
+                    }
+                }
+            }
+        }
+
+class SecurityLogAnalyzer(SecurityLogQueries):
+    def __init__(self, **options):
+        self.client = LazyClient(lambda: create_client(**options))
+        self.partitions = IndexPartitions()
+
+    def create_index(self, index_name):
+        """보안 로그를 저장할 인덱스를 생성합니다. 시간 분할을 쓰면 `<index_name>-*` 인덱스 템플릿을 등록합니다."""
+        if not self.partitions.enabled:
+            if not self.client.indices.exists(index=index_name):
+                self.client.indices.create(index=index_name, body=self.index_settings())
+            return
+        # 예전 단일 인덱스가 같은 이름으로 있으면 읽기 alias를 만들 수 없습니다.
+        legacy = (self.client.indices.exists(index=index_name)
+                  and not self.client.indices.exists_alias(name=index_name))
+        if legacy:
+            logger.warning("단일 인덱스 %s가 있어 읽기 alias 없이 템플릿을 등록합니다. "
+                           "_reindex로 %s-* 인덱스로 옮기거나 LOG_INDEX_PERIOD=none을 사용하세요.", index_name, index_name)
+        self.client.indices.put_index_template(name=index_name,
+                                                   body=self.index_template(index_name, alias=not legacy))
+
+    def ingest_log(self, index_name, log_data):
+        """보안 로그를 OpenSearch에 저장합니다."""
+        try:
+            response = self.client.index(
+                index=self.partitions.index_for(index_name, log_data.get('timestamp')),
+                body=log_data,
+                refresh=True
+            )
+            return response
+        except Exception:
+            logger.exception("로그 저장 중 오류 발생")
+            return None
+
+    def search_logs(self, index_name, query, start_time=None, end_time=None):
+        """보안 로그를 검색합니다."""
+        # 시간 범위는 start_time과 end_time이 모두 있을 때만 적용됩니다.
+        target = (self.search_target(index_name, start_time, end_time) if start_time and end_time
+                  else self.search_target(index_name))
+        response = self.client.search(
+            **target,
+            body=self.search_query(query, start_time, end_time)
+        )
+        return response['hits']['hits']
+
+    def get_security_metrics(self, index_name, time_window='1h'):
+        """보안 메트릭을 계산합니다."""
+        end_time = query_now()
         response = self.client.search(
-            index=index_name,
-            body=query
+            **self.search_target(index_name, end_time - self.parse_time_window(time_window), end_time),
+            body=self.metrics_query(time_window, end_time)
         )
-        
+
         return response['aggregations']
 
+class AsyncSecurityLogAnalyzer(SecurityLogQueries):
+    """이벤트 루프를 막지 않는 SecurityLogAnalyzer의 비동기 버전입니다.
+
+    커넥션 풀 크기와 타임아웃은 OPENSEARCH_POOL_SIZE, OPENSEARCH_TIMEOUT,
+    OPENSEARCH_MAX_RETRIES 환경변수 또는 생성자 인자로 설정합니다.
+    """
+
+    def __init__(self, **options):
+        self.client = LazyClient(lambda: create_client(asynchronous=True, **options), asynchronous=True)
+        self.partitions = IndexPartitions()
+
+    async def close(self):
+        """커넥션 풀을 닫습니다."""
+        await self.client.close()
+
+    async def create_index(self, index_name):
+        """보안 로그를 저장할 인덱스를 생성합니다. 시간 분할을 쓰면 `<index_name>-*` 인덱스 템플릿을 등록합니다."""
+        if not self.partitions.enabled:
+            if not await self.client.indices.exists(index=index_name):
+                await self.client.indices.create(index=index_name, body=self.index_settings())
+            return
+        # 예전 단일 인덱스가 같은 이름으로 있으면 읽기 alias를 만들 수 없습니다.
+        legacy = (await self.client.indices.exists(index=index_name)
+                  and not await self.client.indices.exists_alias(name=index_name))
+        if legacy:
+            logger.warning("단일 인덱스 %s가 있어 읽기 alias 없이 템플릿을 등록합니다. "
+                           "_reindex로 %s-* 인덱스로 옮기거나 LOG_INDEX_PERIOD=none을 사용하세요.", index_name, index_name)
+        await self.client.indices.put_index_template(name=index_name,
+                                                   body=self.index_template(index_name, alias=not legacy))
+
+    async def ingest_log(self, index_name, log_data):
+        """보안 로그를 OpenSearch에 저장합니다."""
+        try:
+            response = await self.client.index(
+                index=self.partitions.index_for(index_name, log_data.get('timestamp')),
+                body=log_data,
+                refresh=True
+            )
+            return response
+        except Exception:
+            logger.exception("로그 저장 중 오류 발생")
+            return None
+
+    async def search_logs(self, index_name, query, start_time=None, end_time=None):
+        """보안 로그를 검색합니다."""
+        # 시간 범위는 start_time과 end_time이 모두 있을 때만 적용됩니다.
+        target = (self.search_target(index_name, start_time, end_time) if start_time and end_time
+                  else self.search_target(index_name))
+        response = await self.client.search(
+            **target,
+            body=self.search_query(query, start_time, end_time)
+        )
+        return response['hits']['hits']
+
+    async def get_window_logs(self, index_name, size=1000):
+        """최근 1시간의 로그를 반환합니다."""
+        start_time, end_time = self.anomaly_window()
+        response = await self.client.search(
+            **self.search_target(index_name, start_time, end_time),
+            body=self.range_query(start_time, end_time),
+            size=size
+        )
+        return [hit['_source'] for hit in response['hits']['hits']]
+
+    async def get_logs_between(self, index_name, start_time, end_time, size=1000):
+        """[start_time, end_time) 범위의 로그를 반환합니다. 최근 데이터 계층과 나눠 조회할 때 씁니다."""
+        response = await self.client.search(
+            **self.search_target(index_name, start_time, end_time),
+            body=self.range_query(start_time, end_time, inclusive=False),
+            size=size
+        )
+        return [hit['_source'] for hit in response['hits']['hits']]
+
+    async def logs_since(self, index_name, timestamp, size=1000, search_after=None):
+        """timestamp 이후(포함)에 저장된 로그를 시간순으로 반환합니다.
+
+        다음 페이지는 마지막 hit의 `sort` 값을 search_after로 넘겨 읽습니다.
+        """
+        response = await self.client.search(
+            **self.search_target(index_name, timestamp),
+            body=self.since_query(timestamp, size, search_after)
+        )
+        return response['hits']['hits']
+
+    async def sample_logs(self, index_name, start_time, end_time, size):
+        """모델 학습용으로 시간 윈도우 내의 로그를 무작위로 추출합니다."""
+        response = await self.client.search(
+            **self.search_target(index_name, start_time, end_time),
+            body=self.sample_query(start_time, end_time, size)
+        )
+        return [hit['_source'] for hit in response['hits']['hits']]
+
+    async def get_minute_metrics(self, index_name, start_time, end_time, top_size=100):
+        """시간 범위의 로그를 분 단위로 집계한 버킷 목록을 반환합니다."""
+        response = await self.client.search(
+            **self.search_target(index_name, start_time, end_time),
+            body=self.minute_metrics_query(start_time, end_time, top_size)
+        )
+        return response['aggregations']['minutes']['buckets']
+
+    async def get_security_metrics(self, index_name, time_window='1h'):
+        """보안 메트릭을 계산합니다."""
+        end_time = query_now()
+        response = await self.client.search(
+            **self.search_target(index_name, end_time - self.parse_time_window(time_window), end_time),
+            body=self.metrics_query(time_window, end_time)
+        )
+
+        return response['aggregations']
+
+class BulkLogWriter:
+    """여러 요청의 로그를 버퍼에 모아 bulk API로 한 번에 저장합니다.
+
+    버퍼가 `max_docs`에 도달하거나 `flush_interval`초가 지나면 백그라운드
+    스레드가 flush하며, 문서마다 refresh를 강제하지 않습니다.
+    """
+
+    def __init__(self, client, index_name: str, max_docs: int = None,
+                 flush_interval: float = None, chunk_size: int = None, max_retries: int = 3,
+                 partitions: IndexPartitions = None):
+        self.client = client
+        self.index_name = index_name
+        self.partitions = partitions or IndexPartitions()
+        self.max_docs = max_docs or int(os.getenv('BULK_MAX_DOCS', '1000'))
+        self.flush_interval = flush_interval or float(os.getenv('BULK_FLUSH_INTERVAL', '0.2'))
+        self.chunk_size = chunk_size or int(os.getenv('BULK_CHUNK_SIZE', '500'))
+        self.max_retries = max_retries
+
+        self._buffer = []
+        self._first_buffered_at = None
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+        self.docs_submitted = 0
+        self.docs_indexed = 0
+        self.docs_failed = 0
+        self.batches = 0
+        self.bulk_seconds = 0.0
+
+    def submit(self, docs) -> Future:
+        """문서 목록을 버퍼에 넣고, 문서별 결과 리스트로 완료되는 Future를 반환합니다."""
+        ticket = _BulkTicket(len(docs))
+        if not docs:
+            ticket.future.set_result([])
+            return ticket.future
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("BulkLogWriter가 이미 종료되었습니다.")
+            self._ensure_thread()
+            if not self._buffer:
+                self._first_buffered_at = time.monotonic()
+            for position, doc in enumerate(docs):
+                self._buffer.append((doc, ticket, position))
+            self.docs_submitted += len(docs)
+            self._cond.notify()
+        return ticket.future
+
+    def flush(self):
+        """버퍼에 남은 문서를 즉시 저장합니다."""
+        with self._cond:
+            batch = self._take_buffer()
+        if batch:
+            self._write(batch)
+
+    def close(self):
+        """남은 문서를 저장하고 백그라운드 스레드를 종료합니다."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def stats(self) -> Dict:
+        """누적 처리량 카운터를 반환합니다."""
+        with self._cond:
+            buffered = len(self._buffer)
+        return {
+            "submitted": self.docs_submitted,
+            "indexed": self.docs_indexed,
+            "failed": self.docs_failed,
+            "buffered": buffered,
+            "batches": self.batches,
+            "docs_per_sec": round(self.docs_indexed / self.bulk_seconds, 1) if self.bulk_seconds else 0.0
+        }
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="bulk-log-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._should_flush():
+                    timeout = None
+                    if self._buffer:
+                        timeout = max(0.0, self._first_buffered_at + self.flush_interval - time.monotonic())
+                    self._cond.wait(timeout)
+                if self._closed:
+                    return
+                batch = self._take_buffer()
+            self._write(batch)
+
+    def _should_flush(self) -> bool:
+        if not self._buffer:
+            return False
+        if len(self._buffer) >= self.max_docs:
+            return True
+        return time.monotonic() - self._first_buffered_at >= self.flush_interval
+
+    def _take_buffer(self):
+        batch, self._buffer = self._buffer, []
+        self._first_buffered_at = None
+        return batch
+
+    def _write(self, batch):
+        from opensearchpy import helpers
+        actions = ({"_index": self.partitions.index_for(self.index_name, doc.get("timestamp")), "_source": doc}
+                   for doc, _, _ in batch)
+        started = time.perf_counter()
+        done = 0
+        try:
+            for ok, info in helpers.streaming_bulk(
+                    self.client,
+                    actions,
+                    chunk_size=self.chunk_size,
+                    max_retries=self.max_retries,
+                    raise_on_error=False,
+                    raise_on_exception=False):
+                _, ticket, position = batch[done]
+                ticket.set(position, _bulk_item_result(ok, info))
+                done += 1
+        except Exception as e:
+            logger.exception("bulk 저장 중 오류 발생")
+            for _, ticket, position in batch[done:]:
+                ticket.set(position, {"status": "error", "error": str(e)})
+
+        results = [ticket.results[position] for _, ticket, position in batch]
+        indexed = sum(1 for result in results if result["status"] == "success")
+        with self._cond:
+            self.batches += 1
+            self.bulk_seconds += time.perf_counter() - started
+            self.docs_indexed += indexed
+            self.docs_failed += len(batch) - indexed
+
+
+class _BulkTicket:
+    """한 번의 submit 호출에 속한 문서들의 결과를 모읍니다."""
+
+    def __init__(self, size: int):
+        self.future = Future()
+        self.results = [None] * size
+        self._remaining = size
+        self._lock = threading.Lock()
+
+    def set(self, position: int, result: Dict):
+        with self._lock:
+            self.results[position] = result
+            self._remaining -= 1
+            finished = self._remaining == 0
+        if finished:
+            self.future.set_result(self.results)
+
+
+def _bulk_item_result(ok: bool, info: Dict) -> Dict:
+    """streaming_bulk 결과 항목을 API 응답 형식으로 변환합니다."""
+    _, item = info.popitem()
+    if ok:
+        return {"status": "success", "id": item.get('_id')}
+    error = item.get('error')
+    if isinstance(error, dict):
+        error = f"{error.get('type')}: {error.get('reason')}"
+    return {"status": "error", "error": str(error), "code": item.get('status')}
+
+
 if __name__ == "__main__":
     analyzer = SecurityLogAnalyzer()
     analyzer.create_index("security-logs") 
\ No newline at end of file
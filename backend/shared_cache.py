@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+import orjson
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, version TEXT NOT NULL, "
+    "expires REAL NOT NULL, size INTEGER NOT NULL, value BLOB NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires)",
+    "CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)"
+)
+
+
+def shared_cache_enabled() -> bool:
+    """SHARED_CACHE=auto(기본)이면 워커가 여러 개(WEB_CONCURRENCY > 1)일 때만 켭니다."""
+    setting = os.getenv('SHARED_CACHE', 'auto').lower()
+    if setting == 'auto':
+        return int(os.getenv('WEB_CONCURRENCY', '1')) > 1
+    return setting == 'true'
+
+
+class SharedCache:
+    """같은 호스트의 워커 프로세스가 함께 쓰는 SQLite(WAL) 결과 캐시입니다.
+
+    항목은 (key, version)으로 찾으므로 데이터 버전이 바뀌면 예전 값은 읽히지 않고 덮어써집니다.
+    TTL이 지난 항목과 `max_bytes`를 넘는 항목은 만료가 빠른 것부터 지웁니다. 없는 항목을
+    여러 워커가 동시에 요청하면 lease를 얻은 워커 하나만 계산하고 나머지는 저장되기를 기다립니다.
+    SQLite 오류는 캐시 미스로 처리하므로 캐시 문제로 요청이 실패하지 않습니다.
+    """
+
+    def __init__(self, path: str = None, max_bytes: int = None, lease_seconds: float = None,
+                 poll_interval: float = None):
+        self.path = path or os.getenv('SHARED_CACHE_PATH',
+                                      os.path.join(tempfile.gettempdir(), 'aidetector-cache.sqlite'))
+        self.max_bytes = max_bytes or int(os.getenv('SHARED_CACHE_MAX_MB', '1024')) * 1024 * 1024
+        self.lease_seconds = lease_seconds or float(os.getenv('SHARED_CACHE_LEASE_SECONDS', '60'))
+        self.poll_interval = poll_interval or float(os.getenv('SHARED_CACHE_POLL_INTERVAL', '0.05'))
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._local = threading.local()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.errors = 0
+
+    def get(self, key: str, version: str = '') -> Optional[bytes]:
+        row = self._execute("SELECT value FROM entries WHERE key = ? AND version = ? AND expires > ?",
+                            (key, version, time.time())).fetchone()
+        return row[0] if row else None
+
+    def get_many(self, keys: List[str], version: str = '') -> Dict[str, bytes]:
+        found = {}
+        now = time.time()
+        # SQLite의 변수 개수 제한 안에서 나눠 조회합니다.
+        for offset in range(0, len(keys), 500):
+            chunk = keys[offset:offset + 500]
+            rows = self._execute(
+                f"SELECT key, value FROM entries WHERE key IN ({','.join('?' * len(chunk))}) "
+                "AND version = ? AND expires > ?", (*chunk, version, now)).fetchall()
+            found.update(rows)
+        return found
+
+    def set(self, key: str, value: bytes, ttl: float, version: str = ''):
+        self.set_many([(key, value)], ttl, version)
+
+    def set_many(self, items: Iterable[Tuple[str, bytes]], ttl: float, version: str = ''):
+        expires = time.time() + ttl
+        rows = [(key, version, expires, len(value), value) for key, value in items]
+        connection = self._connection()
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", rows)
+        self._writes += len(rows)
+        if self._writes >= 100 or sum(row[3] for row in rows) > self.max_bytes // 100:
+            self._writes = 0
+            self.evict()
+
+    def evict(self):
+        """만료된 항목을 지우고, 전체 크기가 max_bytes를 넘으면 만료가 빠른 항목부터 지웁니다."""
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM entries WHERE expires <= ?", (time.time(),))
+            connection.execute("DELETE FROM leases WHERE expires <= ?", (time.time(),))
+            total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total > self.max_bytes:
+                # 누적 크기가 max_bytes를 넘기 시작하는 항목까지(만료 역순으로) 남깁니다.
+                connection.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM (SELECT key, SUM(size) OVER "
+                    "(ORDER BY expires DESC) AS running FROM entries) WHERE running > ?)", (self.max_bytes,))
+
+    def acquire(self, key: str) -> bool:
+        """key 계산 lease를 얻으면 True입니다. 만료된 lease는 다른 워커가 가져갈 수 있습니다."""
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM leases WHERE key = ? AND expires <= ?", (key, time.time()))
+            cursor = connection.execute("INSERT OR IGNORE INTO leases VALUES (?, ?, ?)",
+                                        (key, self.owner, time.time() + self.lease_seconds))
+        return cursor.rowcount == 1
+
+    def leased(self, key: str) -> bool:
+        return self._execute("SELECT 1 FROM leases WHERE key = ? AND expires > ?",
+                             (key, time.time())).fetchone() is not None
+
+    def release(self, key: str):
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, self.owner))
+
+    async def read_many(self, keys: List[str], version: str = '') -> Dict[str, bytes]:
+        """get_many를 스레드 풀에서 실행합니다. 오류가 나면 빈 dict(미스)를 반환합니다."""
+        found = await asyncio.get_running_loop().run_in_executor(None, self._safe, self.get_many, keys, version)
+        found = found or {}
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    async def write_many(self, items: List[Tuple[str, bytes]], ttl: float, version: str = ''):
+        """set_many를 스레드 풀에서 실행합니다. 오류는 기록만 하고 무시합니다."""
+        if items:
+            await asyncio.get_running_loop().run_in_executor(None, self._safe, self.set_many, items, ttl, version)
+
+    async def get_or_compute(self, key: str, version: str, compute: Callable[[], Awaitable],
+                             ttl: float, encode: Callable = orjson.dumps, decode: Callable = orjson.loads):
+        """공유 캐시의 값을 반환하고, 없으면 워커 하나만 compute()로 계산해 저장합니다.
+
+        encode/decode는 스레드 풀에서 실행합니다. compute()가 None을 반환하면 저장하지 않습니다.
+        """
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, self._safe, self.get, key, version)
+        if data is not None:
+            self.hits += 1
+            return await loop.run_in_executor(None, decode, data)
+        self.misses += 1
+
+        lease = f"{key}@{version}"
+        acquired = await loop.run_in_executor(None, self._safe, self.acquire, lease)
+        if not acquired:
+            # 다른 워커가 계산 중이면 저장될 때까지 기다리고, lease가 사라지면 직접 계산합니다.
+            deadline = time.monotonic() + self.lease_seconds
+            while time.monotonic() < deadline:
+                await asyncio.sleep(self.poll_interval)
+                data = await loop.run_in_executor(None, self._safe, self.get, key, version)
+                if data is not None:
+                    self.waits += 1
+                    return await loop.run_in_executor(None, decode, data)
+                if not await loop.run_in_executor(None, self._safe, self.leased, lease):
+                    break
+
+        try:
+            value = await compute()
+            if value is not None:
+                data = await loop.run_in_executor(None, encode, value)
+                await loop.run_in_executor(None, self._safe, self.set, key, data, ttl, version)
+            return value
+        finally:
+            if acquired:
+                await loop.run_in_executor(None, self._safe, self.release, lease)
+
+    def stats(self) -> Dict:
+        try:
+            entries, size = self._execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        except sqlite3.Error:
+            entries, size = None, None
+        return {
+            "path": self.path,
+            "entries": entries,
+            "bytes": size,
+            "capacityBytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "waits": self.waits,
+            "errors": self.errors
+        }
+
+    def _safe(self, method, *args):
+        try:
+            return method(*args)
+        except sqlite3.Error:
+            self.errors += 1
+            logger.exception("공유 캐시 오류")
+            return None
+
+    def _execute(self, sql: str, parameters: Tuple = ()):
+        return self._connection().execute(sql, parameters)
+
+    def _connection(self) -> sqlite3.Connection:
+        # SQLite 연결은 스레드 사이에 공유하지 않으므로 스레드마다 하나씩 엽니다.
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=float(os.getenv('SHARED_CACHE_BUSY_TIMEOUT', '5')))
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            with connection:
+                for statement in _SCHEMA:
+                    connection.execute(statement)
+            self._local.connection = connection
+        return connection
@@ -0,0 +1,783 @@
+import fnmatch
+import ipaddress
+import os
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import yaml
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# span 컬럼으로 평가할 수 있는 Sigma 필드 (Sigma 필드 -> SpanStore 컬럼)
+SPAN_FIELDS = {
+    "EventID": "event_id",
+    "Image": "image",
+    "CommandLine": "command_line",
+    "User": "user",
+    "ProcessId": "pid",
+    "ParentProcessId": "ppid",
+    "ParentImage": "parent_image",
+    "ParentCommandLine": "parent_command_line",
+    "TargetFilename": "target_filename"
+}
+
+# windows 규칙의 logsource.category에 해당하는 Sysmon 이벤트 ID
+CATEGORY_EVENT_IDS = {
+    "process_creation": "1",
+    "network_connection": "3",
+    "process_termination": "5",
+    "driver_load": "6",
+    "image_load": "7",
+    "create_remote_thread": "8",
+    "process_access": "10",
+    "file_event": "11",
+    "registry_add": "12",
+    "registry_set": "13",
+    "registry_rename": "14",
+    "dns_query": "22",
+    "file_delete": "23"
+}
+
+# 규칙을 평가하지 않는 Sigma status
+INACTIVE_STATUSES = {"deprecated", "unsupported"}
+
+SEARCH_MODIFIERS = {"contains", "startswith", "endswith"}
+COMPARE_MODIFIERS = {"lt": np.less, "lte": np.less_equal, "gt": np.greater, "gte": np.greater_equal}
+
+
+class SigmaRuleError(ValueError):
+    """지원하지 않거나 잘못된 Sigma 규칙입니다."""
+
+
+class _Automaton:
+    """pyahocorasick이 없을 때 쓰는 Aho-Corasick 오토마톤입니다. add_word/make_automaton/iter만 같습니다."""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List] = [[]]
+
+    def add_word(self, word: str, value):
+        node = 0
+        for char in word:
+            child = self._goto[node].get(char)
+            if child is None:
+                child = len(self._goto)
+                self._goto[node][char] = child
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = child
+        self._out[node] = [value]
+
+    def make_automaton(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def iter(self, text: str):
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for end, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for value in out[node]:
+                yield end, value
+
+
+def new_automaton():
+    return ahocorasick.Automaton() if ahocorasick is not None else _Automaton()
+
+
+class _FieldMatcher:
+    """한 필드를 참조하는 모든 atom을 값 하나에 대해 한 번에 검사합니다.
+
+    contains/startswith/endswith 값은 Aho-Corasick 오토마톤 하나로 찾고, 일치 값은 dict로,
+    정규식은 미리 컴파일해 둡니다. 같은 값은 반복해서 나오므로 결과를 크기 제한이 있는 dict에 기억합니다.
+    """
+
+    def __init__(self, field: str, cache_size: int):
+        self.field = field
+        self.cache_size = cache_size
+        self.exact: Dict[str, List[int]] = {}
+        self.patterns: Dict[str, List[Tuple[int, str]]] = {}
+        self.regexes: List[Tuple[int, re.Pattern]] = []
+        self.networks: List[Tuple[int, object]] = []
+        self.comparisons: List[Tuple[int, object, float]] = []
+        self.null_atoms: List[int] = []
+        self.atoms: List[int] = []
+        self._automaton = None
+        self._memo: Dict = {}
+
+    def add(self, atom: int, kind: str, value):
+        self.atoms.append(atom)
+        if kind == "exact":
+            self.exact.setdefault(value, []).append(atom)
+        elif kind in SEARCH_MODIFIERS:
+            self.patterns.setdefault(value, []).append((atom, kind))
+        elif kind == "re":
+            self.regexes.append((atom, value))
+        elif kind == "cidr":
+            self.networks.append((atom, value))
+        elif kind in COMPARE_MODIFIERS:
+            self.comparisons.append((atom, COMPARE_MODIFIERS[kind], value))
+        elif kind == "null":
+            self.null_atoms.append(atom)
+
+    def build(self):
+        if self.patterns:
+            self._automaton = new_automaton()
+            for pattern, entries in self.patterns.items():
+                self._automaton.add_word(pattern, (len(pattern), tuple(entries)))
+            self._automaton.make_automaton()
+
+    def match(self, value) -> Tuple[int, ...]:
+        """value와 일치하는 atom 번호를 반환합니다. 값이 없거나 빈 문자열이면 null atom만 일치합니다."""
+        try:
+            return self._memo[value]
+        except KeyError:
+            pass
+        except TypeError:  # dict/list처럼 해시할 수 없는 값
+            return self._match(value)
+        if len(self._memo) >= self.cache_size:
+            self._memo.clear()
+        atoms = self._memo[value] = self._match(value)
+        return atoms
+
+    def _match(self, value) -> Tuple[int, ...]:
+        if value is None or value == '':
+            return tuple(self.null_atoms)
+        raw = str(value)
+        text = raw.lower()
+        matched = list(self.exact.get(text, ()))
+        if self._automaton is not None:
+            last = len(text) - 1
+            for end, (length, entries) in self._automaton.iter(text):
+                for atom, kind in entries:
+                    if (kind == "contains" or (kind == "startswith" and end + 1 == length)
+                            or (kind == "endswith" and end == last)):
+                        matched.append(atom)
+        for atom, pattern in self.regexes:
+            if pattern.search(raw):
+                matched.append(atom)
+        if self.networks:
+            try:
+                address = ipaddress.ip_address(raw)
+            except ValueError:
+                address = None
+            for atom, network in self.networks:
+                if address is not None and address.version == network.version and address in network:
+                    matched.append(atom)
+        if self.comparisons:
+            try:
+                number = float(raw)
+            except ValueError:
+                number = None
+            for atom, compare, bound in self.comparisons:
+                if number is not None and compare(number, bound):
+                    matched.append(atom)
+        return tuple(sorted(set(matched)))
+
+
+class SigmaRule:
+    """컴파일된 Sigma 규칙입니다. condition은 atom 번호를 잎으로 하는 and/or/not 트리입니다."""
+
+    def __init__(self, document: Dict, path: str = ''):
+        self.document = document
+        self.path = path
+        self.id = str(document.get('id') or Path(path).stem)
+        self.title = document.get('title', self.id)
+        self.description = document.get('description', '')
+        self.level = str(document.get('level', 'medium')).lower()
+        self.status = str(document.get('status', 'experimental')).lower()
+        self.tags = [str(tag) for tag in document.get('tags') or []]
+        self.logsource = document.get('logsource') or {}
+        self.condition = None
+        self.atoms: List[int] = []
+        self.always_candidate = False
+
+    @property
+    def active(self) -> bool:
+        return self.status not in INACTIVE_STATUSES
+
+    @property
+    def targets(self) -> Tuple[str, ...]:
+        """규칙을 적용할 데이터입니다. windows/sysmon 규칙은 trace, 나머지는 보안 로그입니다."""
+        if not self.logsource:
+            return ("trace", "log")
+        if self.logsource.get('product') == 'windows' or self.logsource.get('service') == 'sysmon':
+            return ("trace",)
+        return ("log",)
+
+    @property
+    def mitre(self) -> Dict:
+        techniques = [tag[len('attack.'):].upper() for tag in self.tags
+                      if re.fullmatch(r'attack\.t\d{4}(\.\d{3})?', tag)]
+        tactics = [tag[len('attack.'):] for tag in self.tags
+                   if tag.startswith('attack.') and not re.fullmatch(r'attack\.(t\d{4}(\.\d{3})?|g\d{4}|s\d{4})', tag)]
+        return {"techniques": techniques, "tactics": tactics}
+
+
+class RuleStats:
+    __slots__ = ("hits", "evaluated", "batches", "cost_seconds", "last_triggered")
+
+    def __init__(self):
+        self.hits = 0
+        self.evaluated = 0
+        self.batches = 0
+        self.cost_seconds = 0.0
+        self.last_triggered: Optional[float] = None
+
+
+class EventBatch:
+    """평가할 이벤트 묶음입니다. 필드마다 (값 코드 배열, 고유 값 목록)으로 보관합니다.
+
+    코드 -1은 값 목록의 마지막 항목(None)을 가리킵니다.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.columns: Dict[str, Tuple[np.ndarray, List]] = {}
+
+    def add(self, field: str, codes: np.ndarray, values: List):
+        self.columns[field] = (codes, values)
+
+    @classmethod
+    def from_records(cls, records: List[Dict], fields: Iterable[str]) -> "EventBatch":
+        batch = cls(len(records))
+        for field in fields:
+            index = {}
+            codes = np.fromiter((index.setdefault(_hashable(record.get(field)), len(index)) for record in records),
+                                dtype=np.int64, count=len(records))
+            batch.add(field, codes, list(index) + [None])
+        return batch
+
+    @classmethod
+    def from_store(cls, store, fields: Iterable[str]) -> "EventBatch":
+        batch = cls(len(store))
+        for field in fields:
+            column = getattr(store, SPAN_FIELDS[field])
+            if isinstance(column, np.ndarray):
+                index = {}
+                codes = np.fromiter((index.setdefault(value, len(index)) for value in column.tolist()),
+                                    dtype=np.int64, count=len(column))
+                batch.add(field, codes, list(index) + [None])
+            else:
+                batch.add(field, column.codes, list(column.categories) + [None])
+        return batch
+
+
+def _hashable(value):
+    if isinstance(value, (dict, list)):
+        return str(value)
+    return value
+
+
+class _CompiledRules:
+    """불러온 규칙 전체를 필드별 matcher와 atom -> 규칙 역색인으로 컴파일한 결과입니다."""
+
+    def __init__(self, rules: List[SigmaRule], atom_count: int, matchers: Dict[str, _FieldMatcher]):
+        self.rules = rules
+        self.atom_count = atom_count
+        self.matchers = matchers
+        for matcher in matchers.values():
+            matcher.build()
+        self.atom_rules: Dict[int, List[int]] = {}
+        for position, rule in enumerate(rules):
+            for atom in rule.atoms:
+                self.atom_rules.setdefault(atom, []).append(position)
+
+        # target별로 규칙이 참조하는 필드. 배치에는 이 필드만 만듭니다.
+        atom_fields = {atom: field for field, matcher in matchers.items() for atom in matcher.atoms}
+        self.target_fields: Dict[str, List[str]] = {}
+        for target in ("trace", "log"):
+            self.target_fields[target] = sorted({atom_fields[atom] for rule in rules
+                                                 if rule.active and target in rule.targets for atom in rule.atoms})
+
+
+class RuleEngine:
+    """Sigma YAML 규칙을 컴파일해 span과 보안 로그 배치에 적용합니다.
+
+    필드별로 고유 값마다 한 번만 atom을 검사하고, 일치한 atom이 있는 규칙(또는 not 조건처럼
+    아무 atom 없이도 참이 될 수 있는 규칙)만 마스크 연산으로 condition을 평가합니다.
+    규칙별로 탐지 수, 평가한 이벤트 수, 평가 시간을 누적합니다.
+    """
+
+    def __init__(self, rules_dir: str = None, cache_size: int = None):
+        self.rules_dir = rules_dir or os.getenv('SIGMA_RULES_DIR', str(Path(__file__).parent / 'rules'))
+        self.cache_size = cache_size or int(os.getenv('SIGMA_MATCH_CACHE_SIZE', '65536'))
+        self.version = 0
+        self.load_errors: List[Dict] = []
+        self.batches = 0
+        self.events = 0
+        self.match_seconds = 0.0
+        self._compiled = _CompiledRules([], 0, {})
+        self._stats: Dict[str, RuleStats] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def rules(self) -> List[SigmaRule]:
+        return self._compiled.rules
+
+    @property
+    def matches_key(self) -> str:
+        """snapshot.derived에 trace 탐지 결과를 저장할 이름입니다. 규칙을 다시 읽으면 바뀝니다."""
+        return f"rule_matches:{self.version}"
+
+    def rule(self, rule_id: str) -> Optional[SigmaRule]:
+        return next((rule for rule in self.rules if rule.id == rule_id), None)
+
+    def load(self) -> int:
+        """rules_dir의 *.yml/*.yaml을 다시 읽어 컴파일합니다. 잘못된 규칙은 load_errors에 기록하고 건너뜁니다."""
+        documents = []
+        errors = []
+        directory = Path(self.rules_dir)
+        paths = sorted(list(directory.rglob('*.yml')) + list(directory.rglob('*.yaml'))) if directory.is_dir() else []
+        for path in paths:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    for document in yaml.safe_load_all(f):
+                        if isinstance(document, dict) and 'detection' in document:
+                            documents.append((document, str(path)))
+            except (OSError, yaml.YAMLError) as e:
+                errors.append({"path": str(path), "error": str(e)})
+        loaded = self.compile(documents)
+        self.load_errors = errors + self.load_errors
+        return loaded
+
+    def compile(self, documents: List[Tuple[Dict, str]]) -> int:
+        """(Sigma 문서, 경로) 목록을 컴파일해 현재 규칙을 교체합니다."""
+        compiler = _Compiler(self.cache_size)
+        rules = []
+        errors = []
+        seen = set()
+        for document, path in documents:
+            try:
+                rule = compiler.compile(document, path)
+                if rule.id in seen:
+                    raise SigmaRuleError(f"중복된 규칙 id: {rule.id}")
+            except (SigmaRuleError, TypeError, AttributeError, re.error) as e:
+                errors.append({"path": path, "title": document.get('title'), "error": str(e)})
+                continue
+            seen.add(rule.id)
+            rules.append(rule)
+
+        compiled = _CompiledRules(rules, compiler.atom_count, compiler.matchers)
+        with self._lock:
+            self._compiled = compiled
+            for rule in rules:
+                self._stats.setdefault(rule.id, RuleStats())
+            self.load_errors = errors
+            self.version += 1
+        return len(rules)
+
+    def evaluate(self, batch: EventBatch, target: str,
+                 counted: Optional[np.ndarray] = None) -> List[Tuple[SigmaRule, np.ndarray]]:
+        """batch에 target 규칙을 적용해 (규칙, 일치한 행) 목록을 반환합니다.
+
+        counted가 주어지면 그 마스크의 행만 탐지 수에 더합니다 (이미 센 행을 다시 평가할 때).
+        """
+        compiled = self._compiled
+        started = time.perf_counter()
+
+        # 1단계: 필드별 고유 값마다 atom을 검사해 atom별 행 마스크를 만듭니다.
+        masks: Dict[int, np.ndarray] = {}
+        for field, matcher in compiled.matchers.items():
+            column = batch.columns.get(field)
+            if column is None:
+                if matcher.null_atoms and batch.size:
+                    for atom in matcher.null_atoms:
+                        masks[atom] = np.ones(batch.size, dtype=bool)
+                continue
+            codes, values = column
+            tables: Dict[int, np.ndarray] = {}
+            for code, value in enumerate(values):
+                for atom in matcher.match(value):
+                    table = tables.get(atom)
+                    if table is None:
+                        table = tables[atom] = np.zeros(len(values), dtype=bool)
+                    table[code] = True
+            for atom, table in tables.items():
+                mask = table[codes]
+                if mask.any():
+                    masks[atom] = mask
+
+        # 2단계: 일치한 atom이 있는 규칙만 condition을 평가합니다.
+        candidates = set()
+        for atom in masks:
+            candidates.update(compiled.atom_rules.get(atom, ()))
+        candidates.update(position for position, rule in enumerate(compiled.rules) if rule.always_candidate)
+        match_seconds = time.perf_counter() - started
+
+        results = []
+        costs = []
+        for position in sorted(candidates):
+            rule = compiled.rules[position]
+            if not rule.active or target not in rule.targets:
+                continue
+            rule_started = time.perf_counter()
+            mask = _evaluate(rule.condition, masks, batch.size)
+            rows = np.flatnonzero(mask) if mask is not None else np.array([], dtype=np.int64)
+            costs.append((rule, time.perf_counter() - rule_started, rows))
+            if len(rows):
+                results.append((rule, rows))
+
+        now = time.time()
+        with self._lock:
+            self.batches += 1
+            self.events += batch.size
+            self.match_seconds += match_seconds
+            for rule, cost, rows in costs:
+                stats = self._stats.setdefault(rule.id, RuleStats())
+                stats.batches += 1
+                stats.evaluated += batch.size
+                stats.cost_seconds += cost
+                hits = len(rows) if counted is None else int(np.count_nonzero(counted[rows]))
+                if hits:
+                    stats.hits += hits
+                    stats.last_triggered = now
+        return results
+
+    def evaluate_records(self, records: List[Dict], target: str = "log") -> List[Tuple[SigmaRule, np.ndarray]]:
+        """dict 목록(보안 로그 등)에 규칙을 적용합니다."""
+        if not records:
+            return []
+        batch = EventBatch.from_records(records, self._compiled.target_fields[target])
+        return self.evaluate(batch, target)
+
+    def evaluate_store(self, store, counted: Optional[np.ndarray] = None) -> Dict:
+        """SpanStore 전체에 trace 규칙을 적용해 startTime 순으로 정렬된 행과 규칙 위치를 반환합니다."""
+        fields = [field for field in self._compiled.target_fields["trace"] if field in SPAN_FIELDS]
+        batch = EventBatch.from_store(store, fields)
+        results = self.evaluate(batch, "trace", counted)
+        if not results:
+            return {"rows": np.array([], dtype=np.int64), "rules": [], "rule_index": np.array([], dtype=np.int64)}
+        rules = [rule for rule, _ in results]
+        rows = np.concatenate([rows for _, rows in results])
+        rule_index = np.concatenate([np.full(len(rows), position) for position, (_, rows) in enumerate(results)])
+        order = np.lexsort((rule_index, rows, store.start_time[rows]))
+        return {"rows": rows[order], "rules": rules, "rule_index": rule_index[order]}
+
+    def stats(self, rule_id: str) -> RuleStats:
+        return self._stats.get(rule_id) or RuleStats()
+
+    def describe(self, rule: SigmaRule) -> Dict:
+        """규칙 페이지에서 쓰는 형식으로 규칙 정보와 카운터를 반환합니다."""
+        stats = self.stats(rule.id)
+        mitre = rule.mitre
+        return {
+            "id": rule.id,
+            "name": rule.title,
+            "description": rule.description,
+            "category": rule.logsource.get('category') or rule.logsource.get('service') or rule.logsource.get('product', ''),
+            "severity": rule.level.upper(),
+            "status": "ACTIVE" if rule.active else "DISABLED",
+            "sigmaStatus": rule.status,
+            "targets": list(rule.targets),
+            "mitreId": mitre["techniques"][0] if mitre["techniques"] else None,
+            "technique": mitre["tactics"][0] if mitre["tactics"] else None,
+            "tags": rule.tags,
+            "detections": stats.hits,
+            "evaluated": stats.evaluated,
+            "costMs": round(stats.cost_seconds * 1000, 3),
+            "avgCostUs": round(stats.cost_seconds * 1_000_000 / stats.batches, 1) if stats.batches else 0.0,
+            "lastTriggered": datetime.fromtimestamp(stats.last_triggered).isoformat() if stats.last_triggered else None,
+            "path": rule.path
+        }
+
+    def summary(self) -> Dict:
+        rules = self.rules
+        active = sum(1 for rule in rules if rule.active)
+        return {
+            "totalRules": len(rules),
+            "activeRules": active,
+            "disabledRules": len(rules) - active,
+            "detections": sum(self.stats(rule.id).hits for rule in rules),
+            "batches": self.batches,
+            "events": self.events,
+            "matchMs": round(self.match_seconds * 1000, 3),
+            "version": self.version,
+            "automaton": "pyahocorasick" if ahocorasick is not None else "python",
+            "loadErrors": len(self.load_errors)
+        }
+
+
+class SpanRuleRecorder:
+    """trace 캐시가 새 snapshot을 읽으면 규칙을 적용해 결과를 snapshot에 함께 캐시합니다.
+
+    탐지 수는 같은 인덱스의 이전 snapshot 최고 수위(startTime) 이후의 span만 셉니다.
+    """
+
+    def __init__(self, engine: RuleEngine):
+        self.engine = engine
+        self.watermarks: Dict[str, int] = {}
+
+    def __call__(self, snapshot):
+        store = snapshot.store
+        if len(store) == 0:
+            return
+        watermark = self.watermarks.get(snapshot.index_name, -1)
+        snapshot.derived(self.engine.matches_key,
+                         lambda store: self.engine.evaluate_store(store, store.start_time > watermark))
+        self.watermarks[snapshot.index_name] = max(watermark, int(store.start_time.max()))
+
+
+class _Compiler:
+    """Sigma detection을 atom과 condition 트리로 바꿉니다. atom 번호는 규칙 전체에서 공유합니다."""
+
+    def __init__(self, cache_size: int):
+        self.cache_size = cache_size
+        self.matchers: Dict[str, _FieldMatcher] = {}
+        self.atom_count = 0
+        self._atoms: Dict[Tuple, int] = {}
+
+    def compile(self, document: Dict, path: str) -> SigmaRule:
+        rule = SigmaRule(document, path)
+        detection = document.get('detection')
+        if not isinstance(detection, dict) or 'condition' not in detection:
+            raise SigmaRuleError("detection.condition이 없습니다.")
+        if 'timeframe' in detection:
+            raise SigmaRuleError("timeframe 집계 규칙은 지원하지 않습니다.")
+
+        searches = {name: self._search(value) for name, value in detection.items() if name != 'condition'}
+        conditions = detection['condition']
+        if isinstance(conditions, str):
+            conditions = [conditions]
+        nodes = [_ConditionParser(text, searches).parse() for text in conditions]
+        condition = nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+        event_id = CATEGORY_EVENT_IDS.get(rule.logsource.get('category'))
+        if event_id is not None and rule.targets == ("trace",):
+            condition = ("and", [("atom", self._atom("EventID", "exact", event_id)), condition])
+
+        rule.condition = condition
+        rule.atoms = sorted(_atoms(condition))
+        rule.always_candidate = _evaluate(condition, {}, 1) is not None
+        return rule
+
+    def _search(self, value):
+        if isinstance(value, dict):
+            return ("and", [self._field(key, values) for key, values in value.items()]) if value else ("const", True)
+        if isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+            return ("or", [self._search(item) for item in value])
+        raise SigmaRuleError("키워드 검색(필드 없는 값 목록)은 지원하지 않습니다.")
+
+    def _field(self, key: str, values):
+        field, *modifiers = key.split('|')
+        match_all = 'all' in modifiers
+        modifiers = [modifier for modifier in modifiers if modifier != 'all']
+        if not isinstance(values, list):
+            values = [values]
+
+        if modifiers and modifiers[0] == 'exists':
+            exists = values[0] in (True, 'true')
+            null = ("atom", self._atom(field, "null", None))
+            return ("not", null) if exists else null
+
+        nodes = [self._value(field, modifiers, value) for value in values]
+        if len(nodes) == 1:
+            return nodes[0]
+        return ("and" if match_all else "or", nodes)
+
+    def _value(self, field: str, modifiers: List[str], value):
+        if value is None:
+            return ("atom", self._atom(field, "null", None))
+        if modifiers and modifiers[0] == 're':
+            flags = 0
+            for flag in modifiers[1:]:
+                if flag not in ('i', 'm', 's'):
+                    raise SigmaRuleError(f"지원하지 않는 re 플래그: {flag}")
+                flags |= {'i': re.IGNORECASE, 'm': re.MULTILINE, 's': re.DOTALL}[flag]
+            return ("atom", self._atom(field, "re", re.compile(str(value), flags), (str(value), flags)))
+        if modifiers == ['cidr']:
+            try:
+                network = ipaddress.ip_network(str(value), strict=False)
+            except ValueError as e:
+                raise SigmaRuleError(str(e))
+            return ("atom", self._atom(field, "cidr", network, str(network)))
+        if len(modifiers) == 1 and modifiers[0] in COMPARE_MODIFIERS:
+            return ("atom", self._atom(field, modifiers[0], float(value)))
+        if len(modifiers) > 1 or (modifiers and modifiers[0] not in SEARCH_MODIFIERS):
+            raise SigmaRuleError(f"지원하지 않는 modifier: {field}|{'|'.join(modifiers)}")
+
+        # 와일드카드(*, ?)를 포함한 glob으로 바꾼 뒤 가장 싼 검사 방식으로 분류합니다.
+        parts = _wildcard_parts(str(value).lower())
+        modifier = modifiers[0] if modifiers else None
+        if modifier in ('contains', 'endswith'):
+            parts.insert(0, '*')
+        if modifier in ('contains', 'startswith'):
+            parts.append('*')
+        literal = ''.join(part for part in parts if part not in ('*', '?'))
+        wildcards = [part for part in parts if part in ('*', '?')]
+        if not wildcards:
+            kind = "exact"
+        elif literal and len(parts) == 3 and parts[0] == '*' and parts[2] == '*':
+            kind = "contains"
+        elif literal and len(parts) == 2 and parts[0] == '*' and parts[1] not in ('*', '?'):
+            kind = "endswith"
+        elif literal and len(parts) == 2 and parts[1] == '*' and parts[0] not in ('*', '?'):
+            kind = "startswith"
+        else:
+            pattern = ''.join('.*' if part == '*' else '.' if part == '?' else re.escape(part) for part in parts)
+            regex = re.compile(f'^{pattern}$', re.IGNORECASE | re.DOTALL)
+            return ("atom", self._atom(field, "re", regex, (pattern, 'glob')))
+        return ("atom", self._atom(field, kind, literal))
+
+    def _atom(self, field: str, kind: str, value, key=None) -> int:
+        identity = (field, kind, key if key is not None else value)
+        atom = self._atoms.get(identity)
+        if atom is None:
+            atom = self._atoms[identity] = self.atom_count
+            self.atom_count += 1
+            matcher = self.matchers.get(field)
+            if matcher is None:
+                matcher = self.matchers[field] = _FieldMatcher(field, self.cache_size)
+            matcher.add(atom, kind, value)
+        return atom
+
+
+def _wildcard_parts(value: str) -> List[str]:
+    """값을 리터럴 조각과 '*', '?' 와일드카드로 나눕니다. \\*, \\?는 리터럴입니다."""
+    parts = []
+    literal = []
+    position = 0
+    while position < len(value):
+        char = value[position]
+        if char == '\\' and position + 1 < len(value) and value[position + 1] in '*?':
+            literal.append(value[position + 1])
+            position += 2
+            continue
+        if char in '*?':
+            if literal:
+                parts.append(''.join(literal))
+                literal = []
+            parts.append(char)
+        else:
+            literal.append(char)
+        position += 1
+    if literal:
+        parts.append(''.join(literal))
+    return parts
+
+
+class _ConditionParser:
+    """condition 문자열(and/or/not/괄호, '1 of', 'all of')을 트리로 파싱합니다."""
+
+    def __init__(self, text: str, searches: Dict):
+        if '|' in text:
+            raise SigmaRuleError("condition의 집계(|)는 지원하지 않습니다.")
+        self.text = text
+        self.searches = searches
+        self.tokens = re.findall(r'\(|\)|[^\s()]+', text)
+        self.position = 0
+
+    def parse(self):
+        node = self._expression()
+        if self.position != len(self.tokens):
+            raise SigmaRuleError(f"condition을 해석할 수 없습니다: {self.text}")
+        return node
+
+    def _peek(self) -> Optional[str]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _next(self) -> str:
+        token = self._peek()
+        if token is None:
+            raise SigmaRuleError(f"condition이 끝났습니다: {self.text}")
+        self.position += 1
+        return token
+
+    def _expression(self):
+        nodes = [self._term()]
+        while (self._peek() or '').lower() == 'or':
+            self._next()
+            nodes.append(self._term())
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def _term(self):
+        nodes = [self._factor()]
+        while (self._peek() or '').lower() == 'and':
+            self._next()
+            nodes.append(self._factor())
+        return nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+    def _factor(self):
+        token = self._next()
+        lowered = token.lower()
+        if lowered == 'not':
+            return ("not", self._factor())
+        if token == '(':
+            node = self._expression()
+            if self._next() != ')':
+                raise SigmaRuleError(f"괄호가 맞지 않습니다: {self.text}")
+            return node
+        if lowered in ('1', 'any', 'all') and (self._peek() or '').lower() == 'of':
+            self._next()
+            target = self._next()
+            if target.lower() == 'them':
+                names = [name for name in self.searches if not name.startswith('_')]
+            else:
+                names = [name for name in self.searches if fnmatch.fnmatchcase(name, target)]
+            if not names:
+                raise SigmaRuleError(f"일치하는 검색 식별자가 없습니다: {target}")
+            nodes = [self.searches[name] for name in names]
+            return nodes[0] if len(nodes) == 1 else ("and" if lowered == 'all' else "or", nodes)
+        if token not in self.searches:
+            raise SigmaRuleError(f"알 수 없는 검색 식별자: {token}")
+        return self.searches[token]
+
+
+def _evaluate(node, masks: Dict[int, np.ndarray], size: int) -> Optional[np.ndarray]:
+    """condition 트리를 마스크로 평가합니다. 모두 거짓이면 배열 대신 None을 반환합니다."""
+    kind = node[0]
+    if kind == "atom":
+        return masks.get(node[1])
+    if kind == "const":
+        return np.ones(size, dtype=bool) if node[1] else None
+    if kind == "not":
+        child = _evaluate(node[1], masks, size)
+        if child is None:
+            return np.ones(size, dtype=bool)
+        result = ~child
+        return result if result.any() else None
+    if kind == "and":
+        result = None
+        for child in node[1]:
+            mask = _evaluate(child, masks, size)
+            if mask is None:
+                return None
+            result = mask if result is None else result & mask
+        return result if result.any() else None
+    result = None
+    for child in node[1]:
+        mask = _evaluate(child, masks, size)
+        if mask is not None:
+            result = mask if result is None else result | mask
+    return result
+
+
+def _atoms(node) -> set:
+    if node[0] == "atom":
+        return {node[1]}
+    if node[0] == "const":
+        return set()
+    if node[0] == "not":
+        return _atoms(node[1])
+    return set().union(*(_atoms(child) for child in node[1]))
+
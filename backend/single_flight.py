@@ -0,0 +1,77 @@
+import asyncio
+from typing import Awaitable, Callable, Dict
+import orjson
+
+# 같은 요청이면 결과가 같은 읽기 메서드
+COALESCED_METHODS = ("search", "count")
+
+
+class SingleFlight:
+    """같은 키로 동시에 들어온 호출이 진행 중인 호출 하나의 결과를 함께 받게 합니다.
+
+    실제 호출은 별도 task로 실행하므로, 먼저 호출한 요청이 취소되어도 기다리는 다른 요청에는
+    영향이 없습니다. 호출이 끝나면 키를 지우므로 결과를 캐시하지는 않습니다.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.calls = 0
+        self.executed = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    async def do(self, key: str, call: Callable[[], Awaitable]):
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.executed += 1
+            task = asyncio.ensure_future(call())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 기다리던 요청이 모두 취소된 경우에도 예외를 회수해 경고가 남지 않게 합니다.
+        if not task.cancelled() and task.exception() is not None:
+            self.errors += 1
+
+    def stats(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "coalescingRatio": round(self.coalesced / self.calls, 4) if self.calls else 0.0,
+            "inFlight": len(self._inflight),
+            "errors": self.errors
+        }
+
+
+class CoalescingClient:
+    """검색 클라이언트의 search/count 호출을 메서드, index, 정규화한 본문(키 정렬) 기준으로 합칩니다.
+
+    합쳐진 호출은 같은 응답 객체를 공유하므로 호출하는 쪽은 응답을 수정하지 않아야 합니다.
+    나머지 속성(indices, index, close 등)은 원래 클라이언트로 그대로 전달합니다.
+    """
+
+    def __init__(self, client, flight: SingleFlight):
+        self._client = client
+        self._flight = flight
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name not in COALESCED_METHODS:
+            return attribute
+
+        async def coalesced(*args, **kwargs):
+            try:
+                key = name + orjson.dumps([args, kwargs], option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS).decode()
+            except TypeError:
+                # 직렬화할 수 없는 인자는 합치지 않습니다.
+                return await attribute(*args, **kwargs)
+            return await self._flight.do(key, lambda: attribute(*args, **kwargs))
+
+        return coalesced
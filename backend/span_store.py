@@ -0,0 +1,335 @@
+import struct
+from heapq import merge
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import orjson
+
+from cmdline import intern_command
+
+# 범주형으로 저장할 태그 (컬럼 이름 -> span 태그 키)
+CATEGORICAL_TAGS = {
+    "event_id": "sysmon.event_id",
+    "image": "Image",
+    "alert": "sigma.alert",
+    "pid": "sysmon.pid",
+    "ppid": "sysmon.ppid"
+}
+
+# 값이 거의 반복되지 않아 문자열 그대로 저장할 태그
+TEXT_TAGS = {
+    "command_line": "CommandLine",
+    "user": "User",
+    "event_name": "EventName",
+    "parent_image": "ParentImage",
+    "parent_command_line": "ParentCommandLine",
+    "target_filename": "TargetFilename"
+}
+
+# 같은 문자열이 많이 반복되어 공용 intern 표로 보관할 텍스트 컬럼
+INTERNED_COLUMNS = ("command_line", "parent_command_line")
+
+_TAG_COLUMNS = {key: column for column, key in {**CATEGORICAL_TAGS, **TEXT_TAGS}.items()}
+
+# span 또는 Jaeger process에서 호스트 이름을 찾을 태그
+HOST_TAGS = ("host.name", "hostname", "Computer")
+
+MISSING = -1
+
+# SpanStore의 범주형 컬럼과 배열 컬럼 이름
+CATEGORICAL_COLUMNS = ("operation", "trace", "host", *CATEGORICAL_TAGS)
+ARRAY_COLUMNS = ("span_id", "start_time", "duration", "error", *TEXT_TAGS)
+
+
+class Categorical:
+    """값을 정수 코드로 저장하는 컬럼입니다. 태그가 없으면 코드는 -1입니다."""
+
+    def __init__(self, codes: np.ndarray, categories: List):
+        self.codes = codes
+        self.categories = categories
+        self._index = {value: code for code, value in enumerate(categories)}
+
+    def code(self, value) -> int:
+        return self._index.get(value, MISSING)
+
+    def isin(self, values) -> np.ndarray:
+        """values 중 하나와 같은 행의 마스크를 반환합니다."""
+        codes = [self._index[v] for v in values if v in self._index]
+        return np.isin(self.codes, codes)
+
+    def equals(self, value) -> np.ndarray:
+        code = self._index.get(value)
+        if code is None:
+            return np.zeros(len(self.codes), dtype=bool)
+        return self.codes == code
+
+    def present(self) -> np.ndarray:
+        return self.codes != MISSING
+
+    def value(self, row: int, default=''):
+        code = self.codes[row]
+        return default if code == MISSING else self.categories[code]
+
+
+class SpanStore:
+    """span을 한 번만 디코딩해 컬럼 단위 NumPy 배열로 보관합니다.
+
+    엔드포인트는 span별 dict를 만들지 않고 마스크와 group-by로 계산하며,
+    응답에 필요한 행만 dict로 변환합니다.
+    """
+
+    def __init__(self, columns: Dict):
+        self.span_id: np.ndarray = columns["span_id"]
+        self.operation: Categorical = columns["operation"]
+        self.start_time: np.ndarray = columns["start_time"]
+        self.duration: np.ndarray = columns["duration"]
+        self.error: np.ndarray = columns["error"]
+        self.event_id: Categorical = columns["event_id"]
+        self.image: Categorical = columns["image"]
+        self.alert: Categorical = columns["alert"]
+        self.pid: Categorical = columns["pid"]
+        self.ppid: Categorical = columns["ppid"]
+        self.command_line: np.ndarray = columns["command_line"]
+        self.user: np.ndarray = columns["user"]
+        self.event_name: np.ndarray = columns["event_name"]
+        self.parent_image: np.ndarray = columns["parent_image"]
+        self.parent_command_line: np.ndarray = columns["parent_command_line"]
+        self.target_filename: np.ndarray = columns["target_filename"]
+        self.trace: Categorical = columns["trace"]
+        self.host: Categorical = columns["host"]
+
+    def __len__(self):
+        return len(self.start_time)
+
+    def alert_types(self, mask: Optional[np.ndarray] = None) -> List:
+        """발생한 sigma.alert 종류를 처음 등장한 순서대로 반환합니다."""
+        present = self.alert.present()
+        codes = self.alert.codes[present if mask is None else present & mask]
+        unique, first = np.unique(codes, return_index=True)
+        return [self.alert.categories[code] for code in unique[np.argsort(first)]]
+
+    def last_per_pid(self, mask: np.ndarray) -> np.ndarray:
+        """mask에 해당하는 행 중 PID별 마지막 행을, PID가 처음 등장한 순서로 반환합니다."""
+        rows = np.flatnonzero(mask)
+        if len(rows) == 0:
+            return rows
+        pids = self.pid.codes[rows]
+        unique, first = np.unique(pids, return_index=True)
+        _, last_reversed = np.unique(pids[::-1], return_index=True)
+        last = len(pids) - 1 - last_reversed
+        return rows[last[np.argsort(first)]]
+
+    def sorted_rows(self, mask: np.ndarray) -> np.ndarray:
+        """mask에 해당하는 행을 startTime 순(동점이면 원래 순서)으로 반환합니다."""
+        rows = np.flatnonzero(mask)
+        return rows[np.argsort(self.start_time[rows], kind='stable')]
+
+    def filter_mask(self, trace_ids: Iterable = None, hosts: Iterable = None,
+                    start: Optional[int] = None, end: Optional[int] = None) -> Optional[np.ndarray]:
+        """traceID/호스트/startTime 범위 조건의 마스크를 반환합니다. 조건이 없으면 None입니다."""
+        mask = None
+        conditions = []
+        if trace_ids:
+            conditions.append(self.trace.isin(trace_ids))
+        if hosts:
+            conditions.append(self.host.isin(hosts))
+        if start is not None:
+            conditions.append(self.start_time >= start)
+        if end is not None:
+            conditions.append(self.start_time <= end)
+        for condition in conditions:
+            mask = condition if mask is None else mask & condition
+        return mask
+
+    def after_watermarks(self, watermarks: Dict[str, int], default: int = -1) -> np.ndarray:
+        """trace별 최고 수위(startTime, traceID -> 값) 이후인 span의 마스크입니다. 처음 보는 trace는 default 이후입니다."""
+        marks = np.array([watermarks.get(trace_id, default) for trace_id in self.trace.categories]
+                         + [watermarks.get('', default)], dtype=np.int64)
+        return self.start_time > marks[self.trace.codes]  # MISSING(-1) -> 마지막 값
+
+    def advance_watermarks(self, rows: np.ndarray, watermarks: Dict[str, int]):
+        """rows의 trace별 최대 startTime으로 watermarks를 올립니다."""
+        if len(rows) == 0:
+            return
+        newest = np.full(len(self.trace.categories) + 1, -1, dtype=np.int64)
+        np.maximum.at(newest, self.trace.codes[rows], self.start_time[rows])
+        names = [*self.trace.categories, '']
+        for code in np.flatnonzero(newest >= 0).tolist():
+            watermarks[names[code]] = max(watermarks.get(names[code], -1), int(newest[code]))
+
+    def partition(self, rows: np.ndarray) -> List[np.ndarray]:
+        """rows를 trace별로 나눕니다. 각 trace 안에서는 rows의 순서를 유지합니다."""
+        codes = self.trace.codes[rows]
+        order = np.argsort(codes, kind='stable')
+        rows, codes = rows[order], codes[order]
+        return np.split(rows, np.flatnonzero(np.diff(codes)) + 1) if len(rows) else []
+
+    def merge_by_time(self, groups: List[np.ndarray]) -> np.ndarray:
+        """trace별 행 목록을 각 목록의 순서를 유지하면서 startTime 기준으로 병합합니다."""
+        if len(groups) <= 1:
+            return groups[0] if groups else np.array([], dtype=np.int64)
+        start_time = self.start_time
+        merged = merge(*(group.tolist() for group in groups), key=lambda row: start_time[row])
+        return np.fromiter(merged, dtype=np.int64, count=sum(len(group) for group in groups))
+
+
+class SpanStoreBuilder:
+    """검색 결과 페이지를 받아 SpanStore를 만듭니다."""
+
+    def __init__(self):
+        self._span_id = []
+        self._start_time = []
+        self._duration = []
+        self._error = []
+        self._operation = _CategoryEncoder()
+        self._categorical = {column: _CategoryEncoder() for column in CATEGORICAL_TAGS}
+        self._text = {column: [] for column in TEXT_TAGS}
+        self._trace = _CategoryEncoder()
+        self._host = _CategoryEncoder()
+
+    def add_span(self, span: Dict, trace_id: str = '', host: str = ''):
+        """span 하나의 태그를 필요한 컬럼에만 디코딩합니다. span에 호스트 태그가 없으면 host를 씁니다."""
+        self._span_id.append(span.get('spanID', ''))
+        self._operation.add(span.get('operationName', ''))
+        self._start_time.append(span.get('startTime', 0))
+        self._duration.append(span.get('duration', 0))
+
+        values = {}
+        error = False
+        for tag in span.get('tags', []):
+            key = tag['key']
+            column = _TAG_COLUMNS.get(key)
+            if column is not None:
+                values[column] = tag['value']
+            elif key == 'error':
+                error = tag['value'] == True
+            elif key in HOST_TAGS:
+                host = tag['value']
+        self._error.append(error)
+        self._trace.add(trace_id)
+        self._host.add(host)
+
+        for column, encoder in self._categorical.items():
+            encoder.add(values.get(column, _CategoryEncoder.ABSENT))
+        for column, texts in self._text.items():
+            value = values.get(column, '')
+            texts.append(intern_command(value) if column in INTERNED_COLUMNS else value)
+
+    def build(self) -> SpanStore:
+        columns = {
+            "span_id": np.array(self._span_id, dtype=object),
+            "operation": self._operation.build(),
+            "start_time": np.array(self._start_time, dtype=np.int64),
+            "duration": np.array(self._duration, dtype=np.int64),
+            "error": np.array(self._error, dtype=bool),
+            "trace": self._trace.build(),
+            "host": self._host.build()
+        }
+        for column, encoder in self._categorical.items():
+            columns[column] = encoder.build()
+        for column, texts in self._text.items():
+            columns[column] = np.array(texts, dtype=object)
+        return SpanStore(columns)
+
+
+def concat_stores(stores: List[SpanStore]) -> SpanStore:
+    """여러 SpanStore를 순서대로 이어 붙입니다. 범주형 컬럼은 범주 목록을 합쳐 코드를 다시 매깁니다."""
+    if not stores:
+        return SpanStoreBuilder().build()
+    if len(stores) == 1:
+        return stores[0]
+    columns = {name: np.concatenate([getattr(store, name) for store in stores]) for name in ARRAY_COLUMNS}
+    for name in CATEGORICAL_COLUMNS:
+        index: Dict = {}
+        parts = []
+        for store in stores:
+            column = getattr(store, name)
+            # 마지막 원소는 MISSING(-1) 코드를 그대로 유지합니다.
+            mapping = np.array([index.setdefault(value, len(index)) for value in column.categories] + [MISSING],
+                               dtype=np.int32)
+            parts.append(mapping[column.codes])
+        dtype = np.int16 if len(index) < 2 ** 15 else np.int32
+        columns[name] = Categorical(np.concatenate(parts).astype(dtype), list(index))
+    return SpanStore(columns)
+
+
+def encode_store(store: SpanStore, meta: Dict = None) -> bytes:
+    """SpanStore를 워커 사이에 공유할 바이트열로 만듭니다 (pickle 없이 헤더 JSON + 컬럼 버퍼).
+
+    숫자 컬럼과 범주형 코드는 배열 메모리를 그대로, 문자열 컬럼은 JSON 배열로 씁니다.
+    """
+    header = {"meta": meta or {}, "rows": len(store), "columns": {}}
+    buffers = []
+    offset = 0
+    for name in (*ARRAY_COLUMNS, *CATEGORICAL_COLUMNS):
+        column = getattr(store, name)
+        info = {}
+        if isinstance(column, Categorical):
+            info["categories"] = column.categories
+            column = column.codes
+        if column.dtype == object:
+            data = orjson.dumps(column.tolist())
+        else:
+            data = column.tobytes()
+            info["dtype"] = column.dtype.str
+        header["columns"][name] = {"offset": offset, "length": len(data), **info}
+        buffers.append(data)
+        offset += len(data)
+    head = orjson.dumps(header)
+    return b"".join([struct.pack("<I", len(head)), head, *buffers])
+
+
+def decode_store(data: bytes) -> Tuple[SpanStore, Dict]:
+    """encode_store의 결과에서 (SpanStore, meta)를 복원합니다."""
+    (head_size,) = struct.unpack_from("<I", data)
+    header = orjson.loads(data[4:4 + head_size])
+    body = memoryview(data)[4 + head_size:]
+    columns = {}
+    for name, info in header["columns"].items():
+        chunk = body[info["offset"]:info["offset"] + info["length"]]
+        if "dtype" in info:
+            values = np.frombuffer(chunk, dtype=info["dtype"]).copy()
+        else:
+            texts = orjson.loads(chunk)
+            if name in INTERNED_COLUMNS:
+                texts = [intern_command(text) for text in texts]
+            values = np.empty(len(texts), dtype=object)
+            values[:] = texts
+        columns[name] = Categorical(values, info["categories"]) if "categories" in info else values
+    return SpanStore(columns), header["meta"]
+
+
+def process_hosts(processes: Dict) -> Dict[str, str]:
+    """Jaeger trace의 processes 항목에서 processID별 호스트 이름을 찾습니다."""
+    hosts = {}
+    for process_id, process in (processes or {}).items():
+        for tag in process.get('tags', []):
+            if tag.get('key') in HOST_TAGS:
+                hosts[process_id] = tag['value']
+                break
+    return hosts
+
+
+class _CategoryEncoder:
+    ABSENT = object()
+
+    def __init__(self):
+        self._codes = []
+        self._index = {}
+
+    def add(self, value):
+        if value is _CategoryEncoder.ABSENT:
+            self._codes.append(MISSING)
+            return
+        try:
+            code = self._index.get(value)
+        except TypeError:
+            value = str(value)
+            code = self._index.get(value)
+        if code is None:
+            code = self._index[value] = len(self._index)
+        self._codes.append(code)
+
+    def build(self) -> Categorical:
+        dtype = np.int16 if len(self._index) < 2 ** 15 else np.int32
+        return Categorical(np.array(self._codes, dtype=dtype), list(self._index))
+
@@ -0,0 +1,311 @@
+import bisect
+import logging
+import os
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+import numpy as np
+
+from span_store import SpanStore
+
+logger = logging.getLogger(__name__)
+
+
+class Action(NamedTuple):
+    """타임라인 행 하나(프로세스 시작 또는 종료)입니다. 추출할 때 span 값을 복사해 snapshot과 무관하게 보관합니다."""
+    timestamp: int
+    trace_id: str
+    host: str
+    span_id: str
+    operation: str
+    event_id: str
+    image: str
+    alert: str
+    pid: str
+    ppid: str
+    command_line: str
+    user: str
+    duration: int
+    event_name: str
+    start: bool
+    session: int
+
+
+class ActionSession:
+    """한 프로세스의 시작부터 종료까지입니다. 종료 이벤트가 아직 없으면 stop은 None입니다."""
+
+    __slots__ = ("id", "trace_id", "host", "pid", "ppid", "image", "command_line", "user",
+                 "start", "stop", "parent", "children")
+
+    def __init__(self, session_id: int, action: Action, parent: Optional[int]):
+        self.id = session_id
+        self.trace_id = action.trace_id
+        self.host = action.host
+        self.pid = action.pid
+        self.ppid = action.ppid
+        self.image = action.image
+        self.command_line = action.command_line
+        self.user = action.user
+        self.start = action.timestamp
+        self.stop: Optional[int] = None
+        self.parent = parent
+        self.children: List[int] = []
+
+    @property
+    def duration(self) -> Optional[int]:
+        return self.stop - self.start if self.stop is not None else None
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "traceID": self.trace_id,
+            "host": self.host,
+            "pid": self.pid,
+            "parentPid": self.ppid,
+            "image": self.image,
+            "commandLine": self.command_line,
+            "user": self.user,
+            "start": self.start,
+            "stop": self.stop,
+            "duration": self.duration,
+            "running": self.stop is None,
+            "parentId": self.parent,
+            "children": list(self.children)
+        }
+
+
+def _event_ids(name: str, default: str) -> Tuple[str, ...]:
+    return tuple(value.strip() for value in os.getenv(name, default).split(',') if value.strip())
+
+
+def dedup_process_events(pids: Sequence[str], is_start: np.ndarray,
+                         running: Optional[Iterable[str]] = None) -> Tuple[np.ndarray, set]:
+    """시간순 프로세스 시작/종료 이벤트에서 PID별 실행 상태를 추적해 남길 위치를 반환합니다.
+
+    running은 이전 호출이 끝났을 때 실행 중이던 PID이며, 갱신된 집합을 함께 반환합니다.
+    PID가 없는('') 이벤트는 건너뜁니다.
+    """
+    keep = []
+    running = set(running or ())
+    for position, (pid, start) in enumerate(zip(pids, is_start.tolist())):
+        if not pid:
+            continue
+        if start:  # 프로세스 시작
+            if pid not in running:
+                keep.append(position)
+                running.add(pid)
+        elif pid in running:  # 프로세스 종료
+            keep.append(position)
+            running.discard(pid)
+    return np.array(keep, dtype=np.int64), running
+
+
+class TimelineEngine:
+    """trace 캐시 listener로 동작하며 프로세스 시작/종료 이벤트를 사용자 행동과 세션으로 누적합니다.
+
+    trace마다 지금까지 처리한 최고 startTime(워터마크)을 기억해 새 snapshot에서는 그 이후의
+    이벤트만 정렬하고, PID 실행 상태는 호출 사이에 유지합니다. 행동은 startTime 순 리스트로
+    보관해 시간 범위를 bisect로 찾습니다. 워터마크보다 늦게 도착한 과거 span은 반영하지 않습니다.
+    """
+
+    def __init__(self, start_events: Iterable[str] = None, stop_events: Iterable[str] = None,
+                 max_actions: int = None):
+        # 기본값은 Sysmon Event ID 1(프로세스 생성)과 5(프로세스 종료)입니다.
+        self.start_events = tuple(start_events or _event_ids('TIMELINE_START_EVENTS', '1'))
+        self.stop_events = tuple(stop_events or _event_ids('TIMELINE_STOP_EVENTS', '5'))
+        self.max_actions = max_actions or int(os.getenv('TIMELINE_MAX_ACTIONS', '200000'))
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """누적한 행동, 세션, 워터마크를 모두 지웁니다."""
+        with self._lock:
+            self.watermarks: Dict[str, int] = {}
+            self._running: Dict[str, Dict[str, ActionSession]] = {}
+            self._times: List[int] = []
+            self._actions: List[Action] = []
+            self._session_starts: List[int] = []
+            self._sessions: List[ActionSession] = []
+            self._by_id: Dict[int, ActionSession] = {}
+            self._next_session = 0
+            self._doc_count: Optional[int] = None
+            self.updates = 0
+            self.processed = 0
+
+    @property
+    def version(self) -> Tuple[int, int]:
+        """cursor가 확인하는 버전입니다. 행동이 추가될 때마다 바뀝니다."""
+        return (self.updates, len(self._actions))
+
+    def __call__(self, snapshot):
+        self.update(snapshot.store, snapshot.version)
+
+    def update(self, store: SpanStore, version: Optional[Tuple] = None) -> int:
+        """워터마크 이후의 시작/종료 이벤트를 처리하고 새로 추가한 행동 수를 반환합니다.
+
+        인덱스 문서 수가 줄었으면(재적재 등) 처음부터 다시 만듭니다.
+        """
+        if version and self._doc_count is not None and version[0] < self._doc_count:
+            self.reset()
+        if version:
+            self._doc_count = version[0]
+        if len(store) == 0:
+            return 0
+
+        marks = np.array([self.watermarks.get(trace_id, -1) for trace_id in store.trace.categories],
+                         dtype=np.int64)
+        new = (store.event_id.isin(self.start_events + self.stop_events)
+               & (store.start_time > marks[store.trace.codes]))
+        rows = store.sorted_rows(new)
+        if len(rows) == 0:
+            return 0
+
+        # PID는 호스트마다 따로이므로 trace별로 나눠 상태를 추적하고 시간순으로 병합합니다.
+        # 상태 머신은 이벤트마다 집합 연산 몇 번이라 작업 프로세스로 보내면 전송 비용이 더 큽니다.
+        pids = np.array(list(store.pid.categories) + [''], dtype=object)[store.pid.codes]  # MISSING(-1) -> ''
+        is_start = store.event_id.isin(self.start_events)
+        groups = store.partition(rows)
+        trace_ids = [store.trace.value(int(group[0])) for group in groups]
+        results = [dedup_process_events(pids[group].tolist(), is_start[group], self._running.get(trace_id, ()))
+                   for group, trace_id in zip(groups, trace_ids)]
+        kept = store.merge_by_time([group[positions] for group, (positions, _) in zip(groups, results)])
+
+        columns = self._columns(store, kept, is_start)
+        with self._lock:
+            added = [self._apply(*values) for values in zip(*columns)]
+            for group, trace_id in zip(groups, trace_ids):
+                self.watermarks[trace_id] = max(self.watermarks.get(trace_id, -1),
+                                                int(store.start_time[group[-1]]))
+            self.processed += len(rows)
+            self.updates += 1
+            self._trim()
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("타임라인 갱신", extra={
+                "events": len(rows),
+                "traces": len(groups),
+                "actions": len(added),
+                "totalActions": len(self._actions),
+                "running": sum(len(running) for running in self._running.values())
+            })
+        return len(added)
+
+    def actions(self, start: Optional[int] = None, end: Optional[int] = None,
+                trace_ids: Iterable[str] = None, hosts: Iterable[str] = None) -> List[Action]:
+        """[start, end] (startTime, 마이크로초) 범위의 행동을 시간순으로 반환합니다."""
+        with self._lock:
+            low, high = self._window(self._times, start, end)
+            selected = self._actions[low:high]
+        return self._filter(selected, trace_ids, hosts)
+
+    def sessions(self, start: Optional[int] = None, end: Optional[int] = None,
+                 trace_ids: Iterable[str] = None, hosts: Iterable[str] = None,
+                 running: Optional[bool] = None) -> List[ActionSession]:
+        """[start, end] 범위에서 시작한 세션을 시작 순으로 반환합니다. running으로 실행 중 여부를 고릅니다."""
+        with self._lock:
+            low, high = self._window(self._session_starts, start, end)
+            selected = self._sessions[low:high]
+        selected = self._filter(selected, trace_ids, hosts)
+        if running is not None:
+            selected = [session for session in selected if (session.stop is None) == running]
+        return selected
+
+    def session(self, session_id: int) -> Optional[ActionSession]:
+        return self._by_id.get(session_id)
+
+    def stats(self) -> Dict:
+        return {
+            "actions": len(self._actions),
+            "sessions": len(self._sessions),
+            "running": sum(len(running) for running in self._running.values()),
+            "traces": len(self.watermarks),
+            "processedEvents": self.processed,
+            "updates": self.updates
+        }
+
+    @staticmethod
+    def _window(times: List[int], start: Optional[int], end: Optional[int]) -> Tuple[int, int]:
+        low = bisect.bisect_left(times, start) if start is not None else 0
+        high = bisect.bisect_right(times, end) if end is not None else len(times)
+        return low, max(low, high)
+
+    @staticmethod
+    def _filter(items: List, trace_ids: Iterable[str], hosts: Iterable[str]) -> List:
+        if trace_ids:
+            trace_ids = set(trace_ids)
+            items = [item for item in items if item.trace_id in trace_ids]
+        if hosts:
+            hosts = set(hosts)
+            items = [item for item in items if item.host in hosts]
+        return items
+
+    @staticmethod
+    def _columns(store: SpanStore, rows: np.ndarray, is_start: np.ndarray) -> List[List]:
+        """rows의 Action 필드(session 제외)를 컬럼별 리스트로 한 번에 꺼냅니다."""
+        def categorical(column, default=''):
+            return np.array(list(column.categories) + [default], dtype=object)[column.codes[rows]].tolist()
+
+        return [
+            store.start_time[rows].tolist(),
+            categorical(store.trace),
+            categorical(store.host),
+            store.span_id[rows].tolist(),
+            categorical(store.operation),
+            categorical(store.event_id, 'unknown'),
+            categorical(store.image),
+            categorical(store.alert),
+            categorical(store.pid),
+            categorical(store.ppid),
+            store.command_line[rows].tolist(),
+            store.user[rows].tolist(),
+            store.duration[rows].tolist(),
+            store.event_name[rows].tolist(),
+            is_start[rows].tolist()
+        ]
+
+    def _apply(self, *values) -> Action:
+        trace_id, pid, start = values[1], values[8], values[14]
+        running = self._running.setdefault(trace_id, {})
+        if start:
+            session_id = self._next_session
+            self._next_session += 1
+        else:
+            session_id = running[pid].id
+        action = Action(*values, session_id)
+        if start:
+            parent = running.get(action.ppid)
+            session = ActionSession(session_id, action, parent.id if parent is not None else None)
+            if parent is not None:
+                parent.children.append(session_id)
+            running[pid] = session
+            self._by_id[session_id] = session
+            self._insert(self._session_starts, self._sessions, session.start, session)
+        else:
+            running.pop(pid).stop = action.timestamp
+        self._insert(self._times, self._actions, action.timestamp, action)
+        return action
+
+    @staticmethod
+    def _insert(times: List[int], items: List, timestamp: int, item):
+        # 보통은 맨 뒤에 붙고, 다른 trace보다 늦게 들어온 경우에만 중간에 끼워 넣습니다.
+        if not times or timestamp >= times[-1]:
+            times.append(timestamp)
+            items.append(item)
+        else:
+            position = bisect.bisect_right(times, timestamp)
+            times.insert(position, timestamp)
+            items.insert(position, item)
+
+    def _trim(self):
+        """행동 수가 max_actions를 10% 넘으면 오래된 행동과 종료된 세션을 지웁니다."""
+        excess = len(self._actions) - self.max_actions
+        if excess <= self.max_actions // 10:
+            return
+        del self._times[:excess]
+        del self._actions[:excess]
+        cutoff = self._times[0] if self._times else 0
+        kept = [session for session in self._sessions if session.stop is None or session.start >= cutoff]
+        for session in self._sessions:
+            if session.stop is not None and session.start < cutoff:
+                del self._by_id[session.id]
+        self._sessions = kept
+        self._session_starts = [session.start for session in kept]
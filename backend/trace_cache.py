@@ -0,0 +1,188 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+from span_store import SpanStore, SpanStoreBuilder, decode_store, encode_store, process_hosts
+from instrumentation import timed
+
+
+class TraceSnapshot:
+    """인덱스의 모든 trace 문서를 한 번 가져와 컬럼 형태로 디코딩한 결과입니다."""
+
+    def __init__(self, index_name: str, version: Optional[Tuple]):
+        self.index_name = index_name
+        self.version = version
+        self.trace_ids: List[str] = []
+        self.store: Optional[SpanStore] = None
+        self.loaded_at = time.time()
+        self.checked_at = time.monotonic()
+        self._builder = SpanStoreBuilder()
+        self._derived: Dict = {}
+        self._derived_lock = threading.Lock()
+
+    @property
+    def trace_id(self) -> str:
+        return self.trace_ids[0] if self.trace_ids else ''
+
+    def add_batch(self, hits: List[Dict]):
+        """검색 결과 한 페이지의 span을 디코딩해 추가합니다."""
+        for hit in hits:
+            source = hit['_source']
+            trace_id = source.get('traceID', '')
+            hosts = process_hosts(source.get('processes'))
+            self.trace_ids.append(trace_id)
+            for span in source.get('spans', []):
+                self._builder.add_span(span, trace_id, hosts.get(span.get('processID'), ''))
+
+    def finish(self):
+        """모든 페이지를 추가한 뒤 컬럼 배열을 만듭니다."""
+        self.store = self._builder.build()
+        self._builder = None
+
+    def derived(self, name: str, factory):
+        """snapshot에서 파생된 인덱스(프로세스 트리 등)를 한 번만 만들어 함께 캐시합니다."""
+        with self._derived_lock:
+            value = self._derived.get(name)
+            if value is None:
+                value = self._derived[name] = factory(self.store)
+            return value
+
+    def __len__(self):
+        return len(self.store) if self.store is not None else 0
+
+    def encode(self) -> bytes:
+        return encode_store(self.store, {"traceIDs": self.trace_ids})
+
+    @classmethod
+    def decode(cls, data: bytes, index_name: str, version: Optional[Tuple]) -> "TraceSnapshot":
+        snapshot = cls(index_name, version)
+        snapshot.store, meta = decode_store(data)
+        snapshot.trace_ids = meta["traceIDs"]
+        snapshot._builder = None
+        return snapshot
+
+
+class TraceCache:
+    """trace 엔드포인트들이 공유하는 파싱 결과 캐시입니다.
+
+    항목은 TTL이 지나면 만료되고, 항목 수와 전체 span 수 한도를 넘으면
+    가장 오래 사용하지 않은 항목부터 제거됩니다. 인덱스의 문서 수나
+    `_seq_no`가 바뀌면 다시 가져옵니다. shared(SharedCache)를 주면 같은 버전의 snapshot을
+    다른 워커 프로세스와 나눠 써서 클러스터에서 한 번만 가져옵니다.
+    """
+
+    def __init__(self, analyzer, ttl: float = None, max_entries: int = None,
+                 max_spans: int = None, check_interval: float = None, batch_size: int = None,
+                 shared=None):
+        self.analyzer = analyzer
+        self.shared = shared
+        self.ttl = ttl if ttl is not None else float(os.getenv('TRACE_CACHE_TTL', '300'))
+        self.max_entries = max_entries or int(os.getenv('TRACE_CACHE_MAX_ENTRIES', '8'))
+        self.max_spans = max_spans or int(os.getenv('TRACE_CACHE_MAX_SPANS', '2000000'))
+        self.check_interval = (check_interval if check_interval is not None
+                               else float(os.getenv('TRACE_CACHE_CHECK_INTERVAL', '2')))
+        self.batch_size = batch_size or int(os.getenv('TRACE_CACHE_BATCH_SIZE', '50'))
+        self._entries: "OrderedDict[str, TraceSnapshot]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._listeners: List[Callable[[TraceSnapshot], None]] = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, index_name: str) -> Optional[TraceSnapshot]:
+        """캐시된 snapshot을 반환하고, 없거나 오래되었으면 새로 가져옵니다."""
+        # 같은 인덱스를 동시에 요청해도 한 번만 가져오도록 인덱스별 잠금을 사용합니다.
+        lock = self._locks.setdefault(index_name, asyncio.Lock())
+        async with lock:
+            snapshot = self._entries.get(index_name)
+            if snapshot is not None and await self._is_fresh(snapshot):
+                self._entries.move_to_end(index_name)
+                self.hits += 1
+                return snapshot
+
+            self.misses += 1
+            snapshot = await self._load(index_name)
+            self._entries.pop(index_name, None)
+            if snapshot is not None:
+                self._entries[index_name] = snapshot
+                self._evict()
+            return snapshot
+
+    def add_listener(self, callback: Callable[[TraceSnapshot], None]):
+        """새 snapshot을 읽을 때마다 스레드 풀에서 호출할 함수를 등록합니다."""
+        self._listeners.append(callback)
+
+    def invalidate(self, index_name: str = None):
+        """지정한 인덱스(또는 전체)의 캐시 항목을 제거합니다."""
+        if index_name is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(index_name, None)
+
+    def stats(self) -> Dict:
+        """캐시 적중률과 사용량을 반환합니다."""
+        return {
+            "entries": len(self._entries),
+            "spans": sum(len(s) for s in self._entries.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    async def _is_fresh(self, snapshot: TraceSnapshot) -> bool:
+        if time.time() - snapshot.loaded_at > self.ttl:
+            return False
+        if time.monotonic() - snapshot.checked_at < self.check_interval:
+            return True
+
+        version = await self.analyzer.get_index_version(snapshot.index_name)
+        if version is None or version != snapshot.version:
+            return False
+        snapshot.checked_at = time.monotonic()
+        return True
+
+    async def _load(self, index_name: str) -> Optional[TraceSnapshot]:
+        version = await self.analyzer.get_index_version(index_name)
+        if version is None:
+            return None
+
+        if self.shared is None:
+            snapshot = await self._fetch(index_name, version)
+        else:
+            with timed("shared_snapshot"):
+                snapshot = await self.shared.get_or_compute(
+                    f"trace:{index_name}", repr(version), lambda: self._fetch(index_name, version), self.ttl,
+                    encode=TraceSnapshot.encode,
+                    decode=lambda data: TraceSnapshot.decode(data, index_name, version))
+        if snapshot is None:
+            return None
+
+        loop = asyncio.get_running_loop()
+        for callback in self._listeners:
+            with timed(f"listener.{getattr(callback, '__qualname__', type(callback).__name__)}"):
+                await loop.run_in_executor(None, callback, snapshot)
+        return snapshot
+
+    async def _fetch(self, index_name: str, version: Tuple) -> Optional[TraceSnapshot]:
+        # 모든 trace 문서를 페이지 단위로 읽고, span 디코딩은 이벤트 루프 밖에서 수행합니다.
+        snapshot = TraceSnapshot(index_name, version)
+        loop = asyncio.get_running_loop()
+        async for batch in self.analyzer.iter_batches(index_name, batch_size=self.batch_size,
+                                                      source=["traceID", "spans", "processes"]):
+            with timed("span_decode"):
+                await loop.run_in_executor(None, snapshot.add_batch, batch)
+        if not snapshot.trace_ids:
+            return None
+        with timed("span_build"):
+            await loop.run_in_executor(None, snapshot.finish)
+        return snapshot
+
+    def _evict(self):
+        total_spans = sum(len(s) for s in self._entries.values())
+        while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries or total_spans > self.max_spans):
+            _, evicted = self._entries.popitem(last=False)
+            total_spans -= len(evicted)
+            self.evictions += 1